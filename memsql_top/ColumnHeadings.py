@@ -63,7 +63,8 @@ class ColumnHeadings(urwid.Columns):
             else:
                 columns.append(("weight", meta.display_weight(), contents))
         self.sort_column = column_meta.default_sort_key
-        self.columns[self.sort_column].update_sort_column(True)
+        if self.sort_column is not None:
+            self.columns[self.sort_column].update_sort_column(True)
         super(ColumnHeadings, self).__init__(columns, dividechars=1)
 
     def update_sort_column(self, _, sort_column):
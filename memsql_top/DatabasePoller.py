@@ -18,50 +18,46 @@
 
 from __future__ import absolute_import
 
-import urwid
-
-from attrdict import AttrDict
 from collections import namedtuple
 import os
 import sys
 import threading
 import time
 
-from decimal import Decimal
-
 from .database import connect
+from .heavyhitters import HeavyHitters, MemoryBudget
+from .marks import Mark, GetBaselineModes, DescribeBaseline
+from .pressure import PressureHistory
+from .regression import RegressionDetector
+from .shapes import MAX_FINGERPRINTS, ShapeGrouper
+from .sketches import LatencySketches
 
-def DiffSnapshot(a, b):
-    akeys = set(a.keys())
-    bkeys = set(b.keys())
-
-    assert akeys == bkeys, (akeys - bkeys, bkeys - akeys)
-
-    ret = AttrDict({})
-    for k in akeys:
-        if isinstance(a[k], (int, Decimal)) and k != "run_count" and not b[k] is None:
-            ret[k] = int(a[k] - b[k]) if a[k] >= b[k] else 0
-        else:
-            ret[k] = a[k]
-    return ret
-
+#
+# How often to look for new activities of our own, at most. We only look
+# when activities we have not seen before show up.
+#
+OWN_KEYS_INTERVAL = 30.0
 
 def DiffPlanCache(meta, new_plancache, old_plancache, interval):
+    diff_counters = meta.DiffCounters
+    is_interesting = meta.IsDeltaInteresting
+    normalize = meta.NormalizeCounterDelta
+
     diff_plancache = {}
     for key, n_ent in new_plancache.items():
         delta = n_ent
         if key in old_plancache:
-            o_ent = old_plancache[key]
-            delta = DiffSnapshot(n_ent, o_ent)
+            delta = diff_counters(n_ent, old_plancache[key])
 
-        if meta.IsDeltaInteresting(delta):
-            diff_plancache[key] = meta.NormalizeCounterDelta(delta, interval)
+        if is_interesting(delta):
+            diff_plancache[key] = normalize(delta, interval)
 
     return diff_plancache
 
 
 class DatabasePoller(threading.Thread):
-    def __init__(self, args, column_meta):
+    def __init__(self, args, column_meta, alerts=None, history=None,
+                 query_cache=None):
         try:
             #
             # The connection objects are not thread safe, so create a new
@@ -73,20 +69,229 @@ class DatabasePoller(threading.Thread):
         except Exception as e:
             sys.exit("Unexpected error when connecting to database: %s" % e)
 
+        #
+        # Only the columns of the --columns profile are fetched, plus
+        # whatever alerts and history need. The profile can be changed while
+        # running (see cycle_columns).
+        #
+        self.needed = set()
+        if alerts is not None:
+            self.needed.update(alerts.columns())
+        if history is not None:
+            self.needed.update(history.schema.names)
+        try:
+            column_meta = column_meta.Project(args.columns, self.needed)
+        except ValueError as e:
+            sys.exit("Bad --columns: %s" % e)
+        self.pending_columns = None
+
         self.conn = conn
         self.update_interval = args.update_interval
         self.column_meta = column_meta
-        self.last_read_time = time.time()
-        self.plancache = self.column_meta.GetAllCounterSnapshots(self.conn)
+        self.last_read_time = None
+        self.plancache = None
         self.diff_plancache = dict()
+        self.alerts = alerts
+        self.alerting = frozenset()
+        self.history = history
         self.sum_cpu_util = 0
         self.current_mem = 0
-        super(DatabasePoller, self).__init__()
+        self.pressure = PressureHistory()
+
+        #
+        # Our own activities, as reported by the server, and what they cost
+        # the cluster in the last interval. Unless show_self is set they are
+        # left out of the deltas entirely.
+        #
+        self.show_self = args.show_self
+        self.own_keys = frozenset()
+        self.own_keys_time = None
+        self.overhead = None
+
+        #
+        # With a memory cap, only the heaviest activities are diffed exactly
+        # and the rest are summed up in an "other" row. The per activity
+        # state below is capped to its share of the memory too.
+        #
+        self.hitters = None
+        budget = {}
+        if args.max_memory_mb:
+            budget = MemoryBudget(int(args.max_memory_mb * 1024 * 1024))
+            self.hitters = HeavyHitters(column_meta, budget["hitters"])
+
+        self.sketches = None
+        if column_meta.sketch_columns is not None:
+            self.sketches = LatencySketches(column_meta, time.time(),
+                                            budget.get("sketches"))
+
+        self.regressions = None
+        if column_meta.change_column is not None:
+            self.regressions = RegressionDetector(
+                column_meta, column_meta.change_column, time.time(),
+                budget.get("baselines"))
+
+        #
+        # While grouping, the UI is shown one row per query shape instead of
+        # one per activity; alerts and history are not affected.
+        #
+        self.shapes = ShapeGrouper(
+            column_meta, query_cache,
+            budget.get("fingerprints", MAX_FINGERPRINTS))
+        self.grouping = False
+
+        #
+        # Marks pin a raw snapshot as a baseline. While a baseline is
+        # selected, the UI is shown the deltas since it (or between two
+        # marks) instead of the deltas of the last interval; alerts and
+        # history keep using the latter.
+        #
+        self.marks = []
+        self.baseline = None
+        self.baseline_plancache = None
+        self.baseline_lock = threading.Lock()
+        super(DatabasePoller, self).__init__(name="DatabasePoller")
 
     def get_database_data(self):
-        return self.diff_plancache, self.sum_cpu_util, self.current_mem
+        diff_plancache = self.diff_plancache
+        if self.baseline is not None:
+            diff_plancache = self.baseline_plancache
+        return (diff_plancache, self.sum_cpu_util, self.current_mem,
+                self.alerting)
+
+    def status(self):
+        status = "Showing deltas %s" % DescribeBaseline(self.baseline)
+        if self.column_meta.profile != "all":
+            status += " | columns: %s" % self.column_meta.profile
+        if self.grouping:
+            status += " | grouped by query shape"
+        if self.hitters is not None and self.last_read_time is not None:
+            status += " | %s" % self.hitters.describe(self.update_interval)
+        if self.overhead is not None:
+            status += " | memsql-top: %s" % self.overhead
+        return status
+
+    def update_own_keys(self, new_plancache, new_time):
+        if self.own_keys_time is not None:
+            if new_time - self.own_keys_time < OWN_KEYS_INTERVAL:
+                return
+            # Right after apply_columns there is nothing to compare with.
+            if self.plancache is not None and \
+                    all(k in self.plancache for k in new_plancache):
+                return
+        self.own_keys = self.column_meta.GetOwnActivityKeys(self.conn)
+        self.own_keys_time = new_time
+
+    def split_own(self, diff_plancache):
+        """
+        Returns the deltas of everything but our own activities, and the
+        deltas of our own activities.
+        """
+        own = [diff_plancache[k] for k in self.own_keys if k in diff_plancache]
+        if not own:
+            return diff_plancache, own
+        others = dict((k, v) for k, v in diff_plancache.items()
+                      if k not in self.own_keys)
+        return others, own
+
+    def add_mark(self):
+        plancache, read_time = self.plancache, self.last_read_time
+        if plancache is None:
+            return "Nothing to mark yet."
+        mark = Mark("#%d" % (len(self.marks) + 1), read_time, plancache)
+        self.marks.append(mark)
+        return None
+
+    def cycle_baseline(self):
+        modes = GetBaselineModes(self.marks)
+        with self.baseline_lock:
+            self.baseline = modes[(modes.index(self.baseline) + 1) % len(modes)]
+            self.update_baseline_plancache()
+        return None
+
+    def cycle_columns(self):
+        meta = self.column_meta
+        profiles = list(meta.profiles)
+        i = profiles.index(meta.profile) if meta.profile in profiles else -1
+        self.pending_columns = meta.Project(profiles[(i + 1) % len(profiles)],
+                                            self.needed)
+        return None
+
+    def apply_columns(self):
+        """
+        Switches to the pending columns. Snapshots taken with the old columns
+        can't be diffed against new ones, so this drops the marks and starts
+        over from the next snapshot.
+        """
+        column_meta, self.pending_columns = self.pending_columns, None
+        with self.baseline_lock:
+            self.marks = []
+            self.baseline = None
+            self.baseline_plancache = None
+            self.diff_plancache = dict()
+            self.plancache = None
+            self.shapes.set_columns(column_meta)
+            self.column_meta = column_meta
+
+    def toggle_grouping(self):
+        with self.baseline_lock:
+            self.grouping = not self.grouping
+            self.update_baseline_plancache()
+        return None
+
+    def group_by_shape(self, diff_plancache, new_plancache, old_plancache,
+                       interval):
+        """
+        Groups the deltas of activities by query shape, and returns them
+        with the activities in each group. Rows that are not activities (e.g.
+        the heavy hitters' "other" row) are kept as they are.
+        """
+        keys = [k for k in diff_plancache if k in new_plancache]
+        grouped, members = self.shapes.group(keys, new_plancache,
+                                             old_plancache, interval)
+        if self.sketches is not None:
+            self.sketches.fill_groups(grouped, members)
+
+        # A group has changed as much as its most changed activity.
+        change = self.column_meta.change_column
+        if change is not None:
+            for group, ent in grouped.items():
+                changes = [diff_plancache[k][change] for k in members[group]
+                           if diff_plancache[k][change] is not None]
+                if changes:
+                    ent[change] = max(changes)
+
+        for key, ent in diff_plancache.items():
+            if key not in new_plancache:
+                grouped[key] = ent
+        return grouped, members
+
+    def update_baseline_plancache(self):
+        if self.baseline is None:
+            self.baseline_plancache = None
+            return
+
+        since, until = self.baseline
+        if until is None:
+            new_plancache, new_time = self.plancache, self.last_read_time
+        else:
+            new_plancache, new_time = until.snapshot, until.time
+        baseline_plancache = DiffPlanCache(
+            self.column_meta, new_plancache, since.snapshot,
+            max(new_time - since.time, 1e-3))
+        if not self.show_self:
+            baseline_plancache, _ = self.split_own(baseline_plancache)
+        if self.grouping:
+            baseline_plancache, _ = self.group_by_shape(
+                baseline_plancache, new_plancache, since.snapshot,
+                max(new_time - since.time, 1e-3))
+        self.baseline_plancache = baseline_plancache
 
     def run(self):
+        #
+        # Take the initial snapshot on the poller thread so that it overlaps
+        # with building the UI instead of delaying startup.
+        #
+        self.poll()
         while True:
             time.sleep(self.update_interval)
             self.poll()
@@ -98,14 +303,68 @@ class DatabasePoller(threading.Thread):
         super(DatabasePoller, self).start()
 
     def poll(self):
+        if self.pending_columns is not None:
+            self.apply_columns()
+
         new_time = time.time()
-        new_plancache = self.column_meta.GetAllCounterSnapshots(self.conn)
+        if self.hitters is not None:
+            new_plancache = self.hitters.snapshot(
+                self.column_meta.IterCounterSnapshots(self.conn),
+                self.plancache or {})
+        else:
+            new_plancache = self.column_meta.GetAllCounterSnapshots(self.conn)
+        self.update_own_keys(new_plancache, new_time)
 
-        self.diff_plancache = DiffPlanCache(self.column_meta,
+        if self.plancache is None:
+            # The first snapshot is only the baseline for the next diff.
+            self.last_read_time = new_time
+            self.plancache = new_plancache
+            return
+
+        diff_plancache = DiffPlanCache(self.column_meta,
                                        new_plancache, self.plancache,
                                        new_time - self.last_read_time)
+        if self.hitters is not None:
+            self.hitters.add_other_row(diff_plancache,
+                                       new_time - self.last_read_time)
+        if self.sketches is not None:
+            self.sketches.update(diff_plancache, new_time,
+                                 new_time - self.last_read_time)
+        if self.regressions is not None:
+            self.regressions.update(diff_plancache, new_time,
+                                    new_time - self.last_read_time)
+        others, own = self.split_own(diff_plancache)
+        self.overhead = self.column_meta.DescribeOverhead(own)
+        shown = diff_plancache if self.show_self else others
+        members = None
+        if self.grouping:
+            self.shapes.learn(self.conn, shown, new_plancache)
+            shown, members = self.group_by_shape(
+                shown, new_plancache, self.plancache,
+                new_time - self.last_read_time)
+        self.diff_plancache = shown
         self.last_read_time = new_time
         self.plancache = new_plancache
 
-        self.sum_cpu_util = self.column_meta.GetCpuTotalFromAllDeltas(self.diff_plancache)
+        with self.baseline_lock:
+            if self.baseline is not None and self.baseline[1] is None:
+                self.update_baseline_plancache()
+
+        if self.alerts is not None:
+            alerting = self.alerts.evaluate(others, new_time)
+            if members is not None:
+                # A group is alerting if any of its activities is.
+                alerting = frozenset(alerting).union(
+                    group for group, keys in members.items()
+                    if any(k in alerting for k in keys))
+            self.alerting = alerting
+        if self.history is not None:
+            self.history.record(new_time, others)
+
+        # The resource bars show the whole cluster, ourselves included.
+        cpu, wait, faults = \
+            self.column_meta.GetResourceTotalsFromAllDeltas(diff_plancache)
+        self.sum_cpu_util = cpu
+        if wait is not None:
+            self.pressure.add(wait, faults)
         self.current_mem = self.column_meta.GetCurrentMemTotal(self.conn)
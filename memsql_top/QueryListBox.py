@@ -16,40 +16,76 @@
 # limitations under the License.
 #
 
+import time
 import urwid
 
+from collections import OrderedDict
 from urwid.command_map import ACTIVATE
 
 
+FOCUS_MAP = {
+    "body_0": "body_focus_0",
+    "body_1": "body_focus_1",
+    "body_2": "body_focus_2",
+    "body_3": "body_focus_3",
+    "body_4": "body_focus_4",
+    None: "body_focus",
+}
+
+ALERT_MAP = dict((k, "alert") for k in FOCUS_MAP)
+ALERT_FOCUS_MAP = dict((k, "alert_focus") for k in FOCUS_MAP)
+SELF_MAP = dict((k, "self") for k in FOCUS_MAP)
+SELF_FOCUS_MAP = dict((k, "self_focus") for k in FOCUS_MAP)
+
+#
+# The attribute and focus maps of a row in each style: rows that are
+# alerting, rows for memsql-top's own activities and everything else.
+#
+STYLE_MAPS = {
+    None: ({None: "body"}, FOCUS_MAP),
+    "alert": (ALERT_MAP, ALERT_FOCUS_MAP),
+    "self": (SELF_MAP, SELF_FOCUS_MAP),
+}
+
+
 class QueryRow(urwid.AttrMap):
-    def __init__(self, column_meta, **kwargs):
+    """
+    One row of a QueryListBox. If hold is set, a cell whose text changes but
+    whose colour does not is redrawn at most every hold seconds, so values
+    that change on every tick do not make the row flicker.
+    """
+    def __init__(self, column_meta, hold=0, **kwargs):
         columns = []
         self.column_meta = column_meta
+        self.hold = hold
         self.values = {}
         self.text = {}
         self.attr = {}
+        # The (text, color, time) each cell was last drawn with, and the
+        # cells whose text is held back.
+        self.shown = {}
+        self.stale = set()
+        now = time.time() if hold else 0
         for name, meta in self.column_meta.columns.items():
-            t = urwid.Text(meta.humanize(kwargs[name]), wrap="clip")
-            color = meta.colorize(kwargs[name])
+            # A frame may briefly lack columns that were just switched on.
+            value = kwargs.get(name)
+            text = meta.humanize(value)
+            color = meta.colorize(value)
+            t = urwid.Text(text, wrap="clip")
             a = urwid.AttrMap(t, 'body_%d' % color)
             self.text[name] = t
             self.attr[name] = a
-            self.values[name] = kwargs[name]
+            self.values[name] = value
+            self.shown[name] = (text, color, now)
 
             if meta.fixed_width:
                 columns.append((meta.display_width(), a))
             else:
                 columns.append(("weight", meta.display_weight(), a))
 
+        self.style = None
         content = urwid.Columns(columns, dividechars=1)
-        super(QueryRow, self).__init__(content, "body", {
-            "body_0": "body_focus_0",
-            "body_1": "body_focus_1",
-            "body_2": "body_focus_2",
-            "body_3": "body_focus_3",
-            "body_4": "body_focus_4",
-            None: "body_focus",
-        })
+        super(QueryRow, self).__init__(content, "body", FOCUS_MAP)
 
     def selectable(self):
         return True
@@ -59,27 +95,69 @@ class QueryRow(urwid.AttrMap):
         return key
 
     def update(self, **kwargs):
+        now = time.time() if self.hold else 0
         for name, meta in self.column_meta.columns.items():
-            self.text[name].set_text(meta.humanize(kwargs[name]))
-            color = meta.colorize(kwargs[name])
-            self.attr[name].set_attr_map({None: 'body_%d' % color})
-            self.values[name] = kwargs[name]
+            value = kwargs.get(name)
+            # Text columns (e.g. the query) rarely change between ticks, so
+            # skip humanizing and redrawing anything that has not changed.
+            if value == self.values[name] and name not in self.stale:
+                continue
+            self.values[name] = value
+
+            text = meta.humanize(value)
+            color = meta.colorize(value)
+            shown_text, shown_color, shown_at = self.shown[name]
+            if color == shown_color:
+                if text == shown_text:
+                    self.stale.discard(name)
+                    continue
+                if now - shown_at < self.hold:
+                    self.stale.add(name)
+                    continue
+            else:
+                self.attr[name].set_attr_map({None: 'body_%d' % color})
+            if text != shown_text:
+                self.text[name].set_text(text)
+            self.shown[name] = (text, color, now)
+            self.stale.discard(name)
+
+    def set_style(self, style):
+        if self.style != style:
+            self.style = style
+            attr_map, focus_map = STYLE_MAPS[style]
+            self.set_attr_map(attr_map)
+            self.set_focus_map(focus_map)
 
 
 class QueryListBox(urwid.ListBox):
     signals = ['sort_column_changed', 'query_selected']
 
-    def __init__(self, column_meta):
+    def __init__(self, column_meta, hold=0):
         self.qrlist = urwid.SimpleFocusListWalker([])
+        self.hold = hold
         self.widgets = {}
         self.column_meta = column_meta
         self.sort_column = column_meta.default_sort_key
         self.sort_keys_map = {c.sort_key: name
-                              for name, c in column_meta.columns.items()}
+                              for name, c in column_meta.columns.items()
+                              if c.sort_key}
+        # Without a sort column, rows are kept in the order of the entries.
+        self.order = {}
+        # Only entries for which filter returns True are shown.
+        self.filter = None
+        # Whether apply_changes would miss rows, e.g. the filter changed,
+        # so the next update must pass all the entries to update_entries.
+        self.resync = True
         super(QueryListBox, self).__init__(self.qrlist)
 
     def sort_columns(self):
-        self.qrlist.sort(key=lambda qr: qr.values[self.sort_column],
+        if self.sort_column is None:
+            self.qrlist.sort(key=lambda qr: self.order.get(qr, 0))
+            return
+        # Rows without a value (e.g. no latency yet) sort last.
+        sort_column = self.sort_column
+        self.qrlist.sort(key=lambda qr: (qr.values[sort_column] is not None,
+                                         qr.values[sort_column]),
                          reverse=True)
 
     def sort_keys(self):
@@ -107,7 +185,17 @@ class QueryListBox(urwid.ListBox):
         self.qrlist.set_focus(0)
         self._emit('sort_column_changed', self.sort_column)
 
-    def update_entries(self, diff_plancache):
+    def set_filter(self, filter):
+        self.filter = filter
+        self.resync = True
+
+    def update_entries(self, diff_plancache, alerting=frozenset(),
+                       own=frozenset()):
+        self.resync = False
+        if self.filter is not None:
+            diff_plancache = OrderedDict(
+                (k, v) for k, v in diff_plancache.items() if self.filter(v))
+
         # Remove entries that become obsolete
         remove = [k for k in self.widgets if k not in diff_plancache]
         for qr in remove:
@@ -117,11 +205,49 @@ class QueryListBox(urwid.ListBox):
         was_empty = len(self.qrlist) == 0
         for key, ent in diff_plancache.items():
             if key not in self.widgets:
-                self.widgets[key] = QueryRow(self.column_meta, **ent)
+                self.widgets[key] = QueryRow(self.column_meta, self.hold, **ent)
                 self.qrlist.append(self.widgets[key])
             else:
                 self.widgets[key].update(**ent)
+            self.widgets[key].set_style(
+                "alert" if key in alerting else "self" if key in own else None)
 
+        if self.sort_column is None:
+            self.order = dict((self.widgets[key], i)
+                              for i, key in enumerate(diff_plancache))
         self.sort_columns()
         if was_empty:
             self.qrlist.set_focus(0)
+
+    def apply_changes(self, changed, removed, alerting=frozenset(),
+                      own=frozenset()):
+        """
+        Like update_entries, but only touches the rows that were added,
+        changed or removed since the last update.
+        """
+        if self.filter is not None:
+            removed = set(removed)
+            removed.update(k for k, v in changed.items() if not self.filter(v))
+            changed = dict((k, v) for k, v in changed.items()
+                           if k not in removed)
+
+        if removed:
+            drop = set(self.widgets.pop(k) for k in removed
+                       if k in self.widgets)
+            if drop:
+                self.qrlist[:] = [qr for qr in self.qrlist if qr not in drop]
+
+        was_empty = len(self.qrlist) == 0
+        for key, ent in changed.items():
+            if key not in self.widgets:
+                self.widgets[key] = QueryRow(self.column_meta, self.hold, **ent)
+                self.qrlist.append(self.widgets[key])
+            else:
+                self.widgets[key].update(**ent)
+            self.widgets[key].set_style(
+                "alert" if key in alerting else "self" if key in own else None)
+
+        if changed or removed:
+            self.sort_columns()
+        if was_empty and len(self.qrlist):
+            self.qrlist.set_focus(0)
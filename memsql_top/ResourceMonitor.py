@@ -18,6 +18,58 @@
 
 import urwid
 
+#
+# The scheduling bar is full when queries spend as long waiting for a cpu as
+# there is cpu time, i.e. about one query waiting per core. The paging bar
+# is full at PAGING_FULL major faults per second across the cluster; a
+# cluster whose working set fits in memory takes almost none.
+#
+PAGING_FULL = 1000.0
+
+SPARKS = u" \u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"
+
+
+class RateBar(urwid.ProgressBar):
+    """
+    A progress bar labelled with a rate per second, which may be past done,
+    rather than a percentage.
+    """
+    rate = 0.0
+
+    def set_rate(self, rate):
+        self.rate = rate
+        self.set_completion(min(rate, self.done))
+
+    def get_text(self):
+        return "%.0f/s" % self.rate
+
+
+class Sparkline(urwid.Widget):
+    """
+    One row showing as many of the most recent values as fit, scaled so
+    that done is a full block.
+    """
+    _sizing = frozenset(['flow'])
+
+    def __init__(self, done):
+        self.done = done
+        self.values = []
+
+    def set_values(self, values):
+        self.values = values
+        self._invalidate()
+
+    def rows(self, size, focus=False):
+        return 1
+
+    def render(self, size, focus=False):
+        (maxcol,) = size
+        top = len(SPARKS) - 1
+        text = u"".join(
+            SPARKS[int(round(min(v / self.done, 1.0) * top))]
+            for v in self.values[max(0, len(self.values) - maxcol):])
+        return urwid.Text(text, align="right", wrap="clip").render(size)
+
 
 class ResourceMonitor(urwid.WidgetWrap):
     def __init__(self, num_cores, max_mem):
@@ -25,6 +77,14 @@ class ResourceMonitor(urwid.WidgetWrap):
                                              'resource_bar', done=num_cores)
         self.mem_utilbar = urwid.ProgressBar('resource_bar_empty',
                                              'resource_bar', done=max_mem)
+        # Milliseconds of waiting for a cpu per second.
+        wait_full = num_cores * 1000.0
+        self.sched_bar = urwid.ProgressBar('resource_bar_empty',
+                                           'resource_bar', done=wait_full)
+        self.paging_bar = RateBar('resource_bar_empty', 'resource_bar',
+                                  done=PAGING_FULL)
+        self.sched_history = Sparkline(wait_full)
+        self.paging_history = Sparkline(PAGING_FULL)
 
         super(ResourceMonitor, self).__init__(urwid.Pile([
             urwid.Columns([
@@ -34,13 +94,20 @@ class ResourceMonitor(urwid.WidgetWrap):
                 urwid.Text("Memory Capacity", align="right"),
                 self.mem_utilbar
             ]),
-#            urwid.Columns([
-#                urwid.Text("CPU Sched Latency"),
-#                urwid.ProgressBar('resource_bar_empty', 'resource_bar'),
-#                urwid.Divider(),
-#                urwid.Text("Memory Paging"),
-#                urwid.ProgressBar('resource_bar_empty', 'resource_bar'),
-#            ])
+            urwid.Columns([
+                urwid.Text("CPU Sched Latency", align="right"),
+                self.sched_bar,
+                urwid.Divider(),
+                urwid.Text("Memory Paging", align="right"),
+                self.paging_bar,
+            ]),
+            urwid.Columns([
+                urwid.Divider(),
+                self.sched_history,
+                urwid.Divider(),
+                urwid.Divider(),
+                self.paging_history,
+            ]),
         ]))
 
     def update_cpu_util(self, util):
@@ -48,3 +115,18 @@ class ResourceMonitor(urwid.WidgetWrap):
 
     def update_mem_usage(self, usage):
         self.mem_utilbar.set_completion(usage)
+
+    def update_pressure(self, history):
+        """
+        Shows the last tick of a PressureHistory on the bars and the ticks
+        before it on the sparklines below them.
+        """
+        last = history.last()
+        if last is None:
+            return
+        wait, faults = last
+        self.sched_bar.set_completion(min(wait, self.sched_bar.done))
+        self.paging_bar.set_rate(faults)
+        wait_series, faults_series = history.series()
+        self.sched_history.set_values(wait_series)
+        self.paging_history.set_values(faults_series)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import re
+import time
+
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+#
+# Threshold units, scaled to the units NormalizeCounterDelta produces: times
+# are in milliseconds, sizes in bytes and utilization as a fraction of a core.
+#
+VALUE_UNITS = {
+    "": 1.0,
+    "%": 0.01,
+    "ms": 1.0,
+    "s": 1000.0,
+    "m": 60 * 1000.0,
+    "h": 60 * 60 * 1000.0,
+    "b": 1.0,
+    "kb": 1024.0,
+    "mb": 1024.0 ** 2,
+    "gb": 1024.0 ** 3,
+    "tb": 1024.0 ** 4,
+}
+
+DURATION_UNITS = {
+    "": 1.0,
+    "ms": 0.001,
+    "s": 1.0,
+    "m": 60.0,
+    "h": 60 * 60.0,
+}
+
+RULE_RE = re.compile(r"""
+    ^\s*(?P<column>\S+)
+    \s*(?P<op>>=|<=|>|<)
+    \s*(?P<value>[0-9]*\.?[0-9]+)\s*(?P<unit>%|[a-zA-Z]*)
+    (\s+for\s+(?P<duration>[0-9]*\.?[0-9]+)\s*(?P<duration_unit>[a-zA-Z]*))?
+    (\s+on\s+(?P<filters>\S+(\s*,\s*\S+)*))?
+    \s*$""", re.X)
+
+
+class AlertRule(object):
+    __slots__ = ["text", "column", "op", "threshold", "duration", "filters"]
+
+    def __init__(self, text, column, op, threshold, duration, filters):
+        self.text = text
+        self.column = column
+        self.op = op
+        self.threshold = threshold
+        self.duration = duration
+        self.filters = filters
+
+
+def ParseAlertRule(text, column_meta):
+    """
+    Parses rules like `Cpu/s > 2.0 for 10s on database=x` or
+    `LockW/q > 50ms`. Raises ValueError if the rule is malformed or refers to
+    an unknown column.
+    """
+    names = dict((name.lower(), name) for name in column_meta.columns)
+
+    m = RULE_RE.match(text)
+    if m is None:
+        raise ValueError("expected `COLUMN OP VALUE [for DURATION] "
+                         "[on COLUMN=VALUE,...]`")
+
+    column = names.get(m.group("column").lower())
+    if column is None:
+        raise ValueError("unknown column %s" % m.group("column"))
+
+    unit = m.group("unit").lower()
+    if unit not in VALUE_UNITS:
+        raise ValueError("unknown unit %s" % m.group("unit"))
+    threshold = float(m.group("value")) * VALUE_UNITS[unit]
+
+    duration = 0.0
+    if m.group("duration"):
+        duration_unit = m.group("duration_unit").lower()
+        if duration_unit not in DURATION_UNITS:
+            raise ValueError("unknown duration unit %s" %
+                             m.group("duration_unit"))
+        duration = float(m.group("duration")) * DURATION_UNITS[duration_unit]
+
+    filters = []
+    if m.group("filters"):
+        for f in m.group("filters").split(","):
+            fcol, _, fval = f.strip().partition("=")
+            if fcol.lower() not in names or not fval:
+                raise ValueError("bad filter %s" % f.strip())
+            filters.append((names[fcol.lower()], fval))
+    filters.sort()
+
+    return AlertRule(text.strip(), column, m.group("op"), threshold,
+                     duration, tuple(filters))
+
+
+class ColumnCheck(object):
+    """
+    All the rules that compare one column against a threshold, for one set of
+    filter values. The thresholds for each operator are kept sorted, so
+    finding every rule a value fires is a single bisect rather than a loop
+    over the rules.
+    """
+    __slots__ = ["column", "gt", "gt_rules", "ge", "ge_rules",
+                 "lt", "lt_rules", "le", "le_rules"]
+
+    def __init__(self, column, rules):
+        self.column = column
+        for op, attr in [(">", "gt"), (">=", "ge"), ("<", "lt"), ("<=", "le")]:
+            matching = sorted((r for r in rules if r.op == op),
+                              key=lambda r: r.threshold)
+            setattr(self, attr, [r.threshold for r in matching])
+            setattr(self, attr + "_rules", matching)
+
+    def matching(self, value, hits):
+        k = bisect_left(self.gt, value)
+        if k:
+            hits.extend(self.gt_rules[:k])
+        k = bisect_right(self.ge, value)
+        if k:
+            hits.extend(self.ge_rules[:k])
+        k = bisect_right(self.lt, value)
+        if k < len(self.lt):
+            hits.extend(self.lt_rules[k:])
+        k = bisect_left(self.le, value)
+        if k < len(self.le):
+            hits.extend(self.le_rules[k:])
+
+
+def FormatKey(key):
+    if isinstance(key, tuple):
+        return " ".join(str(k) for k in key)
+    return str(key)
+
+
+class AlertEngine(object):
+    """
+    Evaluates a set of rules against each tick's normalized deltas.
+
+    The rules are compiled once: they are grouped by the columns they filter
+    on and the values of those filters, and then by the column they check.
+    Each row costs one dict lookup per distinct set of filter columns and one
+    bisect per checked column, regardless of how many rules there are.
+    """
+    def __init__(self, rules, log_path=None):
+        self.rules = rules
+        self.log_path = log_path
+
+        grouped = OrderedDict()
+        for rule in rules:
+            fcols = tuple(c for c, _ in rule.filters)
+            fvals = tuple(v for _, v in rule.filters)
+            by_value = grouped.setdefault(fcols, OrderedDict())
+            by_value.setdefault(fvals, OrderedDict()).setdefault(
+                rule.column, []).append(rule)
+
+        self.groups = [
+            (fcols, dict((fvals, [ColumnCheck(col, col_rules)
+                                  for col, col_rules in by_column.items()])
+                         for fvals, by_column in by_value.items()))
+            for fcols, by_value in grouped.items()
+        ]
+
+        # (rule, key) -> time the rule started matching the row.
+        self.matching_since = {}
+        self.firing = set()
+
+    def columns(self):
+        """
+        Returns the columns the rules check or filter on.
+        """
+        columns = set()
+        for rule in self.rules:
+            columns.add(rule.column)
+            columns.update(c for c, _ in rule.filters)
+        return columns
+
+    def evaluate(self, diff_plancache, now=None):
+        """
+        Returns the set of keys in diff_plancache for which some rule is
+        firing, and logs rules that started firing this tick.
+        """
+        if now is None:
+            now = time.time()
+
+        matching_since = {}
+        firing = set()
+        started = []
+        hits = []
+        for key, ent in diff_plancache.items():
+            for fcols, by_value in self.groups:
+                checks = by_value.get(tuple(str(ent[c]) for c in fcols))
+                if checks is None:
+                    continue
+
+                for check in checks:
+                    value = ent[check.column]
+                    if value is not None:
+                        check.matching(value, hits)
+
+            if not hits:
+                continue
+
+            for rule in hits:
+                since = self.matching_since.get((rule, key), now)
+                matching_since[(rule, key)] = since
+                if now - since >= rule.duration:
+                    firing.add((rule, key))
+                    if (rule, key) not in self.firing:
+                        started.append((rule, key, ent[rule.column]))
+            del hits[:]
+
+        self.matching_since = matching_since
+        self.firing = firing
+        if started:
+            self.log(now, started)
+        return set(key for _, key in firing)
+
+    def log(self, now, started):
+        if self.log_path is None:
+            return
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+        with open(self.log_path, "a") as f:
+            for rule, key, value in started:
+                f.write("%s\t%s\t%s\t%s\n" % (stamp, rule.text,
+                                              FormatKey(key), value))
+
+
+def LoadAlertRules(texts, path, column_meta):
+    """
+    Parses the rules given on the command line and in the rules file (one per
+    line, `#` starts a comment).
+    """
+    texts = list(texts or [])
+    if path is not None:
+        with open(path) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    texts.append(line)
+
+    rules = []
+    for t in texts:
+        try:
+            rules.append(ParseAlertRule(t, column_meta))
+        except ValueError as e:
+            raise ValueError("invalid alert rule %r: %s" % (t, e))
+    return rules
@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import errno
+import json
+import logging
+import os
+import select
+import socket
+import stat
+import struct
+import sys
+import threading
+
+from attrdict import AttrDict
+
+from .pressure import PressureHistory
+
+#
+# Wire format. Every message is a one byte type and a four byte payload
+# length followed by the payload:
+#
+#   HELLO  json object describing the cluster and the columns.
+#   DEFS   u32 count, then per activity: u32 id and each text column as a u16
+#          length prefixed utf-8 string. Text columns are sent once, when an
+#          activity is first seen, and afterwards referred to by id.
+#   FRAME  f64 cpu, f64 mem, f64 cpu wait, f64 page faults (NaN if the
+#          version has no such counters), u32 count, then per activity: u32
+#          id, u8 flags (alerting, our own activity) and each numeric column
+#          as a f32 (NaN for None).
+#   RESET  forget all ids; sent before the id table is rebuilt.
+#
+MSG_HELLO = b"H"
+MSG_DEFS = b"D"
+MSG_FRAME = b"F"
+MSG_RESET = b"R"
+
+HEADER = struct.Struct("!cI")
+COUNT = struct.Struct("!I")
+DEF_ID = struct.Struct("!I")
+STRLEN = struct.Struct("!H")
+FRAME_HEAD = struct.Struct("!ddddI")
+
+FLAG_ALERTING = 1
+FLAG_OWN = 2
+
+NAN = float("nan")
+
+#
+# Each client's unsent output is buffered, up to MAX_BUFFERED bytes. A
+# client whose buffer grows past that can't keep up and is dropped.
+#
+MAX_BUFFERED = 16 * 1024 * 1024
+
+
+def EncodeMessage(kind, payload):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+def EncodeString(s):
+    if s is None:
+        s = ""
+    if not isinstance(s, bytes):
+        s = str(s).encode("utf-8")
+    if len(s) > 0xffff:
+        # Don't cut a multibyte character in half.
+        s = s[:0xffff].decode("utf-8", "ignore").encode("utf-8")
+    return STRLEN.pack(len(s)) + s
+
+
+class FrameCodec(object):
+    """
+    The column layout shared by FrameEncoder and FrameDecoder.
+    """
+    def __init__(self, column_names, numeric_names):
+        self.text = [n for n in column_names if n not in numeric_names]
+        self.numeric = [n for n in column_names if n in numeric_names]
+        self.row = struct.Struct("!IB%df" % len(self.numeric))
+
+
+class FrameEncoder(FrameCodec):
+    """
+    Encodes each poller frame once, so that the cost of publishing does not
+    depend on the number of subscribers. Activity ids are global to the
+    stream; a new subscriber is sent the whole id table when it connects.
+    """
+    def __init__(self, column_meta):
+        super(FrameEncoder, self).__init__(
+            list(column_meta.columns.keys()),
+            set(n for n, c in column_meta.columns.items() if c.is_numeric()))
+        self.ids = {}
+        self.defs = {}
+
+    def encode_defs(self, ids):
+        parts = [COUNT.pack(len(ids))]
+        for i in ids:
+            parts.append(DEF_ID.pack(i))
+            parts.append(self.defs[i])
+        return EncodeMessage(MSG_DEFS, b"".join(parts))
+
+    def encode_all_defs(self):
+        return self.encode_defs(list(self.defs.keys()))
+
+    def encode_frame(self, diff_plancache, cpu, mem, alerting, own=frozenset(),
+                     pressure=None):
+        out = []
+
+        #
+        # Ids of activities that have gone away are never reused; once the
+        # table is much larger than the live set, rebuild it from scratch.
+        #
+        if len(self.ids) > 4 * len(diff_plancache) + 1024:
+            self.ids = {}
+            self.defs = {}
+            out.append(EncodeMessage(MSG_RESET, b""))
+
+        new_ids = []
+        rows = []
+        pack = self.row.pack
+        for key, ent in diff_plancache.items():
+            i = self.ids.get(key)
+            if i is None:
+                i = len(self.defs)
+                self.ids[key] = i
+                self.defs[i] = b"".join(EncodeString(ent[n])
+                                        for n in self.text)
+                new_ids.append(i)
+
+            values = [ent[n] for n in self.numeric]
+            flags = (FLAG_ALERTING if key in alerting else 0) | \
+                (FLAG_OWN if key in own else 0)
+            rows.append(pack(i, flags,
+                             *[NAN if v is None else v for v in values]))
+
+        if new_ids:
+            out.append(self.encode_defs(new_ids))
+        wait, faults = pressure or (NAN, NAN)
+        out.append(EncodeMessage(MSG_FRAME, b"".join(
+            [FRAME_HEAD.pack(cpu, mem, wait, faults, len(rows))] + rows)))
+        return b"".join(out)
+
+
+class FrameDecoder(FrameCodec):
+    def __init__(self, hello):
+        super(FrameDecoder, self).__init__(hello["columns"],
+                                           set(hello["numeric"]))
+        self.defs = {}
+        # The ids of our own activities in the last frame, and its cpu wait
+        # and page faults (see PressureHistory), if any.
+        self.own = frozenset()
+        self.pressure = None
+
+    def decode(self, kind, payload):
+        """
+        Applies a message to the id table. Returns the decoded frame as
+        (diff_plancache, cpu, mem, alerting) for FRAME messages, else None.
+        The frame's own activities are left in self.own and its cpu wait and
+        page faults in self.pressure.
+        """
+        if kind == MSG_RESET:
+            self.defs = {}
+        elif kind == MSG_DEFS:
+            count, = COUNT.unpack_from(payload, 0)
+            offset = COUNT.size
+            for _ in range(count):
+                i, = DEF_ID.unpack_from(payload, offset)
+                offset += DEF_ID.size
+                values = []
+                for _ in self.text:
+                    n, = STRLEN.unpack_from(payload, offset)
+                    offset += STRLEN.size
+                    values.append(
+                        payload[offset:offset + n].decode("utf-8", "replace"))
+                    offset += n
+                self.defs[i] = values
+        elif kind == MSG_FRAME:
+            cpu, mem, wait, faults, count = FRAME_HEAD.unpack_from(payload, 0)
+            offset = FRAME_HEAD.size
+            diff_plancache = {}
+            alerting = set()
+            own = set()
+            unpack = self.row.unpack_from
+            for _ in range(count):
+                row = unpack(payload, offset)
+                offset += self.row.size
+                i, flags = row[0], row[1]
+                ent = AttrDict(zip(self.text, self.defs[i]))
+                for n, v in zip(self.numeric, row[2:]):
+                    ent[n] = None if v != v else v
+                diff_plancache[i] = ent
+                if flags & FLAG_ALERTING:
+                    alerting.add(i)
+                if flags & FLAG_OWN:
+                    own.add(i)
+            self.own = own
+            self.pressure = None if wait != wait else (wait, faults)
+            return diff_plancache, cpu, mem, alerting
+        return None
+
+
+class ClientOutput(object):
+    """
+    Non-blocking output to any number of sockets from one select loop, so a
+    slow client never stalls the others. send() buffers and writes what the
+    socket takes right away; flush() writes more once select reports the
+    socket writable. Clients that fail or fall more than max_buffered bytes
+    behind are closed and forgotten.
+    """
+    def __init__(self, max_buffered=MAX_BUFFERED):
+        self.max_buffered = max_buffered
+        self.buffers = {}
+        # Clients to close once their output is sent.
+        self.closing = set()
+
+    def add(self, client):
+        client.setblocking(False)
+        self.buffers[client] = bytearray()
+
+    def __contains__(self, client):
+        return client in self.buffers
+
+    def waiting(self):
+        return [c for c, buf in self.buffers.items() if buf]
+
+    def send(self, client, data, close=False):
+        """
+        Returns whether the client is still open.
+        """
+        buf = self.buffers.get(client)
+        if buf is None:
+            return False
+        buf += data
+        if len(buf) > self.max_buffered:
+            logging.warn("Dropping a client that can't keep up.")
+            self.close(client)
+            return False
+        if close:
+            self.closing.add(client)
+        return self.flush(client)
+
+    def flush(self, client):
+        buf = self.buffers[client]
+        try:
+            while buf:
+                del buf[:client.send(buf)]
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                logging.warn("Dropping client: %s" % e)
+                self.close(client)
+                return False
+        if not buf and client in self.closing:
+            self.close(client)
+            return False
+        return True
+
+    def close(self, client):
+        self.buffers.pop(client, None)
+        self.closing.discard(client)
+        client.close()
+
+
+def RemoveStaleSocket(path):
+    """
+    Removes the socket of a collector that is no longer running, e.g. one
+    that was killed. Exits if path is anything else or a collector is still
+    listening on it.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        sys.exit("%s exists and is not a socket" % path)
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    sys.exit("A collector is already serving on %s" % path)
+
+
+def RecvExactly(sock, n):
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(n)
+        if not chunk:
+            raise EOFError("collector closed the connection")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+
+def RecvMessage(sock):
+    kind, length = HEADER.unpack(RecvExactly(sock, HEADER.size))
+    return kind, RecvExactly(sock, length)
+
+
+class FrameCollector(object):
+    """
+    Serves the frames of one DatabasePoller to any number of subscribers on a
+    local Unix socket.
+    """
+    def __init__(self, path, column_meta, dbpoller, hello):
+        self.path = path
+        self.dbpoller = dbpoller
+        self.encoder = FrameEncoder(column_meta)
+        self.output = ClientOutput()
+        # How many pressure ticks have been sent (see PressureHistory).
+        self.pressure_sent = 0
+
+        hello = dict(hello)
+        hello["columns"] = list(column_meta.columns.keys())
+        hello["numeric"] = sorted(self.encoder.numeric)
+        self.hello = EncodeMessage(MSG_HELLO,
+                                   json.dumps(hello).encode("utf-8"))
+
+        RemoveStaleSocket(path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(16)
+        self.clients = []
+
+    def serve_forever(self):
+        signal_r, signal_w = os.pipe()
+        self.dbpoller.start(signal_w)
+        try:
+            while True:
+                readable, writable, _ = select.select(
+                    [self.listener, signal_r] + self.clients,
+                    self.output.waiting(), [])
+                for w in writable:
+                    if w in self.output:
+                        self.output.flush(w)
+                for r in readable:
+                    if r is self.listener:
+                        self.accept()
+                    elif r == signal_r:
+                        os.read(signal_r, 4096)
+                        self.publish()
+                    elif r in self.output:
+                        self.drop_if_closed(r)
+                self.clients = [c for c in self.clients if c in self.output]
+        finally:
+            self.listener.close()
+            os.unlink(self.path)
+
+    def accept(self):
+        client, _ = self.listener.accept()
+        self.output.add(client)
+        if self.output.send(client,
+                            self.hello + self.encoder.encode_all_defs()):
+            self.clients.append(client)
+
+    def publish(self):
+        # A poll that added no pressure tick sends NaNs, so subscribers
+        # don't count the last tick twice.
+        self.pressure_sent, pressure = \
+            self.dbpoller.pressure.last_since(self.pressure_sent)
+        msg = self.encoder.encode_frame(
+            *self.dbpoller.get_database_data(),
+            own=self.dbpoller.own_keys,
+            pressure=pressure)
+        for client in self.clients:
+            self.output.send(client, msg)
+
+    def drop_if_closed(self, client):
+        try:
+            data = client.recv(4096)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b""
+        if not data:
+            self.output.close(client)
+
+
+class FrameSubscriber(threading.Thread):
+    """
+    Receives frames from a FrameCollector. It has the same start,
+    get_database_data and status interface as DatabasePoller, so the UI can
+    render either one.
+    """
+    def __init__(self, path):
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+            kind, payload = RecvMessage(self.sock)
+        except (socket.error, EOFError) as e:
+            sys.exit("Failed to attach to collector at %s: %s" % (path, e))
+        if kind != MSG_HELLO:
+            sys.exit("%s is not a memsql-top collector" % path)
+
+        self.hello = json.loads(payload.decode("utf-8"))
+        self.decoder = FrameDecoder(self.hello)
+        self.data = ({}, 0, 0, frozenset())
+        self.own_keys = frozenset()
+        self.pressure = PressureHistory()
+        self.status_text = ""
+        super(FrameSubscriber, self).__init__(name="FrameSubscriber")
+
+    def get_database_data(self):
+        return self.data
+
+    def status(self):
+        return self.status_text
+
+    def start(self, signal_file):
+        self.daemon = True
+        self.signal_file = signal_file
+        super(FrameSubscriber, self).start()
+
+    def run(self):
+        while True:
+            try:
+                kind, payload = RecvMessage(self.sock)
+                frame = self.decoder.decode(kind, payload)
+            except Exception as e:
+                # Tell the UI, or it would silently stop updating.
+                logging.warn("Lost connection to collector: %s" % e)
+                self.status_text = "Lost connection to collector: %s" % e
+                os.write(self.signal_file, str.encode("\n"))
+                return
+            if frame is not None:
+                self.own_keys = self.decoder.own
+                self.data = frame
+                if self.decoder.pressure is not None:
+                    self.pressure.add(*self.decoder.pressure)
+                os.write(self.signal_file, str.encode("\n"))
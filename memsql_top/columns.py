@@ -20,26 +20,45 @@ from __future__ import absolute_import
 
 from attrdict import AttrDict
 from collections import OrderedDict, namedtuple
+import copy
 
 from distutils.version import LooseVersion
 
 import logging
+import sys
 from decimal import Decimal
 
+from .compiler import NORMALIZE_TEXT, NORMALIZE_GAUGE, \
+    NORMALIZE_PER_SECOND, NORMALIZE_PER_EXECUTION, NORMALIZE_QUANTILE, \
+    NORMALIZE_CHANGE, CompileDiffCounters, CompileNormalizeCounterDelta, \
+    RawColumns
+from .database import QUERY_TAG
 from .humanize import *
+from .regression import HumanizeChange
+
+#
+# How many activity names to look up in one query.
+#
+QUERY_TEXT_BATCH = 500
+
+def NoColorize(c):
+    return 0
 
 class ColumnMetadata(object):
     __slots__ = ["name", "memsql_column_name", "fixed_width",
                  "humanize", "colorize", "sort_key", "help",
-                 "width_weight"]
+                 "width_weight", "normalize", "scale", "quantile"]
     def __init__(self,
                  name,
                  memsql_column_name,
                  help=None,
                  width_weight=None,
                  humanize=lambda c: str(c) if c is not None else "",
-                 colorize=lambda c: 0,
-                 sort_key=None):
+                 colorize=NoColorize,
+                 sort_key=None,
+                 normalize=NORMALIZE_TEXT,
+                 scale=1,
+                 quantile=None):
 
         self.name = name
         self.help = help
@@ -49,6 +68,9 @@ class ColumnMetadata(object):
         self.colorize = colorize
         self.sort_key = sort_key
         self.memsql_column_name = memsql_column_name
+        self.normalize = normalize
+        self.scale = scale
+        self.quantile = quantile
 
     def display_width(self):
         assert self.fixed_width
@@ -59,15 +81,92 @@ class ColumnMetadata(object):
         assert not self.fixed_width
         return self.width_weight
 
+    def is_numeric(self):
+        return self.normalize != NORMALIZE_TEXT
+
 class MemSqlColumnsMetadata(object):
+    #
+    # DiffCounters and NormalizeCounterDelta are generated from the columns'
+    # normalization kinds; executions are the raw columns that add up to the
+    # number of executions that per execution columns are divided by.
+    #
+    # sketch_columns, if set, are the latency and completions per second
+    # columns that the quantile columns are computed from.
+    #
+    # change_column, if set, is the column that the regression detector
+    # fills in.
+    #
+    # Project returns a copy that only shows some of the columns (see
+    # profiles). all_columns are then still every column there is, columns
+    # the ones shown and fetched the ones read from MemSQL: the shown ones
+    # plus the required_columns, which identify an activity or are used by
+    # the poller itself.
+    #
     __slots__ = ['columns', 'default_sort_key', 'minimum_version',
-                 'focus_column']
-
-    def __init__(self, columns, default_sort_key, focus_column, minimum_version):
+                 'focus_column', 'executions', 'sketch_columns',
+                 'change_column', 'all_columns', 'fetched',
+                 'required_columns', 'profiles', 'profile',
+                 'DiffCounters', 'NormalizeCounterDelta']
+
+    def __init__(self, columns, default_sort_key, focus_column, minimum_version,
+                 executions=(), sketch_columns=None, change_column=None,
+                 required_columns=(), profiles=None):
         self.columns = columns
         self.default_sort_key = default_sort_key
         self.minimum_version = minimum_version
         self.focus_column = focus_column
+        self.executions = executions
+        self.sketch_columns = sketch_columns
+        self.change_column = change_column
+        self.all_columns = columns
+        self.fetched = columns
+        self.required_columns = required_columns
+        self.profiles = OrderedDict([("all", list(columns.keys()))])
+        self.profiles.update(profiles or [])
+        self.profile = "all"
+        self.Compile()
+
+    def Compile(self):
+        self.DiffCounters = CompileDiffCounters(self.fetched)
+        self.NormalizeCounterDelta = CompileNormalizeCounterDelta(
+            self.fetched, self.executions)
+
+    def ProfileColumns(self, profile):
+        """
+        Returns the columns of a profile, given its name or a comma separated
+        list of columns.
+        """
+        if profile in self.profiles:
+            return self.profiles[profile]
+        names = dict((name.lower(), name) for name in self.all_columns)
+        columns = []
+        for c in profile.split(","):
+            if c.strip().lower() not in names:
+                raise ValueError("unknown column or profile %s (profiles "
+                                 "are %s)" % (c.strip(),
+                                              ", ".join(self.profiles)))
+            columns.append(names[c.strip().lower()])
+        return columns
+
+    def Project(self, profile, needed=()):
+        """
+        Returns a copy of these columns that only shows the columns of
+        profile, and also fetches the needed columns (e.g. those that alert
+        rules check). The focus and default sort columns are always shown.
+        """
+        shown = set(self.ProfileColumns(profile))
+        shown.update([self.focus_column, self.default_sort_key])
+        fetched = shown | set(self.required_columns) | set(needed)
+        fetched.update(self.sketch_columns or ())
+
+        projected = copy.copy(self)
+        projected.profile = profile
+        projected.columns = OrderedDict(
+            (n, c) for n, c in self.all_columns.items() if n in shown)
+        projected.fetched = OrderedDict(
+            (n, c) for n, c in self.all_columns.items() if n in fetched)
+        projected.Compile()
+        return projected
 
     def CheckHasDataForAllColumns(self, dict):
         dictkeys = set(dict.keys())
@@ -80,6 +179,43 @@ class MemSqlColumnsMetadata(object):
 
         return dict
 
+def LatencyQuantileColumns(p99_sort_key):
+    return [
+        ColumnMetadata("p50",
+            None,
+            normalize=NORMALIZE_QUANTILE,
+            quantile=0.5,
+            humanize=HumanizeTime,
+            colorize=GetColorizeFunc(1000),
+            help="Median latency over the last few minutes"),
+        ColumnMetadata("p95",
+            None,
+            normalize=NORMALIZE_QUANTILE,
+            quantile=0.95,
+            humanize=HumanizeTime,
+            colorize=GetColorizeFunc(1000),
+            help="95th percentile latency over the last few minutes"),
+        ColumnMetadata("p99",
+            None,
+            normalize=NORMALIZE_QUANTILE,
+            quantile=0.99,
+            humanize=HumanizeTime,
+            colorize=GetColorizeFunc(1000),
+            sort_key=p99_sort_key,
+            help="99th percentile latency over the last few minutes"),
+    ]
+
+def ChangeColumn(sort_key):
+    return ColumnMetadata("Change",
+        None,
+        width_weight=1,
+        normalize=NORMALIZE_CHANGE,
+        humanize=HumanizeChange,
+        colorize=GetColorizeFunc(3),
+        sort_key=sort_key,
+        help="How far above its usual level over the last hour the activity"
+             " is, in standard deviations, and in which column")
+
 class Columns57(MemSqlColumnsMetadata):
     def __init__(self):
         sort_keys = iter(map(lambda x: "f%d" % x, range(1, 13)))
@@ -94,74 +230,120 @@ class Columns57(MemSqlColumnsMetadata):
                 help="Paramaterized aggregator query"),
             ColumnMetadata("Executions/sec",
                 "commits",
+                normalize=NORMALIZE_PER_SECOND,
                 humanize=HumanizeCount,
                 colorize=GetColorizeFunc(10),
                 sort_key=next(sort_keys),
                 help="Successful query executions per second"),
             ColumnMetadata("RowCount/sec",
                 "rowcount",
+                normalize=NORMALIZE_PER_SECOND,
                 humanize=HumanizeCount,
                 colorize=GetColorizeFunc(1000),
                 sort_key=next(sort_keys),
                 help="Rows returned by queries per second"),
             ColumnMetadata("CpuUtil",
                 "cpu_time",
+                normalize=NORMALIZE_PER_SECOND,
+                scale=0.001,
                 humanize=HumanizePercent,
                 colorize=GetColorizeFunc(0.10),
                 sort_key=next(sort_keys),
                 help="Sum cpu utilization accross the cluster"),
             ColumnMetadata("Memory/query",
                 "memory_use",
+                normalize=NORMALIZE_PER_EXECUTION,
                 humanize=HumanizeBytes,
                 colorize=GetColorizeFunc(128*1024),
                 sort_key=next(sort_keys),
                 help="Average memory used per execution"),
             ColumnMetadata("ExecutionTime/query",
                 "execution_time",
+                normalize=NORMALIZE_PER_EXECUTION,
                 humanize=HumanizeTime,
                 colorize=GetColorizeFunc(10),
                 sort_key=next(sort_keys),
                 help="Average query latency"),
             ColumnMetadata("QueuedTime/query",
                 "queued_time",
+                normalize=NORMALIZE_PER_EXECUTION,
                 humanize=HumanizeTime,
                 colorize=GetColorizeFunc(1),
                 sort_key=next(sort_keys),
                 help="Average queued time per execution")
-        ]), "CpuUtil", "Query", LooseVersion("5.7"))
-
-    def GetPopUpText(self, conn, name):
+        ] + LatencyQuantileColumns(next(sort_keys)) +
+            [ChangeColumn(next(sort_keys))]),
+           "CpuUtil", "Query", LooseVersion("5.7"), ["commits"],
+           ("ExecutionTime/query", "Executions/sec"), "Change",
+           ["Database", "Query", "Executions/sec", "CpuUtil", "Memory/query",
+            "ExecutionTime/query"],
+           [("narrow", ["Query", "Executions/sec", "CpuUtil",
+                        "ExecutionTime/query", "Change"]),
+            ("latency", ["Database", "Query", "Executions/sec", "CpuUtil",
+                         "ExecutionTime/query", "QueuedTime/query",
+                         "p50", "p95", "p99"])])
+
+    def GetPopUpText(self, conn, name, query_cache=None):
         return name
 
+    def WarmQueryCache(self, conn, query_cache):
+        # The Query column already holds the query text.
+        pass
+
+    def ShapeName(self, raw):
+        return raw.plan_hash
+
+    def GetQueryTexts(self, conn, rows, query_cache=None):
+        return dict((r.plan_hash, r.query_text) for r in rows)
+
     def CheckSupported(self, conn):
         if not conn.get('select @@forward_aggregator_plan_hash as f').f:
             sys.exit("forward_aggregator_plan_hash is required")
 
     def GetAllCounterSnapshots(self, conn):
-        #
-        # We store the parameterized query and deparameterize it in GetPlanCache so
-        # that we can filter out this query.
+        return dict(self.IterCounterSnapshots(conn))
+
+    def IterCounterSnapshots(self, conn):
         #
         # We filter out queries where the plan_hash is null, because those
         # correspond to leaf queries with no corresponding aggregator.
         #
         # MemSql5.7 would sometimes return null for counter columns.
         #
+        # Only the fetched columns are selected (see Project), once each.
         GET_PLANCACHE_QUERY = "select plan_hash, " + \
-            ", ".join("IFNULL(%s, 0) as %s" % (c.memsql_column_name,
-                                               c.memsql_column_name)
-                      for c in self.columns.values()) + \
+            ", ".join("IFNULL(%s, 0) as %s" % (c, c)
+                      for c in RawColumns(self.fetched)[0]) + \
             " from distributed_plancache_summary " + \
             " where plan_hash is not null"
 
-        rows = conn.query(GET_PLANCACHE_QUERY)
-        return {
-            r.plan_hash: r
-            for r in rows if r.query_text != GET_PLANCACHE_QUERY
-        }
+        return ((r.plan_hash, r)
+                for r in conn.query_stream(GET_PLANCACHE_QUERY))
 
-    def GetCpuTotalFromAllDeltas(self, allDeltas):
-        return sum(d.CpuUtil for d in allDeltas.values())
+    def GetOwnActivityKeys(self, conn):
+        #
+        # Our own queries are tagged with QUERY_TAG, which survives
+        # parameterization, so the server can find them for us.
+        #
+        return frozenset(r[0] for r in conn.query_rows(
+            "select plan_hash from distributed_plancache_summary "
+            "where plan_hash is not null and query_text like '%%%s%%'"
+            % QUERY_TAG))
+
+    def DescribeOverhead(self, deltas):
+        execs = sum(d['Executions/sec'] for d in deltas)
+        def avg(name):
+            if not execs:
+                return None
+            return sum(d[name] * d['Executions/sec'] for d in deltas) / execs
+        return "%s cpu, %s/query, %s/query" % (
+            HumanizePercent(sum(d.CpuUtil for d in deltas)),
+            HumanizeBytes(avg('Memory/query')) or "-",
+            HumanizeTime(avg('ExecutionTime/query')) or "-")
+
+    def GetResourceTotalsFromAllDeltas(self, allDeltas):
+        # 5.7 has no wait or page fault counters.
+        return sum(d.CpuUtil for d in allDeltas.values()), None, None
 
     def GetMaxCpuTotal(self, conn):
         return float(1.0)
@@ -172,6 +354,9 @@ class Columns57(MemSqlColumnsMetadata):
         #
         return int(conn.get('select @@maximum_memory as m').m)
 
+    def GetMaxResourceTotals(self, conn):
+        return self.GetMaxCpuTotal(conn), self.GetMaxMemTotal(conn)
+
     def GetCurrentMemTotal(self, conn):
         # TODO(awreece) This isn't accurately max memory across the whole cluster.
         tsm_row = conn.get("show status like 'Total_server_memory'")
@@ -180,31 +365,6 @@ class Columns57(MemSqlColumnsMetadata):
     def IsDeltaInteresting(self, delta):
         return delta.commits > 0
 
-    def NormalizeCounterDelta(self, snapshot, interval):
-        snapkeys = set(snapshot.keys())
-        colnames = set(c.memsql_column_name for c in self.columns.values())
-
-        assert snapkeys >= colnames, (snapkeys - colnames, colnames - snapkeys)
-
-        ret = AttrDict({})
-        for meta in self.columns.values():
-            snapval = snapshot[meta.memsql_column_name]
-            if isinstance(snapval, (int, Decimal)):
-                ret[meta.name] = float(snapshot[meta.memsql_column_name])
-            else:
-                ret[meta.name] = snapval
-
-        ret['Executions/sec'] = ret['Executions/sec'] / interval
-        ret['RowCount/sec'] = ret['RowCount/sec'] / interval
-
-        # Divide by 1000ms to convert to %.
-        ret['CpuUtil'] = ret['CpuUtil'] / 1000.0 / interval
-
-        ret['ExecutionTime/query'] = ret['ExecutionTime/query'] / float(snapshot.commits)
-        ret['Memory/query'] = ret['Memory/query'] / float(snapshot.commits)
-        ret['QueuedTime/query'] = ret['QueuedTime/query'] / float(snapshot.commits)
-        return ret
-
 class Columns58(MemSqlColumnsMetadata):
     def __init__(self):
         sort_keys = iter(map(lambda x: "f%d" % x, range(1, 13)))
@@ -222,114 +382,207 @@ class Columns58(MemSqlColumnsMetadata):
                 width_weight=2),
             ColumnMetadata("Cpu/s",
                 "cpu_time_ms",
+                normalize=NORMALIZE_PER_SECOND,
+                scale=0.001,
                 humanize=HumanizePercent,
                 colorize=GetColorizeFunc(0.10),
                 sort_key=next(sort_keys),
                 help="Sum cpu utilization across the cluster"),
             ColumnMetadata("Mem/s",
                 "memory_bs",
+                normalize=NORMALIZE_PER_SECOND,
                 humanize=HumanizeBytes,
                 colorize=GetColorizeFunc(128*1024),
                 sort_key=next(sort_keys),
                 help="Memory bytes used in the past second"),
              ColumnMetadata("Disk/s",
                 "disk_b",
+                normalize=NORMALIZE_PER_SECOND,
                 humanize=HumanizeBytes,
                 colorize=GetColorizeFunc(128*1024),
                 sort_key=next(sort_keys),
                 help="Disk bytes in the past second"),
               ColumnMetadata("Net/s",
                 "network_b",
+                normalize=NORMALIZE_PER_SECOND,
                 humanize=HumanizeBytes,
                 colorize=GetColorizeFunc(128*1024),
                 sort_key=next(sort_keys),
                 help="Network bytes in the past second"),
             ColumnMetadata("Pf/s",
                 "memory_major_faults",
+                normalize=NORMALIZE_PER_SECOND,
                 humanize=HumanizeCount,
                 colorize=GetColorizeFunc(1),
                 help="Sum page faults across the closter"),
             ColumnMetadata("Lat/q",
                 "elapsed_time_ms",
+                normalize=NORMALIZE_PER_EXECUTION,
                 humanize=HumanizeTime,
                 colorize=GetColorizeFunc(1000),
                 help="Latency per query"),
             ColumnMetadata("Cpu/q",
                 "cpu_time_ms",
+                normalize=NORMALIZE_PER_EXECUTION,
                 humanize=HumanizeTime,
                 colorize=GetColorizeFunc(5),
                 help="Cpu time per query"),
             ColumnMetadata("CpuW/q",
                 "cpu_wait_time_ms",
+                normalize=NORMALIZE_PER_EXECUTION,
                 humanize=HumanizeTime,
                 colorize=GetColorizeFunc(2),
                 help="Cpu wait per query"),
             ColumnMetadata("LockW/q",
                 "lock_time_ms",
+                normalize=NORMALIZE_PER_EXECUTION,
                 humanize=HumanizeTime,
                 colorize=GetColorizeFunc(5),
                 help="Lock wait per query"),
             ColumnMetadata("DiskW/q",
                 "disk_time_ms",
+                normalize=NORMALIZE_PER_EXECUTION,
                 humanize=HumanizeTime,
                 colorize=GetColorizeFunc(5),
                 help="Disk wait per query"),
             ColumnMetadata("NetW/q",
                 "network_time_ms",
+                normalize=NORMALIZE_PER_EXECUTION,
                 humanize=HumanizeTime,
                 colorize=GetColorizeFunc(5),
                 help="Network wait per query"),
             ColumnMetadata("Run",
                 "run_count",
+                normalize=NORMALIZE_GAUGE,
                 humanize=HumanizeCount,
                 colorize=GetColorizeFunc(10),
                 sort_key=next(sort_keys),
                 help="Currently running"),
             ColumnMetadata("Done/s",
                 "success_count + failure_count",
+                normalize=NORMALIZE_PER_SECOND,
                 humanize=HumanizeCount,
                 colorize=GetColorizeFunc(10),
                 sort_key=next(sort_keys),
                 help="Finished running"),
-      ]), "Cpu/s", "Name", LooseVersion("5.8"))
+      ] + LatencyQuantileColumns(next(sort_keys)) +
+          [ChangeColumn(next(sort_keys))]),
+           "Cpu/s", "Name", LooseVersion("5.8"),
+           ["run_count", "success_count + failure_count"],
+           ("Lat/q", "Done/s"), "Change",
+           ["Type", "Database", "Name", "Cpu/s", "Mem/s", "Lat/q", "Run",
+            "Done/s", "CpuW/q", "Pf/s"],
+           [("narrow", ["Database", "Name", "Cpu/s", "Lat/q", "Done/s",
+                        "Change"]),
+            ("latency", ["Database", "Name", "Cpu/s", "Lat/q", "Done/s",
+                         "p50", "p95", "p99"]),
+            ("waits", ["Database", "Name", "Cpu/s", "Lat/q", "CpuW/q",
+                       "LockW/q", "DiskW/q", "NetW/q"]),
+            ("resources", ["Database", "Name", "Cpu/s", "Mem/s", "Disk/s",
+                           "Net/s", "Pf/s", "Run"])])
 
     def GetAllCounterSnapshots(self, conn):
-        #
-        # We store the parameterized query and deparameterize it in GetPlanCache so
-        # that we can filter out this query.
-        #
+        return dict(self.IterCounterSnapshots(conn))
+
+    def IterCounterSnapshots(self, conn):
+        # Only the fetched columns are selected (see Project), once each.
         GET_PLANCACHE_QUERY = "select " + \
-            ", ".join("%s" % (c.memsql_column_name)
-                      for c in self.columns.values()) + \
+            ", ".join(RawColumns(self.fetched)[0]) + \
             " from mv_activities_cumulative"
 
-        rows = conn.query(GET_PLANCACHE_QUERY)
-        return {
-            (r.activity_type, r.database_name, r.activity_name): r
-            for r in rows
-        }
-
-    def GetPopUpText(self, conn, name):
-        rows = [r for r in conn.query("select query_text q from mv_queries where activity_name = '%s'" % name)]
+        return (((r.activity_type, r.database_name, r.activity_name), r)
+                for r in conn.query_stream(GET_PLANCACHE_QUERY))
+
+    def GetOwnActivityKeys(self, conn):
+        return frozenset(tuple(r) for r in conn.query_rows(
+            "select a.activity_type, a.database_name, a.activity_name "
+            "from mv_activities_cumulative a join mv_queries q "
+            "on a.activity_name = q.activity_name "
+            "where q.query_text like '%%%s%%'" % QUERY_TAG))
+
+    def DescribeOverhead(self, deltas):
+        done = sum(d['Done/s'] or 0 for d in deltas)
+        lat = None
+        if done:
+            lat = sum((d['Lat/q'] or 0) * (d['Done/s'] or 0)
+                      for d in deltas) / done
+        return "%s cpu, %s/s mem, %s/query" % (
+            HumanizePercent(sum(d['Cpu/s'] or 0 for d in deltas)),
+            HumanizeBytes(sum(d['Mem/s'] or 0 for d in deltas)),
+            HumanizeTime(lat) or "-")
+
+    def GetPopUpText(self, conn, name, query_cache=None):
+        if query_cache is not None:
+            cleaned = query_cache.get_cleaned(name)
+            if cleaned is not None:
+                return cleaned
+
+        rows = [r for r in conn.query("select query_text q from mv_queries where activity_name = '%s'" % name.replace("'", "''"))]
         assert len(rows) <= 1
         if len(rows) == 1:
-            return rows[0].q
+            if query_cache is not None:
+                query_cache.put(name, rows[0].q)
+                return query_cache.get_cleaned(name)
+            return CleanQuery(rows[0].q)
         else:
             return name
 
+    def WarmQueryCache(self, conn, query_cache):
+        query_cache.put_many(
+            (r.n, r.q) for r in
+            conn.query("select activity_name n, query_text q from mv_queries"))
+        query_cache.flush()
+
+    def ShapeName(self, raw):
+        return raw.activity_name
+
+    def GetQueryTexts(self, conn, rows, query_cache=None):
+        names = set(r.activity_name for r in rows)
+        texts = {}
+        if query_cache is not None:
+            texts = query_cache.get_many(names)
+        # Only look up the names the cache does not have.
+        names = sorted(names.difference(texts))
+        for i in range(0, len(names), QUERY_TEXT_BATCH):
+            found = [(r.n, r.q) for r in conn.query(
+                "select activity_name n, query_text q from mv_queries "
+                "where activity_name in (%s)" % ", ".join(
+                    "'%s'" % n.replace("'", "''")
+                    for n in names[i:i + QUERY_TEXT_BATCH]))]
+            texts.update(found)
+            if query_cache is not None:
+                query_cache.put_many(found)
+        return texts
+
     def CheckSupported(self, conn):
-        if not conn.get('select @@forward_aggregator_plan_hash as f').f:
+        # Probe both variables in one round trip.
+        r = conn.get("select @@forward_aggregator_plan_hash as f, "
+                     "@@read_advanced_counters as r")
+        if not r.f:
             sys.exit("forward_aggregator_plan_hash is required")
 
-        if not conn.get("select @@read_advanced_counters as r").r:
+        if not r.r:
             logging.warn("Cannot read advanced counters.")
             logging.warn("Run `set global read_advanced_counters = ON` on all nodes in the cluster for the best experience.")
 
     def IsDeltaInteresting(self, delta):
         return delta.run_count > 0 or delta['success_count + failure_count'] > 0
 
-    def GetCpuTotalFromAllDeltas(self, allDeltas):
-        return sum(d['Cpu/s'] if d['Cpu/s'] is not None else 0 for d in allDeltas.values())
+    def GetResourceTotalsFromAllDeltas(self, allDeltas):
+        """
+        Returns the cluster's cpu utilization, milliseconds of waiting for a
+        cpu per second and major page faults per second, in one pass over
+        the deltas.
+        """
+        cpu = wait = faults = 0.0
+        for d in allDeltas.values():
+            if d['Cpu/s'] is not None:
+                cpu += d['Cpu/s']
+            if d['CpuW/q'] is not None and d['Done/s'] is not None:
+                wait += d['CpuW/q'] * d['Done/s']
+            if d['Pf/s'] is not None:
+                faults += d['Pf/s']
+        return cpu, wait, faults
 
     def GetMaxCpuTotal(self, conn):
         return float(conn.get("select sum(num_cpus) s from mv_nodes").s)
@@ -337,50 +590,298 @@ class Columns58(MemSqlColumnsMetadata):
     def GetMaxMemTotal(self, conn):
         return float(conn.get("select sum(max_memory_mb) m from mv_nodes").m)
 
+    def GetMaxResourceTotals(self, conn):
+        r = conn.get("select sum(num_cpus) s, sum(max_memory_mb) m from mv_nodes")
+        return float(r.s), float(r.m)
+
     def GetCurrentMemTotal(self, conn):
         return float(conn.get("select sum(memory_used_mb) m from mv_nodes").m)
 
-    def NormalizeCounterDelta(self, snapshot, interval):
-        snapkeys = set(snapshot.keys())
-        colnames = set(c.memsql_column_name for c in self.columns.values())
-
-        assert snapkeys >= colnames, (snapkeys - colnames, colnames - snapkeys)
-
-        ret = AttrDict({})
-        for meta in self.columns.values():
-            snapval = snapshot[meta.memsql_column_name]
-            if isinstance(snapval, (int, Decimal)):
-                ret[meta.name] = float(snapshot[meta.memsql_column_name])
-            else:
-                ret[meta.name] = snapval
-
-        # od = opt div
-        def od(v, d):
-            return v/d if v is not None else v
-
-        commits = float(snapshot.run_count + snapshot['success_count + failure_count'])
-        # Divide by 1000ms to convert to %.
-        ret['Cpu/s'] = od(od(ret['Cpu/s'], 1000.0), interval)
-        ret['Disk/s'] = od(ret['Disk/s'], interval)
-        ret['Mem/s'] = od(ret['Mem/s'], interval)
-        ret['Pf/s'] = od(ret['Pf/s'], interval)
-        ret['Net/s'] = od(ret['Net/s'], interval)
-        ret['Done/s'] = od(ret['Done/s'], interval)
-        ret['Lat/q'] = od(ret['Lat/q'], commits)
-        ret['Cpu/q'] = od(ret['Cpu/q'], commits)
-        ret['CpuW/q'] = od(ret['CpuW/q'], commits)
-        ret['LockW/q'] = od(ret['LockW/q'], commits)
-        ret['DiskW/q'] = od(ret['DiskW/q'], commits)
-        ret['NetW/q'] = od(ret['NetW/q'], commits)
-
-        return ret
+class TableColumns(MemSqlColumnsMetadata):
+    """
+    Columns of a view that shows one row per row of a system table, rather
+    than counter deltas. Subclasses provide the columns, the table and the
+    columns that identify a row.
+    """
+    __slots__ = ['from_clause', 'key_columns']
+
+    def __init__(self, columns, from_clause, key_columns, default_sort_key,
+                 focus_column, minimum_version):
+        super(TableColumns, self).__init__(
+            OrderedDict((cm.name, cm) for cm in columns),
+            default_sort_key, focus_column, minimum_version)
+        self.from_clause = from_clause
+        self.key_columns = key_columns
+
+    def GetSnapshotQuery(self):
+        return "select " + \
+            ", ".join(c.memsql_column_name for c in self.columns.values()) + \
+            " from " + self.from_clause
+
+    def GetKeyIndexes(self):
+        names = list(self.columns.keys())
+        return [names.index(k) for k in self.key_columns]
+
+    def MakeEntry(self, row):
+        """
+        Converts a row of GetSnapshotQuery, as a tuple, into an entry.
+        """
+        return AttrDict(
+            (name, float(v) if isinstance(v, Decimal) else v)
+            for name, v in zip(self.columns.keys(), row))
+
+    def GetSnapshot(self, conn):
+        key_indexes = self.GetKeyIndexes()
+        return {
+            tuple(r[i] for i in key_indexes): self.MakeEntry(r)
+            for r in conn.query_rows(self.GetSnapshotQuery())
+        }
+
+    def GetPopUpText(self, conn, name, query_cache=None):
+        return name if name is not None else ""
 
-def DetectColumnsMetaOrExit(conn):
-    memsql_version = LooseVersion(conn.get("select @@memsql_version as v").v)
+class NodesColumns58(TableColumns):
+    def __init__(self):
+        sort_keys = iter(map(lambda x: "f%d" % x, range(1, 13)))
+        super(NodesColumns58, self).__init__([
+            ColumnMetadata("Id",
+                "id",
+                help="Node id"),
+            ColumnMetadata("Type",
+                "type",
+                help="Node type"),
+            ColumnMetadata("State",
+                "state",
+                help="Node state"),
+            ColumnMetadata("Host",
+                "concat(ip_addr, ':', port)",
+                width_weight=1,
+                help="Node address"),
+            ColumnMetadata("Cpus",
+                "num_cpus",
+                normalize=NORMALIZE_GAUGE,
+                humanize=HumanizeCount,
+                colorize=GetColorizeFunc(1000),
+                sort_key=next(sort_keys),
+                help="Number of cpus"),
+            ColumnMetadata("MaxMem",
+                "max_memory_mb * 1048576",
+                normalize=NORMALIZE_GAUGE,
+                humanize=HumanizeBytes,
+                colorize=GetColorizeFunc(1024 ** 5),
+                sort_key=next(sort_keys),
+                help="Maximum memory"),
+            ColumnMetadata("Mem",
+                "memory_used_mb * 1048576",
+                normalize=NORMALIZE_GAUGE,
+                humanize=HumanizeBytes,
+                colorize=GetColorizeFunc(1024 ** 3),
+                sort_key=next(sort_keys),
+                help="Memory used"),
+            ColumnMetadata("TableMem",
+                "table_memory_used_mb * 1048576",
+                normalize=NORMALIZE_GAUGE,
+                humanize=HumanizeBytes,
+                colorize=GetColorizeFunc(1024 ** 3),
+                sort_key=next(sort_keys),
+                help="Memory used by tables"),
+            ColumnMetadata("Uptime",
+                "uptime * 1000",
+                normalize=NORMALIZE_GAUGE,
+                humanize=HumanizeTime,
+                colorize=GetColorizeFunc(1000 ** 5),
+                sort_key=next(sort_keys),
+                help="Time since the node started"),
+        ], "mv_nodes", ["Id"], "Mem", "Host", LooseVersion("5.8"))
+
+class ProcesslistColumns(TableColumns):
+    """
+    Queries running on the aggregator we are connected to; idle connections
+    are left out. The elapsed time is the default sort, so long running
+    queries are at the top.
+    """
+    def __init__(self):
+        sort_keys = iter(map(lambda x: "f%d" % x, range(1, 13)))
+        super(ProcesslistColumns, self).__init__([
+            ColumnMetadata("Id",
+                "id",
+                help="Connection id"),
+            ColumnMetadata("User",
+                "user",
+                help="User"),
+            ColumnMetadata("Host",
+                "host",
+                help="Client host"),
+            ColumnMetadata("Database",
+                "db",
+                help="Database name"),
+            ColumnMetadata("Command",
+                "command",
+                help="Command"),
+            ColumnMetadata("Time",
+                "time * 1000",
+                normalize=NORMALIZE_GAUGE,
+                humanize=HumanizeTime,
+                colorize=GetColorizeFunc(1000),
+                sort_key=next(sort_keys),
+                help="Time in the current state"),
+            ColumnMetadata("State",
+                "state",
+                help="Connection state"),
+            ColumnMetadata("Info",
+                "info",
+                width_weight=1,
+                humanize=lambda q: CleanQuery(q) if q is not None else "",
+                help="Running query"),
+        ], "processlist where command != 'Sleep' and id != connection_id()",
+           ["Id"], "Time", "Info", LooseVersion("5.7"))
+
+class PipelinesColumns(MemSqlColumnsMetadata):
+    """
+    Per-pipeline ingest counters. The counters are accumulated from the
+    batches in pipelines_batches_summary (see pipelines.PipelinesPoller) and
+    then diffed and normalized like the activity counters.
+    """
+    def __init__(self):
+        sort_keys = iter(map(lambda x: "f%d" % x, range(1, 13)))
+        super(PipelinesColumns, self).__init__(OrderedDict((cm.name, cm) for cm in [
+            ColumnMetadata("Database",
+                "database_name",
+                help="Database name"),
+            ColumnMetadata("Pipeline",
+                "pipeline_name",
+                width_weight=1,
+                help="Pipeline name"),
+            ColumnMetadata("Rows/s",
+                "rows",
+                normalize=NORMALIZE_PER_SECOND,
+                humanize=HumanizeCount,
+                colorize=GetColorizeFunc(1000),
+                sort_key=next(sort_keys),
+                help="Rows loaded per second"),
+            ColumnMetadata("Bytes/s",
+                "bytes",
+                normalize=NORMALIZE_PER_SECOND,
+                humanize=HumanizeBytes,
+                colorize=GetColorizeFunc(1024*1024),
+                sort_key=next(sort_keys),
+                help="Bytes loaded per second"),
+            ColumnMetadata("Batches/s",
+                "batches",
+                normalize=NORMALIZE_PER_SECOND,
+                humanize=HumanizeCount,
+                colorize=GetColorizeFunc(1),
+                sort_key=next(sort_keys),
+                help="Batches finished per second"),
+            ColumnMetadata("Lat/batch",
+                "batch_time_ms",
+                normalize=NORMALIZE_PER_EXECUTION,
+                humanize=HumanizeTime,
+                colorize=GetColorizeFunc(1000),
+                sort_key=next(sort_keys),
+                help="Average batch latency"),
+            ColumnMetadata("Failed/s",
+                "failures",
+                normalize=NORMALIZE_PER_SECOND,
+                humanize=HumanizeCount,
+                colorize=GetColorizeFunc(0.01),
+                sort_key=next(sort_keys),
+                help="Failed batches per second"),
+        ]), "Rows/s", "Pipeline", LooseVersion("5.8"), ["batches"])
+
+    def GetPopUpText(self, conn, name, query_cache=None):
+        return name
+
+    def IsDeltaInteresting(self, delta):
+        return delta.batches > 0 or delta.failures > 0
+
+class DatabaseLatencyColumns(MemSqlColumnsMetadata):
+    """
+    Latency quantiles per database, merged from the sketches of all of its
+    activities (see sketches.LatencySketches).
+    """
+    def __init__(self):
+        sort_keys = iter(map(lambda x: "f%d" % x, range(1, 13)))
+        super(DatabaseLatencyColumns, self).__init__(OrderedDict((cm.name, cm) for cm in [
+            ColumnMetadata("Database",
+                "database_name",
+                width_weight=1,
+                help="Database name"),
+            ColumnMetadata("Activities",
+                "activities",
+                normalize=NORMALIZE_GAUGE,
+                humanize=HumanizeCount,
+                colorize=GetColorizeFunc(1000),
+                sort_key=next(sort_keys),
+                help="Number of activities with a latency sketch"),
+        ] + [ColumnMetadata(c.name,
+                c.name,
+                normalize=NORMALIZE_GAUGE,
+                quantile=c.quantile,
+                humanize=c.humanize,
+                colorize=c.colorize,
+                sort_key=next(sort_keys),
+                help=c.help)
+             for c in LatencyQuantileColumns(None)]),
+           "p99", "Database", LooseVersion("5.7"))
+
+    def GetPopUpText(self, conn, name, query_cache=None):
+        return name
+
+class BlockingColumns(MemSqlColumnsMetadata):
+    """
+    Columns of the blocking chains view. Rows are shown in tree order, so
+    there is no sort column.
+    """
+    def __init__(self):
+        super(BlockingColumns, self).__init__(OrderedDict((cm.name, cm) for cm in [
+            ColumnMetadata("Session",
+                "session",
+                width_weight=1,
+                help="Blocked or blocking session, indented under its blocker"),
+            ColumnMetadata("Wait",
+                "wait_ms",
+                normalize=NORMALIZE_GAUGE,
+                humanize=HumanizeTime,
+                colorize=GetColorizeFunc(100),
+                help="How long this session has been blocked"),
+            ColumnMetadata("Blocked",
+                "blocked_ms",
+                normalize=NORMALIZE_GAUGE,
+                humanize=HumanizeTime,
+                colorize=GetColorizeFunc(100),
+                help="Total wait of the sessions blocked behind this one"),
+            ColumnMetadata("Waiters",
+                "waiters",
+                normalize=NORMALIZE_GAUGE,
+                humanize=HumanizeCount,
+                colorize=GetColorizeFunc(10),
+                help="Number of sessions blocked behind this one"),
+            ColumnMetadata("Database",
+                "database_name",
+                help="Database name"),
+            ColumnMetadata("Query",
+                "query_text",
+                width_weight=3,
+                humanize=lambda q: CleanQuery(q) if q else "",
+                help="Blocked query"),
+        ]), None, "Query", LooseVersion("5.7"))
+
+    def GetPopUpText(self, conn, name, query_cache=None):
+        return name or ""
+
+def GetColumnsMetaForVersion(memsql_version):
     versionsSupported = [Columns58(), Columns57()]
 
     for version in versionsSupported:
-        if memsql_version >= version.minimum_version:
-            version.CheckSupported(conn)
+        if LooseVersion(memsql_version) >= version.minimum_version:
             return version
-    sys.exit("memsql 5.7 or above is required -- got %s" % memsql_version)
+    return None
+
+def DetectColumnsMetaOrExit(conn):
+    memsql_version = conn.get("select @@memsql_version as v").v
+    version = GetColumnsMetaForVersion(memsql_version)
+    if version is None:
+        sys.exit("memsql 5.7 or above is required -- got %s" % memsql_version)
+    version.CheckSupported(conn)
+    return version
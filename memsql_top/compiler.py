@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+from attrdict import AttrDict
+
+#
+# How a column's raw value becomes the value that is shown:
+#
+#   NORMALIZE_TEXT           passed through as is (names, query text).
+#   NORMALIZE_GAUGE          a current value, converted to float.
+#   NORMALIZE_PER_SECOND     a counter; its delta is divided by the interval.
+#   NORMALIZE_PER_EXECUTION  a counter; its delta is divided by the number of
+#                            executions in the interval.
+#   NORMALIZE_QUANTILE       not read from MemSQL; a quantile of another
+#                            column, filled in by the poller (see sketches).
+#   NORMALIZE_CHANGE         not read from MemSQL; how far the other columns
+#                            are from their trailing baseline, filled in by
+#                            the poller (see regression).
+#
+# Every numeric kind is also multiplied by the column's scale.
+#
+NORMALIZE_TEXT = "text"
+NORMALIZE_GAUGE = "gauge"
+NORMALIZE_PER_SECOND = "per_second"
+NORMALIZE_PER_EXECUTION = "per_execution"
+NORMALIZE_QUANTILE = "quantile"
+NORMALIZE_CHANGE = "change"
+
+COUNTER_KINDS = (NORMALIZE_PER_SECOND, NORMALIZE_PER_EXECUTION)
+DERIVED_KINDS = (NORMALIZE_QUANTILE, NORMALIZE_CHANGE)
+
+
+def CompileFunction(name, lines):
+    source = "\n".join(lines) + "\n"
+    namespace = {"AttrDict": AttrDict}
+    exec(compile(source, "<%s>" % name, "exec"), namespace)
+    return namespace[name]
+
+
+def RawColumns(columns):
+    """
+    Returns the distinct raw column names in order, and the kind of each;
+    several columns may be computed from the same raw column.
+    """
+    kinds = {}
+    for meta in columns.values():
+        if meta.memsql_column_name is None:
+            continue
+        kind = kinds.get(meta.memsql_column_name)
+        if kind is None or meta.normalize in COUNTER_KINDS:
+            kinds[meta.memsql_column_name] = meta.normalize
+    names = []
+    for meta in columns.values():
+        if meta.memsql_column_name is not None and \
+                meta.memsql_column_name not in names:
+            names.append(meta.memsql_column_name)
+    return names, kinds
+
+
+def CompileDiffCounters(columns):
+    """
+    Returns DiffCounters(new, old), which subtracts the counters of the old
+    snapshot of an activity from the new one and passes everything else
+    through. Counters that went backwards (e.g. the plancache was flushed)
+    give 0.
+    """
+    names, kinds = RawColumns(columns)
+    lines = ["def DiffCounters(new, old):"]
+    fields = []
+    for i, name in enumerate(names):
+        if kinds[name] in COUNTER_KINDS:
+            lines.append("    a%d = new[%r]" % (i, name))
+            lines.append("    b%d = old[%r]" % (i, name))
+            lines.append("    if a%d is not None and b%d is not None:" % (i, i))
+            lines.append("        a%d = a%d - b%d if a%d >= b%d else 0" %
+                         (i, i, i, i, i))
+            fields.append("%r: a%d" % (name, i))
+        else:
+            fields.append("%r: new[%r]" % (name, name))
+    lines.append("    return AttrDict({%s})" % ", ".join(fields))
+    return CompileFunction("DiffCounters", lines)
+
+
+def CompileNormalizeCounterDelta(columns, executions):
+    """
+    Returns NormalizeCounterDelta(snapshot, interval), which turns a counter
+    delta into the values shown for each column. executions are the raw
+    columns whose sum is the number of executions in the interval.
+
+    The function is generated from the columns' normalization kinds, so the
+    work done per row is exactly the arithmetic the columns need.
+    """
+    names, _ = RawColumns(columns)
+    var = dict((name, "v%d" % i) for i, name in enumerate(names))
+
+    lines = ["def NormalizeCounterDelta(snapshot, interval):"]
+    for name in names:
+        lines.append("    %s = snapshot[%r]" % (var[name], name))
+    if any(m.normalize == NORMALIZE_PER_EXECUTION for m in columns.values()):
+        lines.append("    executions = float(%s)" % " + ".join(
+            "snapshot[%r]" % e for e in executions))
+
+    fields = []
+    for meta in columns.values():
+        if meta.normalize in DERIVED_KINDS:
+            fields.append("%r: None" % meta.name)
+            continue
+        v = var[meta.memsql_column_name]
+        scale = "" if meta.scale == 1 else " * %r" % meta.scale
+        if meta.normalize == NORMALIZE_TEXT:
+            expr = v
+        elif meta.normalize == NORMALIZE_GAUGE:
+            expr = "None if %s is None else float(%s)%s" % (v, v, scale)
+        elif meta.normalize == NORMALIZE_PER_SECOND:
+            expr = "None if %s is None else float(%s)%s / interval" % \
+                (v, v, scale)
+        elif meta.normalize == NORMALIZE_PER_EXECUTION:
+            expr = "None if %s is None or not executions else " \
+                "float(%s)%s / executions" % (v, v, scale)
+        else:
+            raise ValueError("Unknown normalization %r for column %s" %
+                             (meta.normalize, meta.name))
+        fields.append("%r: %s" % (meta.name, expr))
+    lines.append("    return AttrDict({%s})" % ", ".join(fields))
+    return CompileFunction("NormalizeCounterDelta", lines)
@@ -20,6 +20,17 @@ from attrdict import AttrDict
 import pymysql
 import pymysql.cursors
 
+#
+# Every query memsql-top runs starts with this comment, so that its own
+# activities can be picked out of the plancache on the server.
+#
+QUERY_TAG = "/* memsql-top */"
+
+
+def TagQuery(query):
+    return QUERY_TAG + " " + query
+
+
 class Connection(object):
     def __init__(self, host, port, database, user, password):
         self.conn = pymysql.connect(host=host, port=port, db=database,
@@ -29,16 +40,41 @@ class Connection(object):
 
     def get(self, query):
         with self.conn.cursor() as cursor:
-            cursor.execute(query)
+            cursor.execute(TagQuery(query))
             return AttrDict(cursor.fetchone())
 
     def query(self, query):
         with self.conn.cursor() as cursor:
-            cursor.execute(query)
+            cursor.execute(TagQuery(query))
             r = cursor.fetchone()
             while r:
                 yield AttrDict(r)
                 r = cursor.fetchone()
 
+    def query_stream(self, query):
+        """
+        Like query, but the rows are read from the server as they are
+        consumed instead of all being buffered first, so a large result
+        never has to fit in memory at once. The rows must all be consumed
+        (or the generator closed) before the next query on this connection.
+        """
+        with self.conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute(TagQuery(query))
+            for r in cursor:
+                yield AttrDict(r)
+
+    def query_rows(self, query):
+        """
+        Returns the result rows as plain tuples, which is much cheaper than
+        building an AttrDict per row for large results.
+        """
+        with self.conn.cursor(pymysql.cursors.Cursor) as cursor:
+            cursor.execute(TagQuery(query))
+            return cursor.fetchall()
+
+    def execute(self, query):
+        with self.conn.cursor() as cursor:
+            cursor.execute(TagQuery(query))
+
 def connect(host='127.0.0.1', port=3306, database="", user="root", password=""):
     return Connection(host, port, database, user, password)
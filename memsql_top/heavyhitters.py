@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import math
+
+from array import array
+from attrdict import AttrDict
+
+#
+# How --max-memory-mb is split between the structures that grow with the
+# number of distinct activities. HITTERS_SHARE goes to HeavyHitters; each
+# of the others is capped to as many entries as fit in its share, at about
+# the given bytes per entry.
+#
+HITTERS_SHARE = 0.6
+ENTRY_SHARES = [
+    # (name, share, bytes per entry)
+    ("baselines", 0.15, 640),
+    ("sketches", 0.1, 700),
+    ("fingerprints", 0.05, 400),
+    ("query_texts", 0.1, 2048),
+]
+
+#
+# How the memory of HeavyHitters is split: half for the exact snapshots of
+# the tracked activities, at about BYTES_PER_ACTIVITY each, and half for the
+# DEPTH rows of float64 counters of the tail sketch.
+#
+BYTES_PER_ACTIVITY = 2048
+DEPTH = 4
+
+#
+# The key of the row that aggregates all the activities that are not
+# tracked exactly.
+#
+OTHER_KEY = None
+
+
+def MemoryBudget(max_bytes):
+    """
+    Returns the bytes for HeavyHitters and the maximum number of entries of
+    each of the other structures, by name, out of max_bytes.
+    """
+    budget = {"hitters": int(max_bytes * HITTERS_SHARE)}
+    for name, share, entry_bytes in ENTRY_SHARES:
+        budget[name] = max(1, int(max_bytes * share) // entry_bytes)
+    return budget
+
+
+class CountMinMax(object):
+    """
+    A count-min sketch of the last value of monotonic counters: updates
+    raise the key's cells to the new value instead of adding to them. An
+    estimate is never below the key's last value. With probability at least
+    1 - e ** -depth it is at most error() above it.
+    """
+    def __init__(self, width, depth=DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('d', [0.0] * width) for _ in range(depth)]
+        self.total = 0.0
+
+    def cells(self, key):
+        return [hash((i, key)) % self.width for i in range(self.depth)]
+
+    def estimate(self, cells):
+        return min(row[c] for row, c in zip(self.rows, cells))
+
+    def update(self, cells, value):
+        previous = self.estimate(cells)
+        if value > previous:
+            self.total += value - previous
+        for row, c in zip(self.rows, cells):
+            if row[c] < value:
+                row[c] = value
+
+    def error(self):
+        return math.e / self.width * self.total
+
+
+class HeavyHitters(object):
+    """
+    Bounds the memory needed to diff the activity counters.
+
+    Only the capacity activities with the largest deltas of the rank column
+    (the default sort column) keep their whole previous snapshot. For every
+    other activity, only the rank column's counter is kept, in a CountMinMax
+    sketch. The deltas estimated from it are never too large and with high
+    probability at most error() too small. They go into one "other" row,
+    and decide which activities to track instead: like Space-Saving, an
+    untracked activity whose delta beats the smallest tracked delta takes
+    that activity's place. It is shown on its own from the next tick on.
+
+    When an activity's cells are all held up by larger counters of other
+    activities, its estimated delta is meaningless. Its counter is then
+    kept exactly until the next tick (for at most capacity activities), so
+    it gets a real delta and can still be promoted.
+    """
+    def __init__(self, column_meta, max_bytes):
+        self.column_meta = column_meta
+        self.rank_column = column_meta.default_sort_key
+        rank_meta = column_meta.columns[self.rank_column]
+        self.rank_raw = rank_meta.memsql_column_name
+        self.rank_scale = rank_meta.scale
+
+        self.capacity = max(1, max_bytes // 2 // BYTES_PER_ACTIVITY)
+        self.tail = CountMinMax(max(1, max_bytes // 2 // (8 * DEPTH)))
+        self.weights = {}
+        self.collided = {}
+        self.tail_delta = 0.0
+        self.tail_count = 0
+        self.fresh = frozenset()
+
+    def snapshot(self, rows, old_plancache):
+        """
+        Takes the (key, counters) of every activity and the last snapshot
+        this returned. Returns the snapshot of the tracked activities.
+        """
+        rank_raw = self.rank_raw
+        weights = self.weights
+        tail = self.tail
+        collided = self.collided
+        still_collided = {}
+        new_plancache = {}
+        candidates = []
+        tail_delta = 0.0
+        tail_count = 0
+        for key, ent in rows:
+            value = float(ent[rank_raw] or 0)
+            old = old_plancache.get(key)
+            if old is not None:
+                weights[key] = value - float(old[rank_raw] or 0)
+                new_plancache[key] = ent
+                continue
+
+            cells = tail.cells(key)
+            estimate = tail.estimate(cells)
+            previous = collided.get(key)
+            delta = value - (estimate if previous is None else previous)
+            if estimate > value and len(still_collided) < self.capacity:
+                still_collided[key] = value
+            tail.update(cells, value)
+            if delta > 0:
+                tail_delta += delta
+                tail_count += 1
+                candidates.append((delta, key, ent))
+
+        # Forget tracked activities that went away.
+        for key in [k for k in weights if k not in new_plancache]:
+            del weights[key]
+
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        victims = sorted(weights, key=weights.get, reverse=True)
+        fresh = []
+        for delta, key, ent in candidates:
+            if len(weights) >= self.capacity:
+                victim = victims[-1] if victims else None
+                if victim is None or weights[victim] >= delta:
+                    break
+                victims.pop()
+                del weights[victim]
+                tail.update(tail.cells(victim),
+                            float(new_plancache.pop(victim)[rank_raw] or 0))
+            weights[key] = delta
+            new_plancache[key] = ent
+            fresh.append(key)
+
+        for key in fresh:
+            still_collided.pop(key, None)
+        self.collided = still_collided
+        self.tail_delta = tail_delta
+        self.tail_count = tail_count
+        self.fresh = frozenset(fresh)
+        return new_plancache
+
+    def add_other_row(self, diff_plancache, interval):
+        """
+        Drops the activities that were only just tracked from the deltas and
+        adds the "other" row, with the rank column of the untracked ones.
+        """
+        for key in self.fresh:
+            diff_plancache.pop(key, None)
+        if not self.tail_count:
+            return
+
+        ent = AttrDict()
+        for name, meta in self.column_meta.all_columns.items():
+            ent[name] = None if meta.is_numeric() else ""
+        ent[self.column_meta.focus_column] = \
+            "(%d other activities)" % self.tail_count
+        ent[self.rank_column] = self.tail_delta * self.rank_scale / interval
+        diff_plancache[OTHER_KEY] = ent
+
+    def describe(self, interval):
+        rank_meta = self.column_meta.columns[self.rank_column]
+        error = self.tail.error() * self.rank_scale / interval
+        return "top %d exact, other %s within %s each" % (
+            self.capacity, self.rank_column, rank_meta.humanize(error))
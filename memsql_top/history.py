@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from attrdict import AttrDict
+
+from .columns import GetColumnsMetaForVersion
+from .compiler import NORMALIZE_GAUGE, NORMALIZE_PER_SECOND
+
+#
+# (table, bucket seconds, retention seconds). Each tier is rolled up from the
+# one before it once a bucket is complete.
+#
+TIERS = [
+    ("samples_raw", None, 60 * 60),
+    ("samples_1m", 60, 24 * 60 * 60),
+    ("samples_10m", 10 * 60, 30 * 24 * 60 * 60),
+]
+
+KEY_SEPARATOR = "\x1f"
+
+#
+# Columns that are rates or levels over time. An activity that is missing
+# from a tick was idle, so these average over every tick of a bucket, with
+# the missing ticks as 0. Per execution columns only average over the ticks
+# the activity was seen in.
+#
+TIME_WEIGHTED_KINDS = (NORMALIZE_GAUGE, NORMALIZE_PER_SECOND)
+
+# How often rollups, retention and the disk cap are enforced.
+MAINTENANCE_INTERVAL = 60
+
+
+def QuoteName(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def FormatKey(key):
+    if isinstance(key, tuple):
+        return KEY_SEPARATOR.join(str(k) for k in key)
+    return str(key)
+
+
+class HistorySchema(object):
+    """
+    The per-activity delta tables for one MemSQL version. Every tier has the
+    same layout: the bucket start time, the activity key, the number of ticks
+    folded into the row and one column per ColumnMetadata. Each tier also
+    has a TIER_ticks table with the number of ticks in each of its buckets,
+    whether or not any activity was seen in them.
+    """
+    def __init__(self, column_meta, recorded=None):
+        # Only the recorded columns, if given, are read back.
+        self.column_meta = column_meta
+        self.names = [n for n in column_meta.columns
+                      if recorded is None or n in recorded]
+        self.numeric = [n for n, c in column_meta.columns.items()
+                        if c.is_numeric()]
+        self.time_weighted = [n for n, c in column_meta.columns.items()
+                              if c.normalize in TIME_WEIGHTED_KINDS]
+
+    def create(self, db):
+        db.execute("create table if not exists meta "
+                   "(name text primary key, value text)")
+        for table, _, _ in TIERS:
+            db.execute("create table if not exists %s "
+                       "(ts real, key text, samples integer, %s)" %
+                       (table, ", ".join(QuoteName(n) for n in self.names)))
+            db.execute("create index if not exists %s_ts on %s (ts)" %
+                       (table, table))
+            db.execute("create table if not exists %s_ticks "
+                       "(ts real primary key, samples integer)" % table)
+            # Files written before there were tick tables: assume every
+            # bucket had as many ticks as its most active activity.
+            db.execute("insert or ignore into %s_ticks "
+                       "select ts, max(samples) from %s group by ts" %
+                       (table, table))
+
+    def migrate(self, db):
+        """
+        Adds the columns that the tables of an existing file were created
+        without, e.g. by an older memsql-top. Returns every recorded column.
+        """
+        recorded = []
+        for table, _, _ in TIERS:
+            present = [r[1] for r in db.execute(
+                "pragma table_info(%s)" % table)][3:]
+            for name in self.names:
+                if name not in present:
+                    db.execute("alter table %s add column %s" %
+                               (table, QuoteName(name)))
+                    present.append(name)
+            recorded = present
+        return recorded
+
+    def insert_statement(self, table):
+        return "insert into %s (ts, key, samples, %s) values (?, ?, ?, %s)" % (
+            table, ", ".join(QuoteName(n) for n in self.names),
+            ", ".join("?" for _ in self.names))
+
+    def aggregate_list(self, ticks):
+        """
+        Select list that folds a group of rows s, joined with their buckets'
+        ticks t, into one. Time weighted columns are averaged over the ticks
+        expression, the number of ticks the group spans; other numeric
+        columns are averaged over the ticks the activity was seen in.
+        """
+        exprs = []
+        for name in self.names:
+            q = "s." + QuoteName(name)
+            if name in self.time_weighted:
+                exprs.append("sum(%s * t.samples) * 1.0 / %s" % (q, ticks))
+            elif name in self.numeric:
+                exprs.append("sum(%s * s.samples) * 1.0 / sum(s.samples)" % q)
+            else:
+                exprs.append("max(%s)" % q)
+        return ", ".join(exprs)
+
+
+def GetMeta(db, name):
+    row = db.execute("select value from meta where name = ?",
+                     (name,)).fetchone()
+    return row[0] if row else None
+
+
+def GetRecordedColumns(db, path):
+    """
+    Returns the columns a history file says it has recorded, checking that
+    it is a history file at all.
+    """
+    try:
+        columns = json.loads(GetMeta(db, "columns") or "null")
+    except ValueError:
+        columns = None
+    if not isinstance(columns, list) or \
+            not all(isinstance(c, (type(u""), str)) for c in columns):
+        raise ValueError("%s is not a memsql-top history file" % path)
+    return columns
+
+
+def SetMeta(db, name, value):
+    db.execute("insert or replace into meta (name, value) values (?, ?)",
+               (name, value))
+
+
+class HistoryStore(threading.Thread):
+    """
+    Records each tick's normalized deltas into a local SQLite database.
+
+    record() only enqueues the frame, so the poller is never slowed down by
+    disk writes. The writer thread drains everything that is queued and
+    writes it in one transaction, then periodically rolls complete buckets
+    into the coarser tiers, drops data past each tier's retention and trims
+    the oldest data if the database exceeds max_bytes.
+    """
+    def __init__(self, path, column_meta, max_bytes, max_queued=64):
+        self.path = path
+        self.schema = HistorySchema(column_meta)
+        self.max_bytes = max_bytes
+        self.frames = queue.Queue(max_queued)
+        self.last_maintenance = 0
+
+        db = self.open()
+        try:
+            version = GetMeta(db, "version") if self.has_meta(db) else None
+            if version is not None:
+                if version != str(column_meta.minimum_version):
+                    raise ValueError("%s was recorded for MemSQL %s" %
+                                     (path, version))
+                GetRecordedColumns(db, path)
+            self.schema.create(db)
+            recorded = self.schema.migrate(db)
+            SetMeta(db, "version", str(column_meta.minimum_version))
+            SetMeta(db, "columns", json.dumps(recorded))
+            db.commit()
+        finally:
+            db.close()
+
+        super(HistoryStore, self).__init__(name="HistoryStore")
+        self.daemon = True
+
+    def open(self):
+        db = sqlite3.connect(self.path)
+        db.execute("pragma journal_mode = wal")
+        db.execute("pragma synchronous = normal")
+        return db
+
+    def has_meta(self, db):
+        return db.execute("select 1 from sqlite_master where type = 'table' "
+                          "and name = 'meta'").fetchone() is not None
+
+    def record(self, now, diff_plancache):
+        try:
+            self.frames.put_nowait((now, diff_plancache))
+        except queue.Full:
+            logging.warn("History writer is behind -- dropping a frame.")
+
+    def run(self):
+        db = self.open()
+        failing = False
+        while True:
+            frames = [self.frames.get()]
+            while True:
+                try:
+                    frames.append(self.frames.get_nowait())
+                except queue.Empty:
+                    break
+
+            #
+            # A failed write (e.g. a full disk) loses these frames but must
+            # not stop the writer, or every later frame would be dropped
+            # with a warning. Failures are logged once until a write works.
+            #
+            try:
+                self.write(db, frames)
+            except Exception as e:
+                if not failing:
+                    logging.warn("Failed to write history: %s" % e)
+                    failing = True
+                continue
+            if failing:
+                logging.warn("Writing history again.")
+                failing = False
+
+    def write(self, db, frames):
+        insert = self.schema.insert_statement("samples_raw")
+        names = self.schema.names
+        rows = []
+        for now, diff_plancache in frames:
+            for key, ent in diff_plancache.items():
+                row = [now, FormatKey(key), 1]
+                row.extend(ent.get(n) for n in names)
+                rows.append(row)
+
+        with db:
+            db.executemany(insert, rows)
+            db.executemany("insert or replace into samples_raw_ticks "
+                           "values (?, 1)", [(f[0],) for f in frames])
+
+        now = frames[-1][0]
+        if now - self.last_maintenance >= MAINTENANCE_INTERVAL:
+            self.maintain(db, now)
+            self.last_maintenance = now
+
+    def maintain(self, db, now):
+        with db:
+            for (src, _, _), (dst, bucket, _) in zip(TIERS, TIERS[1:]):
+                self.rollup(db, src, dst, bucket, now)
+            for table, _, retention in TIERS:
+                for t in (table, table + "_ticks"):
+                    db.execute("delete from %s where ts < ?" % t,
+                               (now - retention,))
+        self.enforce_max_bytes(db)
+
+    def rollup(self, db, src, dst, bucket, now):
+        done_key = "rolled_up_" + dst
+        start = float(GetMeta(db, done_key) or 0)
+        end = now - now % bucket
+        if end <= start:
+            return
+
+        bucket_of = "cast(%%s.ts / %d as integer) * %d" % (bucket, bucket)
+        db.execute(
+            "insert or replace into %s_ticks select %s as bucket, "
+            "sum(samples) from %s_ticks where ts >= ? and ts < ? "
+            "group by bucket" % (dst, bucket_of % (src + "_ticks"), src),
+            (start, end))
+        db.execute(
+            "insert into %s (ts, key, samples, %s) "
+            "select %s as bucket, s.key, sum(s.samples), %s "
+            "from %s s join %s_ticks t on t.ts = s.ts "
+            "join %s_ticks w on w.ts = %s "
+            "where s.ts >= ? and s.ts < ? group by bucket, s.key" %
+            (dst, ", ".join(QuoteName(n) for n in self.schema.names),
+             bucket_of % "s", self.schema.aggregate_list("max(w.samples)"),
+             src, src, dst, bucket_of % "s"),
+            (start, end))
+        SetMeta(db, done_key, repr(end))
+
+    def used_bytes(self, db):
+        page_size = db.execute("pragma page_size").fetchone()[0]
+        page_count = db.execute("pragma page_count").fetchone()[0]
+        free_count = db.execute("pragma freelist_count").fetchone()[0]
+        return (page_count - free_count) * page_size
+
+    def enforce_max_bytes(self, db):
+        #
+        # Deleted pages are reused by later inserts, so the file stops growing
+        # once we trim; we drop the oldest tenth of the finest non-empty tier
+        # until the live data fits. Raw data that is old enough to trim has
+        # already been rolled up, so the long term tiers go last.
+        #
+        while self.used_bytes(db) > self.max_bytes:
+            for table, _, _ in TIERS:
+                lo, hi = db.execute("select min(ts), max(ts) from %s" %
+                                    table).fetchone()
+                if lo is not None:
+                    break
+            else:
+                return
+
+            with db:
+                for t in (table, table + "_ticks"):
+                    if lo == hi:
+                        db.execute("delete from %s" % t)
+                    else:
+                        db.execute("delete from %s where ts < ?" % t,
+                                   (lo + (hi - lo) / 10.0,))
+
+
+def LoadHistoryWindow(path, since, until):
+    """
+    Returns the column metadata the history was recorded with and the average
+    delta of every activity seen between since and until, in the same form
+    DiffPlanCache produces. The finest tier that still covers since is used.
+    """
+    db = sqlite3.connect(path)
+    try:
+        version = GetMeta(db, "version")
+        if version is None:
+            raise ValueError("%s is not a memsql-top history file" % path)
+        recorded = GetRecordedColumns(db, path)
+        column_meta = GetColumnsMetaForVersion(version)
+        # Show the columns that were recorded, as far as we still know them.
+        known = [n for n in recorded if n in column_meta.all_columns]
+        if not known:
+            raise ValueError("%s has no columns this version can show" % path)
+        column_meta = column_meta.Project(",".join(known))
+        schema = HistorySchema(column_meta, recorded)
+
+        age = time.time() - since
+        table = next((t for t, _, retention in TIERS if age <= retention),
+                     TIERS[-1][0])
+
+        # Files not yet opened for writing since tick tables were added
+        # have none; estimate them as HistorySchema.create would.
+        if db.execute("select 1 from sqlite_master where type = 'table' "
+                      "and name = ?", (table + "_ticks",)).fetchone():
+            ticks_table = table + "_ticks"
+        else:
+            ticks_table = "(select ts, max(samples) as samples from %s " \
+                          "group by ts)" % table
+
+        frame = {}
+        ticks, = db.execute("select sum(samples) from %s "
+                            "where ts >= ? and ts < ?" % ticks_table,
+                            (since, until)).fetchone()
+        if not ticks:
+            return column_meta, frame
+
+        rows = db.execute(
+            "select s.key, %s from %s s join %s t on t.ts = s.ts "
+            "where s.ts >= ? and s.ts < ? group by s.key" %
+            (schema.aggregate_list(repr(float(ticks))), table, ticks_table),
+            (since, until))
+
+        for row in rows:
+            ent = AttrDict((n, None) for n in column_meta.columns)
+            ent.update(zip(schema.names, row[1:]))
+            frame[row[0]] = ent
+        return column_meta, frame
+    finally:
+        db.close()
+
+
+DURATION_RE = re.compile(r"^-?([0-9]*\.?[0-9]+)([smhd])$")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def ParseTime(text, now=None):
+    """
+    Parses `now`, a duration ago (`90s`, `-30m`, `2h`, `1d`), unix seconds or
+    a local `YYYY-MM-DD HH:MM[:SS]` time into unix seconds.
+    """
+    if now is None:
+        now = time.time()
+    text = text.strip()
+
+    if text == "now":
+        return now
+
+    m = DURATION_RE.match(text)
+    if m:
+        return now - float(m.group(1)) * DURATION_UNITS[m.group(2)]
+
+    try:
+        return float(text)
+    except ValueError:
+        pass
+
+    for fmt in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]:
+        try:
+            return time.mktime(time.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise ValueError("cannot parse time %r" % text)
@@ -34,6 +34,103 @@ def CleanQuery(query):
     return query
 
 
+#
+# The tokens of a query, in one pass: each match is exactly one of the named
+# groups. Anything else (operators, punctuation) is a single character.
+#
+QUERY_TOKENS = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<string>'(?:[^'\\]|\\.|'')*'?|"(?:[^"\\]|\\.|"")*"?)
+  | (?P<quoted>`(?:[^`]|``)*`?)
+  | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<variable>@@?[\w.$]+)
+  | (?P<param>[?@])
+  | (?P<word>[^\W\d][\w$]*)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+LITERAL_TOKENS = frozenset(["string", "number", "param"])
+NO_SPACE_BEFORE = frozenset([",", ")", ".", ";"])
+NO_SPACE_AFTER = frozenset(["(", "."])
+
+#
+# A + or - is a sign rather than an operator when it follows one of these
+# keywords, or anything that can't end a value (an operator, "(" or ","), so
+# that e.g. "a = -1" and "a = 1" have the same shape.
+#
+SIGNS = frozenset(["-", "+"])
+SIGN_KEYWORDS = frozenset([
+    "select", "where", "and", "or", "not", "in", "is", "like", "between",
+    "on", "when", "then", "else", "case", "set", "values", "limit",
+    "offset", "having", "by", "return", "div", "mod", "xor", "interval"])
+VALUE_END = re.compile(r"[\w$`@?)]$")
+
+
+def IsSignPosition(out):
+    if not out:
+        return True
+    prev = out[-1]
+    return prev in SIGN_KEYWORDS or not VALUE_END.search(prev)
+
+
+def FingerprintQuery(query):
+    """
+    Returns the shape of a query: with comments and redundant whitespace
+    removed, every literal replaced by ?, every list of literals (e.g. an IN
+    list or the rows of an INSERT) replaced by (?+), and words lowercased.
+    Queries that only differ in those respects have the same shape.
+    """
+    out = []
+    # The index in out of the innermost "(" that has only been followed by
+    # literals and commas so far, if any.
+    group = None
+    # The index in out of a + or - that is a sign, and the group before it.
+    sign = sign_group = None
+    for m in QUERY_TOKENS.finditer(query):
+        kind = m.lastgroup
+        if kind == "space" or kind == "comment":
+            continue
+        if kind == "number" and sign is not None and sign == len(out) - 1:
+            # Fold the sign into the literal.
+            out.pop()
+            group = sign_group
+        if m.group() in SIGNS and IsSignPosition(out):
+            sign, sign_group = len(out), group
+        if kind in LITERAL_TOKENS:
+            token = "?"
+        elif kind == "word":
+            token = m.group().lower()
+        else:
+            token = m.group()
+
+        if token == "(":
+            group = len(out)
+        elif token == ")" and group is not None:
+            if len(out) > group + 1:
+                del out[group:]
+                # Rows of a multi row INSERT collapse into one.
+                if out[-2:] == ["(?+)", ","]:
+                    out.pop()
+                    group = None
+                    continue
+                token = "(?+)"
+            group = None
+        elif token != "?" and token != ",":
+            group = None
+        out.append(token)
+
+    parts = []
+    prev = None
+    for token in out:
+        if prev is not None and token not in NO_SPACE_BEFORE and \
+                prev not in NO_SPACE_AFTER:
+            parts.append(" ")
+        parts.append(token)
+        prev = token
+    return "".join(parts)
+
+
 def HumanizePercent(pct):
     if pct is None:
         return ""
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import logging
+import time
+
+from attrdict import AttrDict
+from collections import OrderedDict, defaultdict
+
+BLOCKED_QUERIES_QUERY = "select node_id, id, blocking_node_id, blocking_id, " \
+    "database_name, query_text from mv_blocked_queries"
+
+#
+# Without mv_blocked_queries we only know who is waiting for a lock, not on
+# whom, so every waiter is shown as its own root.
+#
+LOCK_WAITS_QUERY = "select id, db, info, time * 1000 from processlist " \
+    "where state like '%lock%'"
+
+#
+# MySQL's unknown column, unknown table and no such table errors: the errors
+# of a cluster too old to have mv_blocked_queries (or all its columns).
+#
+NO_BLOCKED_QUERIES_ERRORS = (1054, 1109, 1146)
+
+
+def GetDepths(blockers):
+    """
+    Returns the depth of every session in the waits-for graph (0 for
+    sessions that are not waiting) and the set of sessions on a cycle, which
+    are given depth 0 too.
+
+    Each waiter waits on exactly one blocker, so following blockers from any
+    session either ends at a session that is not waiting, reaches a session
+    whose depth is already known, or loops back onto the current path. Every
+    session is put on a path once, so this is linear in the number of
+    sessions.
+    """
+    depth = {}
+    in_cycle = set()
+    for start in blockers:
+        path = []
+        on_path = {}
+        x = start
+        while x is not None and x not in depth and x not in on_path:
+            on_path[x] = len(path)
+            path.append(x)
+            x = blockers.get(x)
+
+        if x is None:
+            base = -1
+        elif x in depth:
+            base = depth[x]
+        else:
+            cycle_start = on_path[x]
+            for c in path[cycle_start:]:
+                depth[c] = 0
+                in_cycle.add(c)
+            path = path[:cycle_start]
+            base = 0
+
+        for n in reversed(path):
+            base += 1
+            depth[n] = base
+    return depth, in_cycle
+
+
+def BuildBlockingForest(blockers, waits):
+    """
+    Lays out the waits-for graph given by blockers (waiter -> blocker) and
+    waits (waiter -> ms waited) as a forest: root blockers, and deadlocked
+    sessions, first, each followed by the sessions blocked behind it.
+
+    Returns (session, depth, in_cycle, blocked_ms, waiters) tuples in display
+    order; blocked_ms and waiters cover every session below that one.
+    """
+    depth, in_cycle = GetDepths(blockers)
+
+    children = defaultdict(list)
+    by_depth = defaultdict(list)
+    for n, d in depth.items():
+        by_depth[d].append(n)
+        b = blockers.get(n)
+        if b is not None and n not in in_cycle:
+            children[b].append(n)
+
+    blocked = {}
+    waiters = {}
+    for d in sorted(by_depth, reverse=True):
+        for n in by_depth[d]:
+            blocked[n] = sum(waits.get(c, 0) + blocked[c] for c in children[n])
+            waiters[n] = sum(1 + waiters[c] for c in children[n])
+
+    by_blocked = lambda n: -blocked[n]
+    stack = sorted(by_depth[0], key=by_blocked, reverse=True)
+    out = []
+    while stack:
+        n = stack.pop()
+        out.append((n, depth[n], n in in_cycle, blocked[n], waiters[n]))
+        stack.extend(sorted(children[n], key=by_blocked, reverse=True))
+    return out
+
+
+def FormatSession(session):
+    return ":".join(str(s) for s in session)
+
+
+class BlockingChainPoller(object):
+    """
+    Feeds the blocking chains view. mv_blocked_queries does not say how long
+    a query has been blocked, so waits are measured from the first poll that
+    saw the session blocked on its current blocker.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.has_blocked_queries = None
+        self.first_seen = {}
+        self.data = OrderedDict()
+
+    def get_database_data(self):
+        return self.data, None, None, frozenset()
+
+    def poll(self):
+        if self.has_blocked_queries is None:
+            try:
+                self.conn.query_rows(BLOCKED_QUERIES_QUERY + " limit 0")
+                self.has_blocked_queries = True
+            except Exception as e:
+                # Anything else, e.g. a dropped connection, is retried on
+                # the next poll.
+                if not (e.args and e.args[0] in NO_BLOCKED_QUERIES_ERRORS):
+                    raise
+                logging.warn("mv_blocked_queries is not available -- "
+                             "showing lock waits without their blockers.")
+                self.has_blocked_queries = False
+
+        now = time.time()
+        blockers = {}
+        waits = {}
+        info = {}
+        if self.has_blocked_queries:
+            first_seen = {}
+            for node, id, bnode, bid, db, query in \
+                    self.conn.query_rows(BLOCKED_QUERIES_QUERY):
+                waiter = (node, id)
+                if waiter in blockers:
+                    continue
+                blockers[waiter] = (bnode, bid)
+                edge = (waiter, blockers[waiter])
+                first_seen[edge] = self.first_seen.get(edge, now)
+                waits[waiter] = (now - first_seen[edge]) * 1000.0
+                info[waiter] = (db, query)
+            self.first_seen = first_seen
+        else:
+            for id, db, query, wait in self.conn.query_rows(LOCK_WAITS_QUERY):
+                waiter = (id,)
+                blockers[waiter] = None
+                waits[waiter] = float(wait)
+                info[waiter] = (db, query)
+
+        data = OrderedDict()
+        for n, depth, in_cycle, blocked, waiters in \
+                BuildBlockingForest(blockers, waits):
+            db, query = info.get(n, (None, None))
+            data[n] = AttrDict({
+                "Session": "%s%s%s" % ("  " * depth, FormatSession(n),
+                                       " (deadlock)" if in_cycle else ""),
+                "Wait": waits.get(n),
+                "Blocked": float(blocked),
+                "Waiters": float(waiters),
+                "Database": db,
+                "Query": query,
+            })
+        self.data = data
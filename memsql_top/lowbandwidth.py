@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+from urwid import escape, raw_display
+from urwid.display_common import AttrSpec
+
+#
+# In low bandwidth mode the screen is redrawn at most every REDRAW_INTERVAL
+# seconds, and a cell whose text keeps changing without changing colour is
+# redrawn at most every CELL_HOLD seconds.
+#
+REDRAW_INTERVAL = 1.0
+CELL_HOLD = 5.0
+
+#
+# Moving the cursor costs about this many bytes, so unchanged gaps shorter
+# than this between two changed spans are rewritten instead of skipped.
+#
+MERGE_GAP = 8
+
+
+def RowCells(row, cols):
+    """
+    Flattens a canvas row into one (attr, cs, char) tuple per cell. Returns
+    None if the row has characters that are not exactly one cell wide.
+    """
+    cells = []
+    for a, cs, run in row:
+        if isinstance(run, bytes):
+            run = run.decode("utf-8", "replace")
+        for ch in run:
+            cells.append((a, cs, ch if ch >= u" " else u"?"))
+    if len(cells) != cols:
+        return None
+    return cells
+
+
+def ChangedSpans(old, new):
+    """
+    Returns the [start, end) spans of cells that differ between two rows of
+    the same width, merging spans separated by fewer than MERGE_GAP cells.
+    """
+    spans = []
+    i = 0
+    n = len(new)
+    while i < n:
+        if old[i] == new[i]:
+            i += 1
+            continue
+        start = i
+        while i < n and old[i] != new[i]:
+            i += 1
+        if spans and start - spans[-1][1] < MERGE_GAP:
+            spans[-1][1] = i
+        else:
+            spans.append([start, i])
+    return spans
+
+
+def ToNative(s):
+    if isinstance(s, str):
+        return s
+    if isinstance(s, bytes):
+        return s.decode("utf-8")
+    return s.encode("utf-8")
+
+
+class CountingFile(object):
+    """
+    Wraps the terminal's output file and counts the bytes written to it.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class LowBandwidthScreen(raw_display.Screen):
+    """
+    A raw_display.Screen that keeps a copy of what is on the terminal and
+    only writes the runs of cells that changed since the last frame, instead
+    of every row that changed. Frames it cannot diff (the first one, after a
+    resize, or with wide characters) are drawn by raw_display as usual.
+    """
+    def __init__(self):
+        super(LowBandwidthScreen, self).__init__()
+        self._term_output_file = CountingFile(self._term_output_file)
+        self.shadow = None
+        self.frame_bytes = 0
+
+    def clear(self):
+        self.shadow = None
+        super(LowBandwidthScreen, self).clear()
+
+    def attr_to_escape(self, a):
+        if a in self._pal_escape:
+            return self._pal_escape[a]
+        elif isinstance(a, AttrSpec):
+            return self._attrspec_to_escape(a)
+        return self._attrspec_to_escape(AttrSpec('default', 'default'))
+
+    def draw_screen(self, size, r):
+        out = self._term_output_file
+        before = out.count
+
+        cols, rows = size
+        new = [RowCells(row, cols) for row in r.content()]
+        if self.shadow is None or len(self.shadow) != rows or \
+                any(cells is None for cells in new):
+            self._screen_buf_canvas = None
+            super(LowBandwidthScreen, self).draw_screen(size, r)
+        else:
+            self.draw_changes(new, rows)
+
+        self.shadow = new if all(c is not None for c in new) else None
+        self.frame_bytes = out.count - before
+
+    def draw_changes(self, new, rows):
+        o = []
+        for y, (old_cells, new_cells) in enumerate(zip(self.shadow, new)):
+            if old_cells == new_cells:
+                continue
+            for start, end in ChangedSpans(old_cells, new_cells):
+                if y == rows - 1:
+                    # Writing the bottom right cell would scroll the screen.
+                    end = min(end, len(new_cells) - 1)
+                if start >= end:
+                    continue
+                o.append(escape.set_cursor_position(start, y))
+                lasta = lastcs = None
+                first = True
+                for a, cs, ch in new_cells[start:end]:
+                    if first or a != lasta:
+                        o.append(self.attr_to_escape(a))
+                        lasta = a
+                    if first or cs != lastcs:
+                        o.append(escape.SO if cs is not None else escape.SI)
+                        lastcs = cs
+                    first = False
+                    o.append(ch)
+
+        if o:
+            o = [escape.HIDE_CURSOR] + o + [self.attr_to_escape(None)]
+            out = self._term_output_file
+            for s in o:
+                out.write(ToNative(s))
+            out.flush()
@@ -19,62 +19,96 @@
 from __future__ import print_function
 from __future__ import absolute_import
 
-import urwid
+#
+# Keep module scope imports cheap: `--version`, `--help` and argument errors
+# must not pay for urwid, curses, pymysql or attrdict. Everything needed for
+# the interactive UI is imported in RunInteractive.
+#
 import argparse
-import curses
-import logging
 import sys
-import pkg_resources
-
-from distutils.version import LooseVersion
-
-from .database import connect
-
-from .DatabasePoller import DatabasePoller
-from .QueryListBox import QueryListBox
-from .ResourceMonitor import ResourceMonitor
-from .WrappingPopUpViewer import WrappingPopUpViewer
-from .ColumnHeadings import ColumnHeadings
-from .columns import DetectColumnsMetaOrExit
 
-def main(args=None):
-    if args is None:
-        parser = argparse.ArgumentParser(add_help=False)
-        parser.add_argument("-h", "--host", default="127.0.0.1")
-        parser.add_argument("-P", "--port", default=3306, type=int)
-        parser.add_argument("-p", "--password", default="")
-        parser.add_argument("-u", "--user", default="root")
-        parser.add_argument("-v", "--version", action="store_true")
-        parser.add_argument("-?", "--help", action="store_true",
-                            help="Show this help message and exit")
-
-        parser.add_argument("--update-interval", default=3.0, type=float,
-                            help="How frequently to update the screen.")
+from . import __version__
 
-        args = parser.parse_args()
 
-    if args.help:
-        parser.print_help()
-        sys.exit(0)
-    elif args.version:
-        print(pkg_resources.require("memsql-top")[0].version)
-        sys.exit(0)
+def BuildArgParser():
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-h", "--host", default="127.0.0.1")
+    parser.add_argument("-P", "--port", default=3306, type=int)
+    parser.add_argument("-p", "--password", default="")
+    parser.add_argument("-u", "--user", default="root")
+    parser.add_argument("-v", "--version", action="store_true")
+    parser.add_argument("-?", "--help", action="store_true",
+                        help="Show this help message and exit")
 
-    try:
-        conn = connect(host=args.host, port=args.port,
-                       database="information_schema",
-                       password=args.password, user=args.user)
-    except Exception as e:
-        sys.exit("Unexpected error when connecting to database: %s" % e)
+    parser.add_argument("--update-interval", default=3.0, type=float,
+                        help="How frequently to update the screen.")
+    parser.add_argument("--alert", metavar="RULE", action="append",
+                        default=[],
+                        help="Highlight rows matching RULE, e.g. "
+                             "'Cpu/s > 2.0 for 10s on database=x' or "
+                             "'LockW/q > 50ms'. May be repeated.")
+    parser.add_argument("--alert-file", metavar="FILE", default=None,
+                        help="Read alert rules from FILE, one per line.")
+    parser.add_argument("--alert-log", metavar="FILE", default=None,
+                        help="Append alerts to FILE when they start firing.")
+    parser.add_argument("--history", metavar="FILE", default=None,
+                        help="Record activity to the SQLite database FILE, "
+                             "or read it back with --since.")
+    parser.add_argument("--history-max-mb", default=512, type=float,
+                        help="Maximum size of the --history database.")
+    parser.add_argument("--since", metavar="TIME", default=None,
+                        help="Show the activity recorded in --history since "
+                             "TIME (e.g. 30m, 2h, '2017-06-01 10:00') instead "
+                             "of connecting to the database.")
+    parser.add_argument("--until", metavar="TIME", default=None,
+                        help="End of the --since window (default: now).")
+    parser.add_argument("--query-cache", metavar="FILE", default=None,
+                        help="Where to cache query text between runs "
+                             "(default: ~/.memsql-top-queries.db).")
+    parser.add_argument("--no-query-cache", action="store_true",
+                        help="Do not cache query text on disk.")
+    parser.add_argument("--serve", metavar="SOCKET", default=None,
+                        help="Run a collector that polls the cluster once and "
+                             "publishes every update on the Unix socket "
+                             "SOCKET for --attach clients.")
+    parser.add_argument("--attach", metavar="SOCKET", default=None,
+                        help="Show the updates published by a --serve "
+                             "collector instead of polling the cluster.")
+    parser.add_argument("--web", metavar="PORT", default=None, type=int,
+                        help="Serve a live dashboard on "
+                             "http://127.0.0.1:PORT/ instead of running in "
+                             "the terminal.")
+    parser.add_argument("--profile", metavar="FILE", default=None,
+                        help="Sample the poll and render loops and write "
+                             "collapsed stacks (for flame graphs) to FILE "
+                             "on exit.")
+    parser.add_argument("--show-self", action="store_true",
+                        help="Show memsql-top's own queries, in blue, instead "
+                             "of hiding them.")
+    parser.add_argument("--max-memory-mb", metavar="MB", default=None,
+                        type=float,
+                        help="Keep the state kept per activity within "
+                             "about MB: exact counters only for the busiest "
+                             "activities, with the rest summed up in an "
+                             "'other' row, and fewer baselines, latency "
+                             "sketches and cached query texts.")
+    parser.add_argument("--columns", metavar="PROFILE", default="all",
+                        help="Only fetch and show the columns of PROFILE "
+                             "(all, narrow, latency, waits, resources) or "
+                             "a comma separated list of columns. C cycles "
+                             "through the profiles while running.")
+    parser.add_argument("--worker", action="store_true",
+                        help="Query and diff the activities in a separate "
+                             "process, so that the UI stays responsive on "
+                             "very large clusters.")
+    parser.add_argument("--low-bandwidth", action="store_true",
+                        help="Redraw less often and only the parts of the "
+                             "screen that changed, e.g. over slow SSH "
+                             "connections.")
+    return parser
 
-    columnsMeta = DetectColumnsMetaOrExit(conn)
-
-    # Run any check system queries before we start the DatabasePoller and
-    # start tracking queries.
-    #
-    if not conn.get('select @@forward_aggregator_plan_hash as f').f:
-        sys.exit("forward_aggregator_plan_hash is required")
 
+def BuildPalette():
     BLACK = 'h16'
     _BLACK = 'black'
     BLUE = 'h24'
@@ -122,54 +156,64 @@ def main(args=None):
         palette.append(('body_%d' % code, old_color, _WHITE, '', color, WHITE))
         palette.append(('body_focus_%d' % code, old_color, _LIGHT_GRAY, 'underline', color, LIGHT_GRAY))
 
-    dbpoller = DatabasePoller(args, columnsMeta)
+    palette += [
+        ('alert', _WHITE, 'dark red', 'bold', WHITE, 'h124'),
+        ('alert_focus',
+         _WHITE, 'dark red', 'bold,underline', WHITE, 'h160'),
+        ('self', _ACCENT_BLUE, _WHITE, '', 'h110', WHITE),
+        ('self_focus',
+         _ACCENT_BLUE, _LIGHT_GRAY, 'underline', 'h110', LIGHT_GRAY),
+    ]
 
-    column_headings = ColumnHeadings(columnsMeta)
-    resources = ResourceMonitor(columnsMeta.GetMaxCpuTotal(conn),
-                                columnsMeta.GetMaxMemTotal(conn))
-    headerElems = [urwid.Text("MemSQL - MemSQL Top")]
+    return palette
+
+
+def BuildFrameView(body, headerElems, tabs=False, footer_status=None):
+    """
+    footer_status, if given, is a Text shown at the right of the footer.
+    """
+    import urwid
+
+    from .WrappingPopUpViewer import WrappingPopUpViewer
 
-    # 5.7 did not give us enough info for resource bars.
-    if columnsMeta.minimum_version >= LooseVersion("5.8"):
-        headerElems  += [urwid.Divider(), resources]
-    headerElems += [urwid.Divider(), column_headings]
     header = urwid.Pile(headerElems)
 
-    qlistbox = QueryListBox(columnsMeta)
+    keys = [
+        ('foot_key', "UP"), ", ", ('foot_key', "DOWN"), ", ",
+        " move view  ",
+        ('foot_key', "F#"), " sorts by column ",
+    ]
+    if tabs:
+        keys += [('foot_key', "TAB"), " switches view "]
+    keys += [('foot_key', "Q"), " exits"]
 
-    footer = urwid.Columns([
-        urwid.Text([
-            ('foot_key', "UP"), ", ", ('foot_key', "DOWN"), ", ",
-            " move view  ",
-            ('foot_key', "F#"), " sorts by column ",
-            ('foot_key', "Q"), " exits",
-        ]),
-        urwid.Text("Send feedback to help@memsql.com.", align="right")
-    ])
-
-    view = WrappingPopUpViewer(urwid.Frame(
-        urwid.AttrMap(qlistbox, "body"),
+    if footer_status is None:
+        footer_status = urwid.Text("Send feedback to help@memsql.com.",
+                                   align="right")
+    footer = urwid.Columns([urwid.Text(keys), footer_status])
+
+    return WrappingPopUpViewer(urwid.Frame(
+        urwid.AttrMap(body, "body"),
         header=urwid.AttrMap(header, "head"),
         footer=urwid.AttrMap(footer, "foot")))
 
-    urwid.connect_signal(qlistbox, 'sort_column_changed',
-                         column_headings.update_sort_column)
-    urwid.connect_signal(qlistbox, 'query_selected',
-                         lambda w, q: view.show_popup(w, columnsMeta.GetPopUpText(conn, q)))
 
-    def handle_keys(input):
+def BuildMainLoop(view, handle_keys, screen=None):
+    """
+    Returns a MainLoop for view that exits on Q and passes any other
+    unhandled keys to handle_keys.
+    """
+    import urwid
+    import curses
+    import logging
+
+    def unhandled_input(input):
         if input in ('q', 'Q'):
             raise urwid.ExitMainLoop()
-        if input in qlistbox.sort_keys():
-            qlistbox.update_sort_column(input)
+        handle_keys(input)
 
-    loop = urwid.MainLoop(view, palette, unhandled_input=handle_keys)
-    def update_widgets(plancache, cpu, mem):
-        qlistbox.update_entries(plancache)
-        resources.update_cpu_util(cpu)
-        resources.update_mem_usage(mem)
-    dbpoller.start(loop.watch_pipe(lambda _:
-        update_widgets(*dbpoller.get_database_data())))
+    loop = urwid.MainLoop(view, BuildPalette(), screen=screen,
+                          unhandled_input=unhandled_input)
 
     try:
         curses.setupterm()
@@ -178,8 +222,490 @@ def main(args=None):
     except curses.error:
         logging.warn("Failed to identify terminal color support -- falling back to ANSI terminal colors.")
         logging.warn("Set TERM=xterm-256color or equivalent for best the experience.")
+    return loop
+
+
+def SortKeyHandler(qlistbox):
+    def handle_keys(input):
+        if input in qlistbox.sort_keys():
+            qlistbox.update_sort_column(input)
+    return handle_keys
+
+
+def ConnectOrExit(args):
+    from .database import connect
+
+    try:
+        return connect(host=args.host, port=args.port,
+                       database="information_schema",
+                       password=args.password, user=args.user)
+    except Exception as e:
+        sys.exit("Unexpected error when connecting to database: %s" % e)
+
+
+def BuildDatabasePoller(args, conn, query_cache=None):
+    """
+    Detects the cluster's version and returns its column metadata and a
+    DatabasePoller with any requested alerts and history recording.
+    """
+    from .DatabasePoller import DatabasePoller
+    from .columns import DetectColumnsMetaOrExit
+    from .alerts import AlertEngine, LoadAlertRules
+
+    # DetectColumnsMetaOrExit runs the version specific CheckSupported probes
+    # before we start the DatabasePoller and start tracking queries.
+    #
+    columnsMeta = DetectColumnsMetaOrExit(conn)
+
+    alerts = None
+    if args.alert or args.alert_file:
+        try:
+            rules = LoadAlertRules(args.alert, args.alert_file, columnsMeta)
+        except (ValueError, IOError) as e:
+            sys.exit("Failed to load alert rules: %s" % e)
+        alerts = AlertEngine(rules, args.alert_log)
+
+    history = None
+    if args.history:
+        from .history import HistoryStore
+        try:
+            history = HistoryStore(args.history, columnsMeta,
+                                   int(args.history_max_mb * 1024 * 1024))
+        except Exception as e:
+            sys.exit("Failed to open history file: %s" % e)
+        history.start()
+
+    dbpoller = DatabasePoller(args, columnsMeta, alerts, history, query_cache)
+    return dbpoller.column_meta, dbpoller
+
+
+def OpenQueryCache(args, cluster):
+    import logging
+
+    if args.no_query_cache:
+        return None
+
+    from .querycache import QueryTextCache, DEFAULT_PATH, MAX_ENTRIES
+    max_entries = MAX_ENTRIES
+    if args.max_memory_mb:
+        from .heavyhitters import MemoryBudget
+        max_entries = min(max_entries, MemoryBudget(
+            int(args.max_memory_mb * 1024 * 1024))["query_texts"])
+    try:
+        return QueryTextCache(args.query_cache or DEFAULT_PATH, cluster,
+                              max_entries)
+    except Exception as e:
+        logging.warn("Not caching query text: %s" % e)
+        return None
+
+
+def StartWarmingQueryCache(args, columnsMeta, query_cache):
+    """
+    Fills the query cache with every query the cluster knows, on a thread
+    and connection of its own, so that a large mv_queries does not hold up
+    the UI. Until it is done, lookups that miss ask the cluster.
+    """
+    import logging
+    import threading
+
+    from .database import connect
+
+    def warm():
+        try:
+            conn = connect(host=args.host, port=args.port,
+                           database="information_schema",
+                           password=args.password, user=args.user)
+            columnsMeta.WarmQueryCache(conn, query_cache)
+        except Exception as e:
+            logging.warn("Failed to warm the query cache: %s" % e)
+
+    thread = threading.Thread(target=warm, name="QueryCacheWarmer")
+    thread.daemon = True
+    thread.start()
+
+
+def RunLiveView(views, source, max_cpu, max_mem, low_bandwidth=False):
+    """
+    Runs the UI with one tab per view. source is started with the UI's
+    update signal; it is either the ViewScheduler that polls the views or a
+    FrameSubscriber. The resource bars follow the first view's poller.
+
+    With low_bandwidth, updates are applied at most every REDRAW_INTERVAL,
+    only the changed cells are sent to the terminal and the footer shows
+    how many bytes the last frame took.
+    """
+    import time
+    import urwid
+
+    from distutils.version import LooseVersion
+
+    from .QueryListBox import QueryListBox
+    from .ResourceMonitor import ResourceMonitor
+    from .ColumnHeadings import ColumnHeadings
+    from .humanize import HumanizeBytes
+
+    screen = footer_status = None
+    hold = 0
+    if low_bandwidth:
+        from .lowbandwidth import LowBandwidthScreen, REDRAW_INTERVAL, \
+            CELL_HOLD
+        screen = LowBandwidthScreen()
+        footer_status = urwid.Text("", align="right")
+        hold = CELL_HOLD
+
+    resources = ResourceMonitor(max_cpu, max_mem)
+    tab_bar = urwid.Text("")
+    status = urwid.Text("", align="right")
+    headings = urwid.WidgetPlaceholder(urwid.Divider())
+    body = urwid.WidgetPlaceholder(urwid.SolidFill())
+
+    headerElems = [urwid.Columns([
+        urwid.Text("MemSQL - MemSQL Top"),
+        tab_bar,
+        status,
+    ])]
+
+    # 5.7 did not give us enough info for resource bars.
+    if views[0].column_meta.minimum_version >= LooseVersion("5.8"):
+        headerElems  += [urwid.Divider(), resources]
+    headerElems += [urwid.Divider(), headings]
+
+    view = BuildFrameView(body, headerElems, tabs=len(views) > 1,
+                          footer_status=footer_status)
+
+    def build_tab(v):
+        qlistbox = QueryListBox(v.column_meta, hold)
+        column_headings = ColumnHeadings(v.column_meta)
+        urwid.connect_signal(qlistbox, 'sort_column_changed',
+                             column_headings.update_sort_column)
+        urwid.connect_signal(qlistbox, 'query_selected',
+                             lambda w, q, v=v: view.show_popup(w, v.popup_text(q)))
+        return (v, qlistbox, column_headings)
+
+    tabs = [build_tab(v) for v in views]
+    current = [0]
+
+    def rebuild_tab(i, column_meta):
+        """
+        Rebuilds a tab's rows and headings for the columns its poller
+        switched to, keeping its filter and, if still shown, sort column.
+        """
+        v, old, _ = tabs[i]
+        v.column_meta = column_meta
+        tabs[i] = build_tab(v)
+        _, qlistbox, column_headings = tabs[i]
+        qlistbox.set_filter(old.filter)
+        if old.sort_column in column_meta.columns:
+            qlistbox.sort_column = old.sort_column
+            column_headings.update_sort_column(qlistbox, old.sort_column)
+        headings.original_widget = column_headings
+        body.original_widget = qlistbox
+
+    def update_widgets():
+        v, qlistbox, _ = tabs[current[0]]
+        column_meta = getattr(v.poller, "column_meta", v.column_meta)
+        if column_meta is not v.column_meta:
+            rebuild_tab(current[0], column_meta)
+            v, qlistbox, _ = tabs[current[0]]
+        incremental = hasattr(v.poller, "take_changes")
+        if incremental and not qlistbox.resync:
+            qlistbox.apply_changes(*v.poller.take_changes())
+        else:
+            if incremental:
+                # The whole table includes the pending changes.
+                v.poller.take_changes()
+            plancache, _, _, alerting = v.poller.get_database_data()
+            own = v.poller.own_keys if hasattr(v.poller, "own_keys") \
+                else frozenset()
+            qlistbox.update_entries(plancache, alerting, own)
+        if getattr(v, "error", None):
+            status.set_text(v.error)
+        else:
+            status.set_text(v.poller.status()
+                            if hasattr(v.poller, "status") else "")
+
+        _, cpu, mem, _ = views[0].poller.get_database_data()
+        if cpu is not None:
+            resources.update_cpu_util(cpu)
+            resources.update_mem_usage(mem)
+        if hasattr(views[0].poller, "pressure"):
+            resources.update_pressure(views[0].poller.pressure)
+
+        if footer_status is not None:
+            footer_status.set_text(
+                "%s/frame" % HumanizeBytes(screen.frame_bytes))
+
+    #
+    # In low bandwidth mode, updates that arrive too soon after the last one
+    # are coalesced into one update when REDRAW_INTERVAL has passed.
+    #
+    last_update = [0]
+    pending = [False]
+
+    def delayed_update(loop, _):
+        pending[0] = False
+        on_update(None)
+
+    def on_update(_):
+        if low_bandwidth:
+            wait = last_update[0] + REDRAW_INTERVAL - time.time()
+            if wait > 0:
+                if not pending[0]:
+                    pending[0] = True
+                    loop.set_alarm_in(wait, delayed_update)
+                return
+            last_update[0] = time.time()
+        update_widgets()
+
+    def show_tab(i):
+        current[0] = i
+        v, qlistbox, column_headings = tabs[i]
+        tab_bar.set_text([
+            (('head_so' if j == i else 'head'),
+             " %d %s%s " % (j + 1, t[0].name,
+                            " (filtered)" if t[1].filter else ""))
+            for j, t in enumerate(tabs)
+        ])
+        headings.original_widget = column_headings
+        body.original_widget = qlistbox
+        if hasattr(source, "set_visible"):
+            source.set_visible(v)
+        update_widgets()
+
+    def handle_keys(input):
+        v, qlistbox, _ = tabs[current[0]]
+        if input in v.commands or \
+                (input in v.actions and qlistbox.focus is not None):
+            if input in v.commands:
+                message = v.commands[input]()
+            else:
+                message = v.actions[input](qlistbox.focus.values)
+            if message:
+                view.show_popup(qlistbox, message)
+            update_widgets()
+        elif input in v.links:
+            if qlistbox.focus is not None:
+                name, make_filter = v.links[input]
+                for j, t in enumerate(tabs):
+                    if t[0].name == name:
+                        t[1].set_filter(make_filter(qlistbox.focus.values))
+                        show_tab(j)
+        elif input == 'esc' and qlistbox.filter is not None:
+            qlistbox.set_filter(None)
+            show_tab(current[0])
+        elif input == 'tab':
+            show_tab((current[0] + 1) % len(tabs))
+        elif input in [str(i + 1) for i in range(len(tabs))]:
+            show_tab(int(input) - 1)
+        elif input in qlistbox.sort_keys():
+            qlistbox.update_sort_column(input)
+
+    show_tab(0)
+    loop = BuildMainLoop(view, handle_keys, screen)
+    source.start(loop.watch_pipe(on_update))
+
     loop.run()
 
 
+def RunInteractive(args):
+    from .views import BuildViews, ViewContext, ViewScheduler
+
+    if args.worker:
+        # Start the worker first, so that it connects while we do.
+        from .worker import WorkerPoller
+        dbpoller = WorkerPoller(args)
+
+    conn = ConnectOrExit(args)
+    query_cache = OpenQueryCache(args, "%s:%d" % (args.host, args.port))
+    if args.worker:
+        dbpoller.wait_ready()
+        columnsMeta = dbpoller.column_meta
+    else:
+        columnsMeta, dbpoller = BuildDatabasePoller(args, conn, query_cache)
+
+    if query_cache is not None:
+        StartWarmingQueryCache(args, columnsMeta, query_cache)
+
+    # The views other than activities share one connection on the scheduler
+    # thread; conn stays with the UI thread for popups and actions.
+    views = BuildViews(ViewContext(
+        args, ConnectOrExit(args), conn, columnsMeta, dbpoller,
+        lambda q: columnsMeta.GetPopUpText(conn, q, query_cache)))
+
+    max_cpu, max_mem = columnsMeta.GetMaxResourceTotals(conn)
+    try:
+        RunLiveView(views, ViewScheduler(views), max_cpu, max_mem,
+                    args.low_bandwidth)
+    finally:
+        if query_cache is not None:
+            query_cache.close()
+
+
+def RunCollector(args):
+    """
+    Polls the cluster once and publishes every frame on the --serve socket
+    to any number of --attach clients.
+    """
+    from .collector import FrameCollector
+
+    conn = ConnectOrExit(args)
+    columnsMeta, dbpoller = BuildDatabasePoller(args, conn)
+    max_cpu, max_mem = columnsMeta.GetMaxResourceTotals(conn)
+
+    collector = FrameCollector(args.serve, columnsMeta, dbpoller, {
+        "version": str(columnsMeta.minimum_version),
+        "cluster": "%s:%d" % (args.host, args.port),
+        "max_cpu": max_cpu,
+        "max_mem": max_mem,
+    })
+    try:
+        collector.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def RunWeb(args):
+    """
+    Polls the cluster once and streams every frame to any number of
+    browsers.
+    """
+    from .web import WebDashboard
+
+    conn = ConnectOrExit(args)
+    columnsMeta, dbpoller = BuildDatabasePoller(args, conn)
+    max_cpu, max_mem = columnsMeta.GetMaxResourceTotals(conn)
+
+    try:
+        dashboard = WebDashboard(args.web, columnsMeta, dbpoller,
+                                 max_cpu, max_mem)
+    except Exception as e:
+        sys.exit("Failed to listen on port %d: %s" % (args.web, e))
+    print("Serving on http://127.0.0.1:%d/" % args.web)
+    try:
+        dashboard.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def RunAttached(args):
+    """
+    Renders the frames published by a --serve collector. This does not
+    connect to the database; popups only show query text that is already in
+    the query cache.
+    """
+    from .collector import FrameSubscriber
+    from .columns import GetColumnsMetaForVersion
+    from .views import View
+
+    subscriber = FrameSubscriber(args.attach)
+    hello = subscriber.hello
+    # Show the columns the collector was started with.
+    columnsMeta = GetColumnsMetaForVersion(hello["version"]).Project(
+        ",".join(hello["columns"]))
+    query_cache = OpenQueryCache(args, hello["cluster"])
+
+    def popup_text(name):
+        cleaned = None
+        if query_cache is not None:
+            cleaned = query_cache.get_cleaned(name)
+        return cleaned if cleaned is not None else name
+
+    view = View("Activities", columnsMeta, subscriber, None,
+                popup_text=popup_text)
+    RunLiveView([view], subscriber, hello["max_cpu"], hello["max_mem"],
+                args.low_bandwidth)
+
+
+def RunHistoryView(args):
+    """
+    Shows the average activity recorded in the --history file between --since
+    and --until. This does not connect to the database.
+    """
+    import time
+    import urwid
+
+    from .QueryListBox import QueryListBox
+    from .ColumnHeadings import ColumnHeadings
+    from .history import LoadHistoryWindow, ParseTime
+
+    try:
+        now = time.time()
+        since = ParseTime(args.since, now)
+        until = ParseTime(args.until, now) if args.until else now
+        columnsMeta, frame = LoadHistoryWindow(args.history, since, until)
+    except Exception as e:
+        sys.exit("Failed to load history: %s" % e)
+
+    def fmt(t):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+
+    column_headings = ColumnHeadings(columnsMeta)
+    headerElems = [
+        urwid.Text("MemSQL - MemSQL Top - history from %s to %s" %
+                   (fmt(since), fmt(until))),
+        urwid.Divider(),
+        column_headings,
+    ]
+
+    qlistbox = QueryListBox(columnsMeta)
+    qlistbox.update_entries(frame)
+    view = BuildFrameView(qlistbox, headerElems)
+
+    urwid.connect_signal(qlistbox, 'sort_column_changed',
+                         column_headings.update_sort_column)
+    urwid.connect_signal(qlistbox, 'query_selected', view.show_popup)
+
+    BuildMainLoop(view, SortKeyHandler(qlistbox)).run()
+
+
+def main(args=None):
+    parser = BuildArgParser()
+    if args is None:
+        args = parser.parse_args()
+
+    if args.help:
+        parser.print_help()
+        sys.exit(0)
+    elif args.version:
+        print(__version__)
+        sys.exit(0)
+    elif args.since and not args.history:
+        parser.error("--since requires --history")
+    elif args.serve and args.attach:
+        parser.error("--serve and --attach are mutually exclusive")
+    elif args.web is not None and (args.serve or args.attach or args.since):
+        parser.error("--web can't be combined with --serve, --attach "
+                     "or --since")
+    elif args.worker and (args.serve or args.attach or args.since or
+                          args.web is not None):
+        parser.error("--worker only applies to the interactive view")
+    elif args.worker and args.profile:
+        # The profiler only samples the threads of this process.
+        parser.error("--profile can't see the --worker process; profile "
+                     "without --worker")
+
+    profiler = None
+    if args.profile:
+        from .profiler import SamplingProfiler
+        profiler = SamplingProfiler()
+        profiler.start()
+
+    try:
+        if args.since:
+            RunHistoryView(args)
+        elif args.serve:
+            RunCollector(args)
+        elif args.attach:
+            RunAttached(args)
+        elif args.web is not None:
+            RunWeb(args)
+        else:
+            RunInteractive(args)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(args.profile)
+
+
 if __name__ == "__main__":
     main()
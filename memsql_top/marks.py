@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import time
+
+from attrdict import AttrDict
+
+
+class CompactSnapshot(object):
+    """
+    A raw counter snapshot (as returned by GetAllCounterSnapshots) stored as
+    one tuple of values per key, with the field names shared by all rows.
+    Rows are turned back into AttrDicts only when they are looked up, which
+    is all DiffPlanCache and ShapeGrouper need of the old snapshot.
+    """
+    __slots__ = ["fields", "rows"]
+
+    def __init__(self, plancache):
+        self.fields = None
+        self.rows = {}
+        for key, ent in plancache.items():
+            if self.fields is None:
+                self.fields = tuple(ent.keys())
+            self.rows[key] = tuple(ent[f] for f in self.fields)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __getitem__(self, key):
+        return AttrDict(zip(self.fields, self.rows[key]))
+
+    def get(self, key, default=None):
+        if key not in self.rows:
+            return default
+        return self[key]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def items(self):
+        return ((key, self[key]) for key in self.rows)
+
+
+class Mark(object):
+    """
+    A named baseline: the raw counters at the time it was taken.
+    """
+    __slots__ = ["name", "time", "snapshot"]
+
+    def __init__(self, name, time, plancache):
+        self.name = name
+        self.time = time
+        self.snapshot = CompactSnapshot(plancache)
+
+    def describe(self):
+        return "%s (%s)" % (self.name,
+                            time.strftime("%H:%M:%S", time.localtime(self.time)))
+
+
+def GetBaselineModes(marks):
+    """
+    The modes the baseline can cycle through: live (None), since each mark,
+    and between each pair of consecutive marks.
+    """
+    modes = [None]
+    modes += [(m, None) for m in marks]
+    modes += [(a, b) for a, b in zip(marks, marks[1:])]
+    return modes
+
+
+def DescribeBaseline(mode):
+    if mode is None:
+        return "live"
+    since, until = mode
+    if until is None:
+        return "since %s" % since.describe()
+    return "from %s to %s" % (since.describe(), until.describe())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import logging
+import time
+
+from attrdict import AttrDict
+
+from .DatabasePoller import DiffPlanCache
+
+BATCHES_QUERY = "select batch_id, database_name, pipeline_name, batch_state, " \
+    "rows_streamed, mb_streamed, batch_time " \
+    "from pipelines_batches_summary where batch_id > %d"
+
+MAX_BATCH_QUERY = "select max(batch_id) from pipelines_batches_summary"
+
+UNFINISHED_STATES = ("in progress", "queued")
+
+# MySQL's unknown table and no such table errors.
+NO_SUCH_TABLE_ERRORS = (1109, 1146)
+
+
+class PipelinesPoller(object):
+    """
+    Feeds the pipelines view.
+
+    Only batches newer than a watermark are fetched on each poll. Finished
+    batches are added to cumulative per-pipeline counters, which are then
+    diffed and normalized with DiffPlanCache exactly like the activity
+    counters. The watermark stops below the oldest unfinished batch, so that
+    batch is fetched again until it finishes; finished batches above the
+    watermark are remembered so they are only counted once.
+
+    The view is only given up on if the first poll finds no pipelines
+    table. Other errors are raised, and the next poll tries again.
+    """
+    def __init__(self, conn, column_meta):
+        self.conn = conn
+        self.column_meta = column_meta
+        self.watermark = None
+        self.counted = set()
+        self.totals = {}
+        self.plancache = {}
+        self.last_read_time = None
+        self.diff_plancache = {}
+        self.unavailable = False
+
+    def get_database_data(self):
+        return self.diff_plancache, None, None, frozenset()
+
+    def poll(self):
+        if self.unavailable:
+            return
+
+        if self.watermark is None:
+            try:
+                # Start counting from now, like the activity counters.
+                watermark = self.conn.query_rows(MAX_BATCH_QUERY)[0][0] or 0
+            except Exception as e:
+                if e.args and e.args[0] in NO_SUCH_TABLE_ERRORS:
+                    logging.warn("Pipelines are not available: %s" % e)
+                    self.unavailable = True
+                    return
+                raise
+            self.watermark = watermark
+            self.last_read_time = time.time()
+            return
+
+        new_time = time.time()
+        rows = self.conn.query_rows(BATCHES_QUERY % self.watermark)
+
+        oldest_unfinished = None
+        newest = self.watermark
+        for batch_id, db, pipeline, state, rows_streamed, mb, batch_time in rows:
+            newest = max(newest, batch_id)
+            if (state or "").lower() in UNFINISHED_STATES:
+                if oldest_unfinished is None or batch_id < oldest_unfinished:
+                    oldest_unfinished = batch_id
+                continue
+            if batch_id in self.counted:
+                continue
+            self.counted.add(batch_id)
+
+            key = (db, pipeline)
+            total = self.totals.get(key)
+            if total is None:
+                total = AttrDict({
+                    "database_name": db, "pipeline_name": pipeline,
+                    "rows": 0, "bytes": 0, "batches": 0,
+                    "batch_time_ms": 0, "failures": 0,
+                })
+                self.totals[key] = total
+            total["rows"] += int(rows_streamed or 0)
+            total["bytes"] += int((mb or 0) * 1024 * 1024)
+            total["batches"] += 1
+            total["batch_time_ms"] += int((batch_time or 0) * 1000)
+            if (state or "").lower() == "failed":
+                total["failures"] += 1
+
+        if oldest_unfinished is not None:
+            self.watermark = oldest_unfinished - 1
+        else:
+            self.watermark = newest
+        self.counted = set(b for b in self.counted if b > self.watermark)
+
+        new_plancache = dict((k, AttrDict(v)) for k, v in self.totals.items())
+        self.diff_plancache = DiffPlanCache(self.column_meta,
+                                            new_plancache, self.plancache,
+                                            new_time - self.last_read_time)
+        self.plancache = new_plancache
+        self.last_read_time = new_time
+
+
+def PipelineActivityFilter(ent):
+    """
+    Returns a filter for the activities of the pipeline in a pipelines view
+    entry: those in its database whose name mentions the pipeline.
+    """
+    db, pipeline = ent["Database"], ent["Pipeline"]
+    return lambda act: act.get("Database") == db and \
+        pipeline in (act.get("Name") or act.get("Query") or "")
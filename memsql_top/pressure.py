@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+from array import array
+
+#
+# How many ticks of history are kept, and so how many the resource bars'
+# sparklines can show.
+#
+HISTORY_TICKS = 60
+
+
+class PressureHistory(object):
+    """
+    The cluster's CPU scheduling wait (milliseconds of waiting for a CPU
+    per second) and major page faults per second, for each of the last
+    HISTORY_TICKS ticks. Both are kept in fixed rings of float32s, so the
+    history costs the same few hundred bytes however long we run.
+    """
+    def __init__(self, ticks=HISTORY_TICKS):
+        self.wait = array('f', [0.0] * ticks)
+        self.faults = array('f', [0.0] * ticks)
+        self.next = 0
+        self.count = 0
+        # How many ticks were ever added.
+        self.added = 0
+
+    def add(self, wait, faults):
+        self.wait[self.next] = wait
+        self.faults[self.next] = faults
+        self.next = (self.next + 1) % len(self.wait)
+        self.count = min(self.count + 1, len(self.wait))
+        self.added += 1
+
+    def last(self):
+        """
+        Returns the (wait, faults) of the last tick, or None if there has
+        not been one yet.
+        """
+        if not self.count:
+            return None
+        i = self.next - 1
+        return self.wait[i], self.faults[i]
+
+    def last_since(self, seen):
+        """
+        Returns how many ticks have been added and, if that is more than
+        seen, the (wait, faults) of the last one, else None. This lets the
+        collector and the worker pass each tick on once, even while the
+        poller thread adds more.
+        """
+        added = self.added
+        if added == seen:
+            return added, None
+        i = (added - 1) % len(self.wait)
+        return added, (self.wait[i], self.faults[i])
+
+    def series(self):
+        """
+        Returns the wait and faults of the recorded ticks, oldest first.
+        """
+        start = (self.next - self.count) % len(self.wait)
+        order = [(start + i) % len(self.wait) for i in range(self.count)]
+        return [self.wait[i] for i in order], [self.faults[i] for i in order]
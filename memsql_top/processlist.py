@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import threading
+
+
+class IncrementalPoller(object):
+    """
+    Feeds a view from a TableColumns snapshot, diffing consecutive snapshots
+    by key so that only the rows that changed are converted into entries and
+    handed to the UI.
+
+    The raw rows are kept as tuples; comparing them is cheap, so a tick in
+    which most rows are unchanged costs little more than fetching them.
+    """
+    def __init__(self, conn, column_meta):
+        self.conn = conn
+        self.column_meta = column_meta
+        self.query = column_meta.GetSnapshotQuery()
+        self.key_indexes = column_meta.GetKeyIndexes()
+        self.rows = {}
+        self.data = {}
+
+        # Changes the UI has not seen yet, guarded by lock.
+        self.lock = threading.Lock()
+        self.changed = set()
+        self.removed = set()
+
+    def poll(self):
+        key_indexes = self.key_indexes
+        new_rows = {}
+        for r in self.conn.query_rows(self.query):
+            new_rows[tuple(r[i] for i in key_indexes)] = r
+
+        old_rows = self.rows
+        changed = [k for k, r in new_rows.items() if old_rows.get(k) != r]
+        removed = [k for k in old_rows if k not in new_rows]
+
+        make_entry = self.column_meta.MakeEntry
+        with self.lock:
+            for k in changed:
+                self.data[k] = make_entry(new_rows[k])
+            for k in removed:
+                del self.data[k]
+            self.changed.update(changed)
+            self.changed.difference_update(removed)
+            self.removed.difference_update(changed)
+            self.removed.update(removed)
+        self.rows = new_rows
+
+    def get_database_data(self):
+        with self.lock:
+            return dict(self.data), None, None, frozenset()
+
+    def take_changes(self):
+        """
+        Returns the entries that were added or changed and the keys that were
+        removed since the last call.
+        """
+        with self.lock:
+            changed = dict((k, self.data[k]) for k in self.changed)
+            removed = self.removed
+            self.changed = set()
+            self.removed = set()
+        return changed, removed
+
+
+def KillQuery(conn, entry):
+    """
+    Kills the query running on the connection of a processlist entry.
+    Returns a message describing the outcome.
+    """
+    if entry is None:
+        return "No query selected."
+    try:
+        conn.execute("kill query %d" % int(entry["Id"]))
+    except Exception as e:
+        return "Failed to kill query on connection %s: %s" % (entry["Id"], e)
+    return "Killed query on connection %s." % entry["Id"]
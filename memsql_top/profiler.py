@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import os
+import sys
+import threading
+
+from collections import defaultdict
+
+#
+# Samples are attributed to the innermost frame on the stack whose function
+# appears in STAGE_FUNCTIONS or whose module appears in STAGE_MODULES.
+# Attributing by name means the poll and render loops need no
+# instrumentation, so they pay nothing when profiling is off.
+#
+# Rows are read from the server lazily (see Connection.query_stream), so
+# reading them shows up inside whatever consumes them; attributing all of
+# database.py to "poll" keeps that time apart. A poller's own poll() is
+# the outermost poll stage, for whatever its callees don't cover.
+#
+STAGE_FUNCTIONS = {
+    'poll': 'poll',
+    'GetAllCounterSnapshots': 'poll',
+    'IterCounterSnapshots': 'poll',
+    'GetCurrentMemTotal': 'poll',
+    'DiffPlanCache': 'diff',
+    'DiffCounters': 'diff',
+    'NormalizeCounterDelta': 'normalize',
+    'update_widgets': 'widget_update',
+    'update_entries': 'widget_update',
+    'apply_changes': 'widget_update',
+    'draw_screen': 'draw',
+}
+STAGE_MODULES = {
+    'database.py': 'poll',
+    'heavyhitters.py': 'diff',
+    'sketches.py': 'sketch',
+    'regression.py': 'regression',
+    'shapes.py': 'group',
+}
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Periodically samples the stacks of every other thread (the urwid main
+    loop, the ViewScheduler and the DatabasePoller) and counts them by
+    thread, stage and stack.
+    The counts are written in the collapsed stack format understood by
+    flamegraph.pl and speedscope.
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.counts = defaultdict(int)
+        self.labels = {}
+        self.stages = {}
+        self.stopped = threading.Event()
+        super(SamplingProfiler, self).__init__(name="SamplingProfiler")
+        self.daemon = True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+    def label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = "%s (%s)" % (code.co_name,
+                                 os.path.basename(code.co_filename))
+            self.labels[code] = label
+        return label
+
+    def stage(self, code):
+        if code not in self.stages:
+            self.stages[code] = STAGE_FUNCTIONS.get(code.co_name) or \
+                STAGE_MODULES.get(os.path.basename(code.co_filename))
+        return self.stages[code]
+
+    def sample(self):
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+
+            stage = None
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if stage is None:
+                    stage = self.stage(code)
+                stack.append(self.label(code))
+                frame = frame.f_back
+            stack.reverse()
+
+            key = (names.get(ident, str(ident)), stage or "other", tuple(stack))
+            self.counts[key] += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for (thread, stage, stack), count in sorted(self.counts.items()):
+                f.write("%s;%s;%s %d\n" % (thread, stage, ";".join(stack), count))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import os
+import sqlite3
+import threading
+import time
+
+from collections import namedtuple, OrderedDict
+
+from .humanize import CleanQuery
+
+DEFAULT_PATH = os.path.join("~", ".memsql-top-queries.db")
+
+#
+# How many query texts are kept, unless --max-memory-mb allows fewer.
+#
+MAX_ENTRIES = 50000
+
+QueryText = namedtuple("QueryText", ["raw", "cleaned"])
+
+
+class QueryTextCache(object):
+    """
+    A persistent, size bounded map from an activity name on one cluster to
+    its raw and cleaned query text.
+
+    Activity names are stable hashes of the query, so entries never go stale;
+    they are only evicted, least recently used first, once the cache holds
+    more than max_entries, both in memory and on disk. Lookups are served
+    from memory; new entries are written back to disk in bulk by flush().
+    The cleaned text is only made the first time it is asked for.
+
+    The cache is shared by the UI, the poller and the warming threads, so
+    every method takes the lock.
+    """
+    def __init__(self, path, cluster, max_entries=MAX_ENTRIES):
+        self.cluster = cluster
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.expanduser(path),
+                                  check_same_thread=False)
+        self.db.execute("create table if not exists query_text "
+                        "(cluster text, name text, raw text, cleaned text, "
+                        "last_used real, primary key (cluster, name))")
+
+        # Least recently used first.
+        self.entries = OrderedDict()
+        rows = list(self.db.execute(
+            "select name, raw, cleaned from query_text where cluster = ? "
+            "order by last_used desc, rowid desc limit ?",
+            (cluster, max_entries)))
+        for name, raw, cleaned in reversed(rows):
+            self.entries[name] = QueryText(raw, cleaned)
+        self.dirty = set()
+        self.used = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def touch(self, name):
+        ent = self.entries.pop(name, None)
+        if ent is not None:
+            self.entries[name] = ent
+            self.used.add(name)
+        return ent
+
+    def get(self, name):
+        with self.lock:
+            return self.touch(name)
+
+    def get_many(self, names):
+        """
+        Returns the raw text of those of names that are cached.
+        """
+        with self.lock:
+            texts = {}
+            for name in names:
+                ent = self.touch(name)
+                if ent is not None:
+                    texts[name] = ent.raw
+            return texts
+
+    def get_cleaned(self, name):
+        with self.lock:
+            ent = self.touch(name)
+            if ent is None:
+                return None
+            if ent.cleaned is None:
+                ent = self.entries[name] = ent._replace(
+                    cleaned=CleanQuery(ent.raw))
+                self.dirty.add(name)
+            return ent.cleaned
+
+    def put(self, name, raw):
+        with self.lock:
+            self.add(name, raw)
+
+    def put_many(self, rows):
+        with self.lock:
+            for name, raw in rows:
+                self.add(name, raw)
+
+    def add(self, name, raw):
+        ent = self.touch(name)
+        if ent is None or ent.raw != raw:
+            self.entries[name] = QueryText(raw, None)
+            self.dirty.add(name)
+            self.used.add(name)
+            while len(self.entries) > self.max_entries:
+                old, _ = self.entries.popitem(last=False)
+                self.dirty.discard(old)
+                self.used.discard(old)
+
+    def flush(self):
+        with self.lock:
+            now = time.time()
+            with self.db:
+                self.db.executemany(
+                    "insert or replace into query_text values (?, ?, ?, ?, ?)",
+                    [(self.cluster, name, self.entries[name].raw,
+                      self.entries[name].cleaned, now)
+                     for name in self.dirty])
+                self.db.executemany(
+                    "update query_text set last_used = ? "
+                    "where cluster = ? and name = ?",
+                    [(now, self.cluster, name)
+                     for name in self.used - self.dirty])
+
+                count = self.db.execute(
+                    "select count(*) from query_text").fetchone()[0]
+                if count > self.max_entries:
+                    self.db.execute(
+                        "delete from query_text where rowid in (select rowid "
+                        "from query_text order by last_used, rowid limit ?)",
+                        (count - self.max_entries,))
+            self.dirty = set()
+            self.used = set()
+
+    def close(self):
+        self.flush()
+        self.db.close()
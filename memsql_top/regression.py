@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import math
+
+from array import array
+
+from .compiler import NORMALIZE_GAUGE, NORMALIZE_PER_SECOND, \
+    NORMALIZE_PER_EXECUTION
+
+#
+# The baseline of each activity and column is an exponentially weighted mean
+# and variance whose weights halve every HALF_LIFE seconds, so it roughly
+# covers the last hour. An activity is only judged once it has been watched
+# for WARMUP seconds; before that, activities that show up after memsql-top
+# has itself been running for WARMUP seconds are reported as new.
+#
+HALF_LIFE = 3600.0
+WARMUP = 300.0
+
+#
+# Increases smaller than RELATIVE_FLOOR of the baseline mean are noise, even
+# for columns that have been perfectly steady so far.
+#
+RELATIVE_FLOOR = 0.1
+ABSOLUTE_FLOOR = 1e-6
+
+#
+# The score of a new activity, in standard deviations.
+#
+NEW_SCORE = 5.0
+
+#
+# Activities that have not been seen for FORGET_AFTER seconds are dropped
+# from the baselines; the sweep for them runs every HALF_LIFE seconds.
+#
+FORGET_AFTER = 4 * HALF_LIFE
+
+#
+# Columns whose value is 0 while an activity is idle. The baselines of these
+# decay towards 0 over the ticks an activity was not seen; the others (per
+# execution columns) have no value while idle and are left alone.
+#
+IDLE_ZERO_KINDS = (NORMALIZE_GAUGE, NORMALIZE_PER_SECOND)
+
+UNSET = float("nan")
+
+
+class Change(float):
+    """
+    How far an activity is from its baseline, in standard deviations, and
+    a short description of the column that is furthest from it.
+    """
+    def __new__(cls, score, text):
+        self = super(Change, cls).__new__(cls, score)
+        self.text = text
+        return self
+
+
+def HumanizeChange(c):
+    if c is None:
+        return ""
+    # Values decoded from a collector stream are plain floats.
+    return getattr(c, "text", "%.1f" % c)
+
+
+class Baseline(object):
+    __slots__ = ["stats", "first_seen", "last_seen"]
+
+    def __init__(self, width, now):
+        # The mean and variance of each column, interleaved; the mean is
+        # UNSET until the column first has a value.
+        self.stats = array('d', [UNSET, 0.0] * width)
+        self.first_seen = now
+        self.last_seen = None
+
+
+class RegressionDetector(object):
+    """
+    Keeps a trailing baseline of every numeric column of every activity, and
+    fills in the change column with how far each active activity currently
+    is from its own baseline. The work per tick is proportional to the
+    number of activities in the tick's deltas: the baselines of activities
+    that were idle are caught up when they are next seen.
+
+    Only increases count: a regression is an activity that got busier or
+    slower than it usually is. Columns that are not fetched (see
+    MemSqlColumnsMetadata.Project) are skipped.
+
+    With max_entries, the baselines of the activities seen least recently
+    are dropped once there are more than that.
+    """
+    def __init__(self, column_meta, change_column, now, max_entries=None):
+        self.change_column = change_column
+        self.columns = [
+            (name, meta.humanize, meta.colorize,
+             meta.normalize in IDLE_ZERO_KINDS)
+            for name, meta in column_meta.all_columns.items()
+            if meta.memsql_column_name is not None and
+            meta.normalize in (NORMALIZE_GAUGE, NORMALIZE_PER_SECOND,
+                               NORMALIZE_PER_EXECUTION)]
+        self.baselines = {}
+        self.max_entries = max_entries
+        self.start = now
+        self.last_sweep = now
+
+    def update(self, diff_plancache, now, interval):
+        baselines = self.baselines
+        columns = self.columns
+        width = len(columns)
+        change_column = self.change_column
+        keep = 2 ** (-interval / HALF_LIFE)
+        alpha = 1 - keep
+        watching_for_new = now - self.start >= WARMUP
+
+        for key, ent in diff_plancache.items():
+            baseline = baselines.get(key)
+            if baseline is None:
+                baseline = baselines[key] = Baseline(width, now)
+
+            stats = baseline.stats
+            if baseline.last_seen is not None:
+                # Catch up with the ticks this activity was idle for.
+                idle = now - baseline.last_seen - interval
+                if idle > 0:
+                    d = 2 ** (-idle / HALF_LIFE)
+                    for i, (_, _, _, idle_zero) in enumerate(columns):
+                        mean = stats[2 * i]
+                        if idle_zero and mean == mean:
+                            stats[2 * i] = d * mean
+                            stats[2 * i + 1] = d * (stats[2 * i + 1] +
+                                                    (1 - d) * mean * mean)
+
+            if now - baseline.first_seen < WARMUP:
+                # Too young to judge, but it is news if we were already
+                # watching when it showed up.
+                if watching_for_new and \
+                        baseline.first_seen - self.start >= WARMUP:
+                    ent[change_column] = Change(NEW_SCORE, "new")
+                else:
+                    ent[change_column] = Change(0.0, "")
+                best = None
+            else:
+                best = 0.0
+                best_text = ""
+
+            for i, (name, humanize, colorize, _) in enumerate(columns):
+                x = ent.get(name)
+                if x is None:
+                    continue
+                mean = stats[2 * i]
+                var = stats[2 * i + 1]
+
+                if mean != mean:
+                    stats[2 * i] = x
+                    stats[2 * i + 1] = 0.0
+                    continue
+
+                # Values too small to be coloured are not worth reporting,
+                # however many times their usual size they are.
+                if best is not None and x > mean and colorize(x):
+                    sd = max(math.sqrt(var), RELATIVE_FLOOR * abs(mean),
+                             ABSOLUTE_FLOOR)
+                    score = (x - mean) / sd
+                    if score > best:
+                        best = score
+                        if mean > ABSOLUTE_FLOOR and x >= 2 * mean:
+                            best_text = "%s %.0fx" % (name, x / mean)
+                        else:
+                            best_text = "%s +%s" % (name, humanize(x - mean))
+
+                diff = x - mean
+                incr = alpha * diff
+                stats[2 * i] = mean + incr
+                stats[2 * i + 1] = keep * (var + diff * incr)
+
+            if best is not None:
+                ent[change_column] = Change(best, best_text)
+            baseline.last_seen = now
+
+        if now - self.last_sweep >= HALF_LIFE:
+            self.sweep(now)
+        if self.max_entries is not None and \
+                len(baselines) > self.max_entries:
+            self.trim()
+
+    def sweep(self, now):
+        self.last_sweep = now
+        for key in [k for k, b in self.baselines.items()
+                    if now - b.last_seen > FORGET_AFTER]:
+            del self.baselines[key]
+
+    def trim(self):
+        # Drop a quarter more than needed, so this sort runs rarely.
+        baselines = self.baselines
+        keep = self.max_entries * 3 // 4
+        stale = sorted(baselines, key=lambda k: baselines[k].last_seen)
+        for key in stale[:len(baselines) - keep]:
+            del baselines[key]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+from .compiler import NORMALIZE_TEXT, RawColumns
+from .humanize import FingerprintQuery
+
+#
+# Fingerprints are memoized by activity name. Names are stable hashes, so an
+# entry never goes stale, but clusters can make up thousands of new names a
+# minute; once there are more than MAX_FINGERPRINTS (or the number that fits
+# in --max-memory-mb) the memo starts over.
+#
+MAX_FINGERPRINTS = 100000
+
+
+class ShapeGrouper(object):
+    """
+    Groups activities whose queries have the same shape (see
+    FingerprintQuery), e.g. the same query sent with different literals or
+    differently formatted by different clients. Query text is looked up in
+    query_cache, if given, before asking the cluster.
+
+    Groups are made from the raw counter deltas, which are summed and only
+    then normalized, so per execution columns are averages over all the
+    executions in the group. The focus column of a group shows the shape.
+    """
+    def __init__(self, column_meta, query_cache=None,
+                 max_fingerprints=MAX_FINGERPRINTS):
+        self.set_columns(column_meta)
+        self.query_cache = query_cache
+        self.max_fingerprints = max_fingerprints
+        self.fingerprints = {}
+
+    def set_columns(self, column_meta):
+        self.column_meta = column_meta
+        names, kinds = RawColumns(column_meta.fetched)
+        self.focus_raw = \
+            column_meta.columns[column_meta.focus_column].memsql_column_name
+        self.text = [n for n in names
+                     if kinds[n] == NORMALIZE_TEXT and n != self.focus_raw]
+        self.counters = [n for n in names if kinds[n] != NORMALIZE_TEXT]
+
+    def learn(self, conn, keys, snapshot):
+        """
+        Fingerprints the queries of the activities among keys that have not
+        been seen before. This queries the cluster, so it is only called
+        from the poller thread.
+        """
+        shape_name = self.column_meta.ShapeName
+        unknown = {}
+        for key in keys:
+            raw = snapshot.get(key)
+            if raw is None:
+                continue
+            name = shape_name(raw)
+            if name not in self.fingerprints:
+                unknown[name] = raw
+        if not unknown:
+            return
+
+        if len(self.fingerprints) + len(unknown) > self.max_fingerprints:
+            self.fingerprints = {}
+        texts = self.column_meta.GetQueryTexts(
+            conn, list(unknown.values()), self.query_cache)
+        for name in unknown:
+            text = texts.get(name)
+            # Activities that are not queries are a shape of their own.
+            self.fingerprints[name] = \
+                FingerprintQuery(text) if text else name
+
+    def group(self, keys, new_plancache, old_plancache, interval):
+        """
+        Returns the normalized deltas of each group of the activities keys
+        between the two snapshots, and the activities in each group.
+        Activities that have not been fingerprinted yet are grouped on their
+        own.
+        """
+        meta = self.column_meta
+        diff_counters = meta.DiffCounters
+        shape_name = meta.ShapeName
+        fingerprints = self.fingerprints
+        focus_raw = self.focus_raw
+        text = self.text
+        counters = self.counters
+
+        sums = {}
+        members = {}
+        for key in keys:
+            new = new_plancache[key]
+            old = old_plancache.get(key)
+            delta = new if old is None else diff_counters(new, old)
+
+            shape = fingerprints.get(shape_name(new), new[focus_raw])
+            group = tuple(new[n] for n in text) + (shape,)
+            acc = sums.get(group)
+            if acc is None:
+                acc = sums[group] = dict(delta)
+                acc[focus_raw] = shape
+                members[group] = [key]
+                continue
+            for n in counters:
+                a, b = acc[n], delta[n]
+                acc[n] = b if a is None else a if b is None else a + b
+            members[group].append(key)
+
+        normalize = meta.NormalizeCounterDelta
+        grouped = dict((group, normalize(acc, interval))
+                       for group, acc in sums.items())
+        return grouped, members
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import math
+import threading
+
+from array import array
+from attrdict import AttrDict
+
+#
+# Latencies are counted in BUCKETS log spaced buckets from MIN_LATENCY to
+# MAX_LATENCY ms (values outside are clamped), so a quantile is off by at
+# most about 10%. With float32 counts a sketch takes about 500 bytes,
+# including the Python object overhead.
+#
+BUCKETS = 96
+MIN_LATENCY = 0.01
+MAX_LATENCY = 3600 * 1000.0
+GAMMA = (MAX_LATENCY / MIN_LATENCY) ** (1.0 / BUCKETS)
+LOG_GAMMA = math.log(GAMMA)
+ZEROS = array('f', [0.0] * BUCKETS)
+
+#
+# Older completions count for less: their weight halves every HALF_LIFE
+# seconds, which makes the quantiles cover roughly the last few minutes.
+#
+# Rather than decaying every sketch on every tick, new completions are
+# weighted up by 2 ** ((now - landmark) / HALF_LIFE) ("forward decay"), which
+# only touches the sketches of activities that completed something. Once the
+# weights get large, every sketch is scaled back down and the landmark is
+# moved forward; sketches that have become negligible are dropped then.
+#
+HALF_LIFE = 120.0
+RESCALE_AFTER = 40 * HALF_LIFE
+NEGLIGIBLE = 1e-6
+
+
+def BucketIndex(latency):
+    if latency <= MIN_LATENCY:
+        return 0
+    return min(BUCKETS - 1, int(math.log(latency / MIN_LATENCY) / LOG_GAMMA))
+
+
+def BucketValue(i):
+    # The geometric middle of the bucket.
+    return MIN_LATENCY * GAMMA ** (i + 0.5)
+
+
+class LatencySketch(object):
+    """
+    A log bucketed histogram of latencies, weighted by completions. Sketches
+    with the same landmark can be merged by adding them.
+    """
+    __slots__ = ["counts", "total", "lo", "hi", "database"]
+
+    def __init__(self, database):
+        self.counts = array('f', ZEROS)
+        self.total = 0.0
+        self.lo = BUCKETS
+        self.hi = -1
+        self.database = database
+
+    def add(self, latency, weight):
+        i = BucketIndex(latency)
+        self.counts[i] += weight
+        self.total += weight
+        if i < self.lo:
+            self.lo = i
+        if i > self.hi:
+            self.hi = i
+
+    def merge(self, other):
+        for i in range(other.lo, other.hi + 1):
+            self.counts[i] += other.counts[i]
+        self.total += other.total
+        self.lo = min(self.lo, other.lo)
+        self.hi = max(self.hi, other.hi)
+
+    def scale(self, factor):
+        for i in range(self.lo, self.hi + 1):
+            self.counts[i] *= factor
+        self.total *= factor
+
+    def quantiles(self, qs):
+        """
+        Returns the latency at each of the quantiles qs, which are sorted.
+        """
+        out = []
+        if self.total <= 0:
+            return [None] * len(qs)
+        counts = self.counts
+        seen = 0.0
+        i = self.lo
+        for q in qs:
+            target = q * self.total
+            while i < self.hi and seen + counts[i] < target:
+                seen += counts[i]
+                i += 1
+            out.append(BucketValue(i))
+        return out
+
+
+class LatencySketches(object):
+    """
+    The latency sketches of every activity. Each tick, the activities that
+    completed something add their mean latency in that tick, weighted by the
+    number of completions, and get their quantile columns filled in.
+
+    MemSQL only gives us the mean latency of each activity per tick, so the
+    quantiles are of those means: a slow tick shows in p99, but a few slow
+    executions among many fast ones in the same tick do not.
+
+    With max_entries, the lightest sketches are dropped once there are more
+    than that.
+    """
+    def __init__(self, column_meta, now, max_entries=None):
+        self.latency_column, self.completions_column = \
+            column_meta.sketch_columns
+        self.quantile_columns = [
+            (name, meta.quantile)
+            for name, meta in column_meta.all_columns.items()
+            if meta.quantile is not None]
+        self.qs = [q for _, q in self.quantile_columns]
+        self.sketches = {}
+        self.max_entries = max_entries
+        self.landmark = now
+        self.lock = threading.Lock()
+
+    def update(self, diff_plancache, now, interval):
+        with self.lock:
+            if now - self.landmark > RESCALE_AFTER:
+                self.rescale(now)
+
+            weight = 2 ** ((now - self.landmark) / HALF_LIFE) * interval
+            sketches = self.sketches
+            latency_column = self.latency_column
+            completions_column = self.completions_column
+            quantile_columns = self.quantile_columns
+            qs = self.qs
+            for key, ent in diff_plancache.items():
+                sketch = sketches.get(key)
+                latency = ent[latency_column]
+                completions = ent[completions_column]
+                if latency is not None and completions:
+                    if sketch is None:
+                        sketch = sketches[key] = LatencySketch(ent.Database)
+                    sketch.add(latency, completions * weight)
+                if sketch is None:
+                    continue
+                for (name, _), v in zip(quantile_columns, sketch.quantiles(qs)):
+                    ent[name] = v
+
+            if self.max_entries is not None and \
+                    len(sketches) > self.max_entries:
+                self.trim()
+
+    def fill_groups(self, grouped, members):
+        """
+        Fills in the quantile columns of groups of activities from their
+        merged sketches.
+        """
+        with self.lock:
+            for group, ent in grouped.items():
+                merged = None
+                for key in members[group]:
+                    sketch = self.sketches.get(key)
+                    if sketch is None:
+                        continue
+                    if merged is None:
+                        merged = LatencySketch(sketch.database)
+                    merged.merge(sketch)
+                if merged is None:
+                    continue
+                for (name, _), v in zip(self.quantile_columns,
+                                        merged.quantiles(self.qs)):
+                    ent[name] = v
+
+    def rescale(self, now):
+        factor = 2 ** (-(now - self.landmark) / HALF_LIFE)
+        self.landmark = now
+        for key, sketch in list(self.sketches.items()):
+            sketch.scale(factor)
+            if sketch.total < NEGLIGIBLE:
+                del self.sketches[key]
+
+    def trim(self):
+        # Drop a quarter more than needed, so this sort runs rarely. All
+        # the sketches share the landmark, so their totals compare.
+        sketches = self.sketches
+        keep = self.max_entries * 3 // 4
+        light = sorted(sketches, key=lambda k: sketches[k].total)
+        for key in light[:len(sketches) - keep]:
+            del sketches[key]
+
+    def by_database(self):
+        """
+        Returns the merged sketch and the number of activities of every
+        database.
+        """
+        merged = {}
+        with self.lock:
+            for sketch in self.sketches.values():
+                db = sketch.database
+                if db not in merged:
+                    merged[db] = [LatencySketch(db), 0]
+                merged[db][0].merge(sketch)
+                merged[db][1] += 1
+        return merged
+
+
+class LatencyByDatabasePoller(object):
+    """
+    Feeds the databases view from the activities' latency sketches.
+    """
+    def __init__(self, sketches, column_meta):
+        self.sketches = sketches
+        self.quantile_columns = [
+            (name, meta.quantile) for name, meta in column_meta.columns.items()
+            if meta.quantile is not None]
+        self.data = {}
+
+    def get_database_data(self):
+        return self.data, None, None, frozenset()
+
+    def poll(self):
+        qs = [q for _, q in self.quantile_columns]
+        data = {}
+        for db, (sketch, activities) in self.sketches.by_database().items():
+            ent = AttrDict({"Database": db, "Activities": float(activities)})
+            for (name, _), v in zip(self.quantile_columns,
+                                    sketch.quantiles(qs)):
+                ent[name] = v
+            data[db] = ent
+        self.data = data
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import time
+
+from collections import namedtuple
+
+from .columns import NodesColumns58, ProcesslistColumns, BlockingColumns, \
+    PipelinesColumns, DatabaseLatencyColumns
+from .locks import BlockingChainPoller
+from .pipelines import PipelinesPoller, PipelineActivityFilter
+from .processlist import IncrementalPoller, KillQuery
+from .sketches import LatencyByDatabasePoller
+
+#
+# What a view factory gets to build its view from: the parsed arguments, a
+# connection reserved for the ViewScheduler thread, a connection for actions
+# taken from the UI thread, the cluster's activity columns, the activities
+# DatabasePoller and a function that returns the popup text for an activity.
+#
+ViewContext = namedtuple("ViewContext", ["args", "conn", "ui_conn",
+                                         "columns_meta", "dbpoller",
+                                         "popup_text"])
+
+
+class View(object):
+    """
+    A tab in the UI: the columns it shows, the poller that feeds it and how
+    often to poll it while it is visible and while it is in the background
+    (None to not poll it at all in the background).
+
+    actions maps a key to a function that is called with the selected row's
+    values, only if a row is selected, and returns a message to show, if
+    any. commands are the same for keys that do not act on a row; they are
+    called with no arguments. links maps a key to the name of
+    another view and a function that, given the selected row's values,
+    returns a filter for the rows of that view.
+
+    error is why the last poll failed, if it did.
+    """
+    def __init__(self, name, column_meta, poller, interval,
+                 background_interval=None, popup_text=None, actions=None,
+                 links=None, commands=None):
+        self.name = name
+        self.column_meta = column_meta
+        self.poller = poller
+        self.interval = interval
+        self.background_interval = background_interval
+        self.popup_text = popup_text or (lambda name: name)
+        self.actions = actions or {}
+        self.commands = commands or {}
+        self.links = links or {}
+        self.last_poll = None
+        self.error = None
+
+    def next_poll(self, visible):
+        interval = self.interval if visible else self.background_interval
+        if interval is None:
+            return None
+        if self.last_poll is None:
+            return 0
+        return self.last_poll + interval
+
+
+class SnapshotPoller(object):
+    """
+    Feeds a view from a TableColumns snapshot, e.g. one row per node.
+    """
+    def __init__(self, conn, column_meta):
+        self.conn = conn
+        self.column_meta = column_meta
+        self.data = {}
+
+    def poll(self):
+        self.data = self.column_meta.GetSnapshot(self.conn)
+
+    def get_database_data(self):
+        return self.data, None, None, frozenset()
+
+
+VIEW_FACTORIES = []
+
+
+def RegisterView(factory):
+    """
+    Registers a function that takes a ViewContext and returns a View, or None
+    if the view is not supported by the cluster. Views are shown as tabs in
+    registration order.
+    """
+    VIEW_FACTORIES.append(factory)
+    return factory
+
+
+def BuildViews(context):
+    views = [factory(context) for factory in VIEW_FACTORIES]
+    return [v for v in views if v is not None]
+
+
+@RegisterView
+def ActivitiesView(context):
+    interval = context.args.update_interval
+    dbpoller = context.dbpoller
+    commands = {}
+    for key in "mM":
+        commands[key] = dbpoller.add_mark
+    for key in "bB":
+        commands[key] = dbpoller.cycle_baseline
+    for key in "gG":
+        commands[key] = dbpoller.toggle_grouping
+    for key in "cC":
+        commands[key] = dbpoller.cycle_columns
+
+    # Keep the activity deltas (and the resource bars) going in the
+    # background, just less often.
+    return View("Activities", context.columns_meta, dbpoller,
+                interval, 5 * interval, context.popup_text,
+                commands=commands)
+
+
+@RegisterView
+def NodesView(context):
+    column_meta = NodesColumns58()
+    if context.columns_meta.minimum_version < column_meta.minimum_version:
+        return None
+    return View("Nodes", column_meta, SnapshotPoller(context.conn, column_meta),
+                context.args.update_interval, 30.0)
+
+
+@RegisterView
+def QueriesView(context):
+    column_meta = ProcesslistColumns()
+    kill = lambda ent: KillQuery(context.ui_conn, ent)
+    return View("Queries", column_meta,
+                IncrementalPoller(context.conn, column_meta),
+                context.args.update_interval,
+                actions={'k': kill, 'K': kill})
+
+
+@RegisterView
+def LocksView(context):
+    return View("Locks", BlockingColumns(), BlockingChainPoller(context.conn),
+                context.args.update_interval)
+
+
+@RegisterView
+def PipelinesView(context):
+    column_meta = PipelinesColumns()
+    if context.columns_meta.minimum_version < column_meta.minimum_version:
+        return None
+    link = ("Activities", PipelineActivityFilter)
+    return View("Pipelines", column_meta,
+                PipelinesPoller(context.conn, column_meta),
+                context.args.update_interval, 5 * context.args.update_interval,
+                links={'a': link, 'A': link})
+
+
+@RegisterView
+def DatabasesView(context):
+    sketches = context.dbpoller.sketches
+    if sketches is None:
+        return None
+    column_meta = DatabaseLatencyColumns()
+    link = ("Activities",
+            lambda ent: lambda act: act.get("Database") == ent["Database"])
+    return View("Databases", column_meta,
+                LatencyByDatabasePoller(sketches, column_meta),
+                context.args.update_interval, None,
+                links={'a': link, 'A': link})
+
+
+class ViewScheduler(threading.Thread):
+    """
+    Polls every view on one thread: the visible view at its full rate and
+    the others at their background rate, if any. Switching views wakes the
+    scheduler so that the new view is refreshed right away. A view whose
+    poll fails (e.g. on a transient network error) keeps its last rows and
+    shows the error, and is polled again at its next turn.
+    """
+    def __init__(self, views):
+        self.views = views
+        self.visible = views[0]
+        self.wakeup = threading.Event()
+        super(ViewScheduler, self).__init__(name="ViewScheduler")
+
+    def start(self, signal_file):
+        self.daemon = True
+        self.signal_file = signal_file
+        super(ViewScheduler, self).start()
+
+    def set_visible(self, view):
+        self.visible = view
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.clear()
+            polled = False
+            for view in self.views:
+                due = view.next_poll(view is self.visible)
+                now = time.time()
+                if due is not None and due <= now:
+                    view.last_poll = now
+                    self.poll(view)
+                    polled = True
+            if polled:
+                os.write(self.signal_file, str.encode("\n"))
+
+            dues = [d for d in (v.next_poll(v is self.visible)
+                                for v in self.views) if d is not None]
+            timeout = max(0, min(dues) - time.time()) if dues else None
+            self.wakeup.wait(timeout)
+
+    def poll(self, view):
+        try:
+            view.poller.poll()
+        except Exception as e:
+            # Only log when a view starts failing, not on every retry.
+            if view.error is None:
+                logging.warn("Failed to poll %s: %s" % (view.name, e))
+            view.error = "%s failed: %s" % (view.name, e)
+            return
+        view.error = None
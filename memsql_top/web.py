@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import errno
+import json
+import os
+import select
+import socket
+
+try:
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from urlparse import urlparse, parse_qs
+
+from .collector import ClientOutput
+from .humanize import HumanizePercent
+
+#
+# Event stream format. Every event is one JSON object:
+#
+#   {"reset": true, ...}     sent first; drop all rows.
+#   "set": {id: row}         rows that are new or whose cells changed; a row
+#                            is [texts, colors, alerting].
+#   "del": [id, ...]         rows that went away.
+#   "rank": {id: rank}       new positions of rows that moved.
+#   "head": {...}            resource usage and status.
+#
+# Rows are humanized and colorized once per frame and sorted once per sort
+# column in use on the server, and each event is encoded once for all the
+# clients that use that sort column.
+#
+
+MAX_REQUEST = 8192
+
+
+class RankedTable(object):
+    """
+    The rows in one sort order, as last sent to clients.
+    """
+    def __init__(self, sort_column):
+        self.sort_column = sort_column
+        self.rows = {}
+        self.ranks = {}
+
+    def update(self, rows, plancache, ids):
+        """
+        Takes the rendered rows by id, the entries they were rendered from
+        and the ids of their keys. Returns the changes as an event.
+        """
+        changed = dict((i, row) for i, row in rows.items()
+                       if self.rows.get(i) != row)
+        removed = [i for i in self.rows if i not in rows]
+
+        if self.sort_column is None:
+            order = [ids[key] for key in plancache]
+        else:
+            sort = self.sort_column
+            by_id = dict((ids[key], ent[sort])
+                         for key, ent in plancache.items())
+            order = sorted(by_id, reverse=True, key=lambda i: (
+                by_id[i] is not None, by_id[i], int(i)))
+        ranks = dict((i, rank) for rank, i in enumerate(order))
+        moved = dict((i, rank) for i, rank in ranks.items()
+                     if self.ranks.get(i) != rank)
+
+        self.rows = rows
+        self.ranks = ranks
+        return {"set": changed, "del": removed, "rank": moved}
+
+    def snapshot(self):
+        return {"reset": True, "set": self.rows, "del": [],
+                "rank": self.ranks}
+
+
+def EncodeEvent(event):
+    return ("data: %s\n\n" % json.dumps(event, separators=(",", ":"))) \
+        .encode("utf-8")
+
+
+class WebDashboard(object):
+    """
+    Serves a static page and streams the frames of one DatabasePoller to any
+    number of browsers with server-sent events, from a single thread. The
+    work per frame depends on the number of sort columns in use, not on the
+    number of browsers.
+    """
+    def __init__(self, port, column_meta, dbpoller, max_cpu, max_mem,
+                 host="127.0.0.1"):
+        self.column_meta = column_meta
+        self.dbpoller = dbpoller
+        self.max_cpu = max_cpu
+        self.max_mem = max_mem
+        self.output = ClientOutput()
+        self.page = BuildPage(column_meta).encode("utf-8")
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(16)
+
+        # Requests still being read, and the event streams by sort column.
+        self.pending = {}
+        self.tables = {}
+        self.clients = {}
+
+        # The last frame, rendered once for all sort columns.
+        self.ids = {}
+        self.next_id = 0
+        self.plancache = {}
+        self.rows = {}
+        self.head = {}
+
+    def serve_forever(self):
+        signal_r, signal_w = os.pipe()
+        self.dbpoller.start(signal_w)
+        try:
+            while True:
+                streams = [c for cs in self.clients.values() for c in cs]
+                readable, writable, _ = select.select(
+                    [self.listener, signal_r] + list(self.pending) + streams,
+                    self.output.waiting(), [])
+                for w in writable:
+                    if w in self.output:
+                        self.output.flush(w)
+                for r in readable:
+                    if r is self.listener:
+                        client, _ = self.listener.accept()
+                        self.output.add(client)
+                        self.pending[client] = b""
+                    elif r == signal_r:
+                        os.read(signal_r, 4096)
+                        self.publish()
+                    elif r in self.pending:
+                        self.read_request(r)
+                    elif r in self.output:
+                        self.drop_if_closed(r)
+                for clients in self.clients.values():
+                    clients[:] = [c for c in clients if c in self.output]
+        finally:
+            self.listener.close()
+
+    def read_request(self, client):
+        try:
+            data = client.recv(4096)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b""
+        buf = self.pending[client] + data
+        if not data or len(buf) > MAX_REQUEST:
+            del self.pending[client]
+            self.output.close(client)
+            return
+        if b"\r\n\r\n" not in buf:
+            self.pending[client] = buf
+            return
+
+        del self.pending[client]
+        request_line = buf.split(b"\r\n", 1)[0].decode("latin-1")
+        parts = request_line.split()
+        url = urlparse(parts[1] if len(parts) > 1 else "/")
+        if url.path == "/":
+            self.output.send(client, b"HTTP/1.0 200 OK\r\n"
+                             b"Content-Type: text/html; charset=utf-8\r\n"
+                             b"Content-Length: " +
+                             str(len(self.page)).encode() +
+                             b"\r\n\r\n" + self.page, close=True)
+        elif url.path == "/events":
+            sort = parse_qs(url.query).get("sort", [None])[0]
+            self.subscribe(client, sort)
+        else:
+            self.output.send(client, b"HTTP/1.0 404 Not Found\r\n\r\n",
+                             close=True)
+
+    def subscribe(self, client, sort):
+        columns = self.column_meta.columns
+        if sort not in columns or not columns[sort].is_numeric():
+            sort = self.column_meta.default_sort_key
+
+        table = self.tables.get(sort)
+        if table is None:
+            table = self.tables[sort] = RankedTable(sort)
+            table.update(self.rows, self.plancache, self.ids)
+
+        event = table.snapshot()
+        event["head"] = self.head
+        event["sort"] = sort
+        if self.output.send(client, b"HTTP/1.0 200 OK\r\n"
+                            b"Content-Type: text/event-stream\r\n"
+                            b"Cache-Control: no-cache\r\n\r\n" +
+                            EncodeEvent(event)):
+            self.clients.setdefault(sort, []).append(client)
+
+    def render(self, plancache, alerting):
+        """
+        Humanizes and colorizes every entry. Returns the rows by id; a row
+        is [texts, colors, alerting].
+        """
+        columns = list(self.column_meta.columns.items())
+        ids = self.ids
+        rows = {}
+        for key, ent in plancache.items():
+            i = ids.get(key)
+            if i is None:
+                i = ids[key] = str(self.next_id)
+                self.next_id += 1
+            values = [ent[name] for name, _ in columns]
+            rows[i] = [
+                [meta.humanize(v) for (_, meta), v in zip(columns, values)],
+                [meta.colorize(v) for (_, meta), v in zip(columns, values)],
+                1 if key in alerting else 0,
+            ]
+        for key in [k for k in ids if k not in plancache]:
+            del ids[key]
+        return rows
+
+    def publish(self):
+        plancache, cpu, mem, alerting = self.dbpoller.get_database_data()
+        self.plancache = plancache
+        self.rows = self.render(plancache, alerting)
+
+        cpu = cpu / self.max_cpu if cpu is not None and self.max_cpu else None
+        mem = mem / self.max_mem if mem is not None and self.max_mem else None
+        self.head = {
+            "cpu": cpu,
+            "mem": mem,
+            "cpu_text": HumanizePercent(cpu),
+            "mem_text": HumanizePercent(mem),
+            "status": self.dbpoller.status(),
+        }
+
+        # Tables nobody is watching anymore are dropped, not kept up to date.
+        for sort in [s for s, cs in self.clients.items() if not cs]:
+            del self.clients[sort]
+            del self.tables[sort]
+
+        for sort, clients in self.clients.items():
+            event = self.tables[sort].update(self.rows, plancache, self.ids)
+            event["head"] = self.head
+            msg = EncodeEvent(event)
+            for client in list(clients):
+                if not self.output.send(client, msg):
+                    clients.remove(client)
+
+    def drop_if_closed(self, client):
+        try:
+            data = client.recv(4096)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b""
+        if not data:
+            self.output.close(client)
+            for clients in self.clients.values():
+                if client in clients:
+                    clients.remove(client)
+
+
+def BuildPage(column_meta):
+    columns = [{"name": name, "help": meta.help or "",
+                "sortable": meta.is_numeric()}
+               for name, meta in column_meta.columns.items()]
+    return PAGE_TEMPLATE.replace("__COLUMNS__", json.dumps(columns))
+
+
+PAGE_TEMPLATE = u"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>MemSQL Top</title>
+<style>
+body { font-family: monospace; margin: 0; color: #585858; }
+#head { background: #1c1c1c; color: #878787; padding: 4px 8px; }
+.bar { display: inline-block; width: 20em; height: 0.8em; background: #000; }
+.bar div { height: 100%; background: #005f87; }
+table { border-collapse: collapse; width: 100%; }
+th { background: #1c1c1c; color: #878787; text-align: left; padding: 2px 6px; }
+th.sortable { cursor: pointer; text-decoration: underline; }
+th.sorted { color: #fff; }
+td { padding: 1px 6px; white-space: nowrap; overflow: hidden;
+     max-width: 40em; text-overflow: ellipsis; }
+.c1 { color: #5fd75f; } .c2 { color: #ffd700; }
+.c3 { color: #ff5f00; } .c4 { color: #d70000; }
+tr.alert td { background: #af0000; color: #fff; font-weight: bold; }
+</style>
+</head>
+<body>
+<div id="head">
+MemSQL - MemSQL Top &nbsp;
+CPU <span class="bar"><div id="cpu"></div></span> <span id="cpu_text"></span>
+&nbsp; Memory <span class="bar"><div id="mem"></div></span>
+<span id="mem_text"></span> &nbsp; <span id="status"></span>
+</div>
+<table><thead><tr id="headings"></tr></thead><tbody id="rows"></tbody></table>
+<script>
+var COLUMNS = __COLUMNS__;
+var rows = {}, ranks = {}, source = null, sort = null, dirty = false;
+
+function escapeHtml(s) {
+  return String(s).replace(/&/g, "&amp;").replace(/</g, "&lt;")
+                  .replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+}
+
+function render() {
+  dirty = false;
+  var ids = Object.keys(ranks).sort(function(a, b) {
+    return ranks[a] - ranks[b];
+  });
+  var html = [];
+  ids.forEach(function(id) {
+    var row = rows[id];
+    if (!row) return;
+    html.push(row[2] ? '<tr class="alert">' : '<tr>');
+    for (var i = 0; i < row[0].length; i++) {
+      var text = escapeHtml(row[0][i]);
+      html.push('<td class="c' + row[1][i] + '" title="' + text + '">' +
+                text + '</td>');
+    }
+    html.push('</tr>');
+  });
+  document.getElementById("rows").innerHTML = html.join("");
+}
+
+function renderHeadings() {
+  var tr = document.getElementById("headings");
+  tr.innerHTML = "";
+  COLUMNS.forEach(function(c) {
+    var th = document.createElement("th");
+    th.textContent = c.name;
+    th.title = c.help;
+    if (c.sortable) {
+      th.className = "sortable" + (c.name === sort ? " sorted" : "");
+      th.onclick = function() { connect(c.name); };
+    }
+    tr.appendChild(th);
+  });
+}
+
+function onEvent(e) {
+  var ev = JSON.parse(e.data);
+  if (ev.reset) { rows = {}; ranks = {}; }
+  if (ev.sort) { sort = ev.sort; renderHeadings(); }
+  for (var id in ev.set) rows[id] = ev.set[id];
+  ev.del.forEach(function(id) { delete rows[id]; delete ranks[id]; });
+  for (var id in ev.rank) ranks[id] = ev.rank[id];
+  var h = ev.head || {};
+  ["cpu", "mem"].forEach(function(r) {
+    document.getElementById(r).style.width =
+      (h[r] == null ? 0 : Math.min(100, 100 * h[r])) + "%";
+    document.getElementById(r + "_text").textContent = h[r + "_text"] || "";
+  });
+  document.getElementById("status").textContent = h.status || "";
+  if (!dirty) { dirty = true; window.requestAnimationFrame(render); }
+}
+
+function connect(by) {
+  if (source) source.close();
+  source = new EventSource("/events" +
+                           (by ? "?sort=" + encodeURIComponent(by) : ""));
+  source.onmessage = onEvent;
+}
+
+connect(null);
+</script>
+</body>
+</html>
+"""
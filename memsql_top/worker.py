@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import absolute_import
+
+import json
+import logging
+import multiprocessing
+import socket
+import sys
+import threading
+
+from attrdict import AttrDict
+
+from .collector import EncodeMessage, EncodeString, RecvMessage, \
+    FrameEncoder, FrameDecoder, COUNT, DEF_ID, FLAG_ALERTING, FLAG_OWN, \
+    FRAME_HEAD, MSG_HELLO, MSG_DEFS, NAN, STRLEN
+from .columns import GetColumnsMetaForVersion
+from .compiler import NORMALIZE_CHANGE
+from .pressure import PressureHistory
+from .regression import Change
+
+#
+# Besides the collector's HELLO and DEFS, the UI and the worker exchange:
+#
+#   POLL     UI -> worker: poll now and send the frame. The worker answers
+#            with a STATUS, a HELLO if the columns changed, DEFS for the
+#            activities whose text columns are new or changed, and CHANGES.
+#   COMMAND  UI -> worker: the name of a DatabasePoller method to call, e.g.
+#            add_mark. There is no answer; the next frame shows the effect.
+#   STATUS   worker -> UI: the poller's status line, utf-8.
+#   CHANGES  worker -> UI: like the collector's FRAME, but only with the
+#            rows that changed since the last one. Each row is followed by
+#            the note of each change column (see regression.Change) as a u16
+#            length prefixed utf-8 string. Then u32 count and the u32 ids of
+#            the rows that went away.
+#
+MSG_POLL = b"P"
+MSG_COMMAND = b"C"
+MSG_STATUS = b"S"
+MSG_CHANGES = b"U"
+
+COMMANDS = frozenset(["add_mark", "cycle_baseline", "toggle_grouping",
+                      "cycle_columns"])
+
+
+def EncodeHello(column_meta, encoder):
+    return EncodeMessage(MSG_HELLO, json.dumps({
+        "version": str(column_meta.minimum_version),
+        "columns": list(column_meta.columns.keys()),
+        "numeric": sorted(encoder.numeric),
+        "notes": encoder.notes,
+    }).encode("utf-8"))
+
+
+class ChangesEncoder(FrameEncoder):
+    """
+    Encodes the poller's frames as CHANGES: only the rows whose values,
+    flags or notes differ from the last frame are sent. Text columns are
+    sent again whenever they change, e.g. the count of the heavy hitters'
+    "other" row. Ids are dropped with their rows and never reused.
+    """
+    def __init__(self, column_meta):
+        super(ChangesEncoder, self).__init__(column_meta)
+        self.notes = [n for n in self.numeric
+                      if column_meta.columns[n].normalize == NORMALIZE_CHANGE]
+        self.next_id = 0
+        # The encoded row last sent for each id.
+        self.sent = {}
+
+    def encode_changes(self, diff_plancache, cpu, mem, alerting,
+                       own=frozenset(), pressure=None):
+        ids = self.ids
+        defs = self.defs
+        sent = self.sent
+        pack = self.row.pack
+        new_ids = []
+        rows = []
+        seen = {}
+        for key, ent in diff_plancache.items():
+            i = ids.get(key)
+            if i is None:
+                i = ids[key] = self.next_id
+                self.next_id += 1
+            text = b"".join(EncodeString(ent[n]) for n in self.text)
+            if defs.get(i) != text:
+                defs[i] = text
+                new_ids.append(i)
+                sent.pop(i, None)
+
+            values = [ent[n] for n in self.numeric]
+            flags = (FLAG_ALERTING if key in alerting else 0) | \
+                (FLAG_OWN if key in own else 0)
+            row = pack(i, flags, *[NAN if v is None else v for v in values])
+            if self.notes:
+                row += b"".join(EncodeString(getattr(ent[n], "text", None))
+                                for n in self.notes)
+            if sent.get(i) != row:
+                rows.append(row)
+            seen[i] = row
+
+        removed = [i for i in sent if i not in seen]
+        for key in [k for k, i in ids.items() if i not in seen]:
+            del defs[ids.pop(key)]
+        self.sent = seen
+
+        out = []
+        if new_ids:
+            out.append(self.encode_defs(new_ids))
+        wait, faults = pressure or (NAN, NAN)
+        out.append(EncodeMessage(MSG_CHANGES, b"".join(
+            [FRAME_HEAD.pack(cpu, mem, wait, faults, len(rows))] + rows +
+            [COUNT.pack(len(removed))] +
+            [DEF_ID.pack(i) for i in removed])))
+        return b"".join(out)
+
+
+class ChangesDecoder(FrameDecoder):
+    """
+    Keeps the rows of a CHANGES stream up to date.
+    """
+    def __init__(self, hello):
+        super(ChangesDecoder, self).__init__(hello)
+        self.notes = set(hello["notes"])
+        self.rows = {}
+        self.alerting = set()
+        self.own = set()
+        self.cpu = self.mem = 0
+
+    def decode_changes(self, payload):
+        """
+        Applies a CHANGES message. Returns the rows that were added or
+        changed, by id, and the ids of the rows that went away.
+        """
+        cpu, mem, wait, faults, count = FRAME_HEAD.unpack_from(payload, 0)
+        offset = FRAME_HEAD.size
+        changed = {}
+        unpack = self.row.unpack_from
+        for _ in range(count):
+            row = unpack(payload, offset)
+            offset += self.row.size
+            i, flags = row[0], row[1]
+            ent = AttrDict(zip(self.text, self.defs[i]))
+            for n, v in zip(self.numeric, row[2:]):
+                ent[n] = None if v != v else v
+            for n in self.numeric:
+                if n not in self.notes:
+                    continue
+                length, = STRLEN.unpack_from(payload, offset)
+                offset += STRLEN.size
+                note = payload[offset:offset + length].decode("utf-8",
+                                                             "replace")
+                offset += length
+                if ent[n] is not None:
+                    ent[n] = Change(ent[n], note)
+            changed[i] = self.rows[i] = ent
+            for flag, ids in ((FLAG_ALERTING, self.alerting),
+                              (FLAG_OWN, self.own)):
+                if flags & flag:
+                    ids.add(i)
+                else:
+                    ids.discard(i)
+
+        count, = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        removed = set()
+        for _ in range(count):
+            i, = DEF_ID.unpack_from(payload, offset)
+            offset += DEF_ID.size
+            removed.add(i)
+            self.rows.pop(i, None)
+            self.defs.pop(i, None)
+            self.alerting.discard(i)
+            self.own.discard(i)
+
+        self.cpu, self.mem = cpu, mem
+        self.pressure = None if wait != wait else (wait, faults)
+        return changed, removed
+
+
+def RunWorker(args, sock):
+    """
+    The worker process: owns the DatabasePoller and does all the querying,
+    diffing and normalization, and sends the UI finished frames. A poll or
+    command that fails is reported in the next STATUS instead of ending the
+    process, and polling goes on as usual.
+    """
+    from .main import ConnectOrExit, BuildDatabasePoller
+
+    conn = ConnectOrExit(args)
+    column_meta, dbpoller = BuildDatabasePoller(args, conn)
+    encoder = ChangesEncoder(column_meta)
+    sock.sendall(EncodeHello(column_meta, encoder))
+
+    error = None
+    failing = False
+    # How many pressure ticks have been sent (see PressureHistory).
+    pressure_sent = 0
+    while True:
+        try:
+            kind, payload = RecvMessage(sock)
+        except (socket.error, EOFError):
+            # The UI exited.
+            return
+        if kind == MSG_COMMAND:
+            name = payload.decode("utf-8")
+            if name in COMMANDS:
+                try:
+                    getattr(dbpoller, name)()
+                except Exception as e:
+                    logging.warn("Worker command %s failed: %s" % (name, e))
+                    error = "%s failed: %s" % (name, e)
+            continue
+        if kind != MSG_POLL:
+            continue
+
+        try:
+            dbpoller.poll()
+        except Exception as e:
+            # Only log when polling starts failing, not on every retry.
+            if not failing:
+                logging.warn("Failed to poll activities: %s" % e)
+            failing = True
+            error = "Activities failed: %s" % e
+        else:
+            failing = False
+        status, error = error or dbpoller.status(), None
+        out = [EncodeMessage(MSG_STATUS, status.encode("utf-8"))]
+        if dbpoller.column_meta is not column_meta:
+            column_meta = dbpoller.column_meta
+            encoder = ChangesEncoder(column_meta)
+            out.append(EncodeHello(column_meta, encoder))
+        # A poll that added no pressure tick sends NaNs, so the UI doesn't
+        # count the last tick twice.
+        pressure_sent, pressure = dbpoller.pressure.last_since(pressure_sent)
+        out.append(encoder.encode_changes(*dbpoller.get_database_data(),
+                                          own=dbpoller.own_keys,
+                                          pressure=pressure))
+        sock.sendall(b"".join(out))
+
+
+class WorkerPoller(object):
+    """
+    Runs the activities DatabasePoller in a separate process, so that
+    querying and diffing a large cluster does not hold the UI process's GIL.
+    It has the same interface as DatabasePoller, plus take_changes (see
+    IncrementalPoller): each poll() asks the worker to poll and decodes the
+    rows that changed, which only costs the UI process a struct unpack per
+    changed row.
+
+    The process is started right away, so that it connects to the cluster
+    while the UI does; wait_ready() waits for it to describe the columns.
+
+    There are no latency sketches on this side, so there is no databases
+    view.
+    """
+    def __init__(self, args):
+        self.sock, worker_sock = socket.socketpair()
+        self.process = multiprocessing.Process(
+            target=RunWorker, args=(args, worker_sock), name="memsql-top worker")
+        self.process.daemon = True
+        self.process.start()
+        worker_sock.close()
+
+        self.sketches = None
+        self.own_keys = frozenset()
+        self.pressure = PressureHistory()
+        self.status_text = ""
+        self.send_lock = threading.Lock()
+        self.alive = True
+
+        # Changes the UI has not seen yet, guarded by lock.
+        self.lock = threading.Lock()
+        self.changed = {}
+        self.removed = set()
+
+    def wait_ready(self):
+        try:
+            kind, payload = RecvMessage(self.sock)
+        except (socket.error, EOFError):
+            # The worker already said why, e.g. it could not connect.
+            sys.exit(1)
+        assert kind == MSG_HELLO
+        hello = json.loads(payload.decode("utf-8"))
+        self.all_columns = GetColumnsMetaForVersion(hello["version"])
+        self.set_hello(hello)
+
+    def set_hello(self, hello):
+        with self.lock:
+            # The rows of the new columns all come in the next frame.
+            self.decoder = ChangesDecoder(hello)
+            self.changed = {}
+            self.removed = set()
+        self.column_meta = self.all_columns.Project(",".join(hello["columns"]))
+
+    def get_database_data(self):
+        with self.lock:
+            decoder = self.decoder
+            return (dict(decoder.rows), decoder.cpu, decoder.mem,
+                    frozenset(decoder.alerting))
+
+    def take_changes(self):
+        """
+        Returns the rows that were added or changed and the ids that were
+        removed since the last call, and the ids of the alerting rows and of
+        our own.
+        """
+        with self.lock:
+            changed, removed = self.changed, self.removed
+            self.changed = {}
+            self.removed = set()
+            return (changed, removed, frozenset(self.decoder.alerting),
+                    frozenset(self.decoder.own))
+
+    def status(self):
+        return self.status_text
+
+    def send(self, kind, payload=b""):
+        with self.send_lock:
+            self.sock.sendall(EncodeMessage(kind, payload))
+
+    def poll(self):
+        if not self.alive:
+            return
+        try:
+            self.send(MSG_POLL)
+            while True:
+                kind, payload = RecvMessage(self.sock)
+                if kind == MSG_STATUS:
+                    self.status_text = payload.decode("utf-8")
+                elif kind == MSG_HELLO:
+                    self.set_hello(json.loads(payload.decode("utf-8")))
+                elif kind == MSG_DEFS:
+                    with self.lock:
+                        self.decoder.decode(kind, payload)
+                elif kind == MSG_CHANGES:
+                    with self.lock:
+                        changed, removed = \
+                            self.decoder.decode_changes(payload)
+                        for i in removed:
+                            self.changed.pop(i, None)
+                        self.removed.update(removed)
+                        self.removed.difference_update(changed)
+                        self.changed.update(changed)
+                        self.own_keys = frozenset(self.decoder.own)
+                        pressure = self.decoder.pressure
+                    if pressure is not None:
+                        self.pressure.add(*pressure)
+                    return
+        except (socket.error, EOFError) as e:
+            logging.warn("Lost the worker process: %s" % e)
+            self.alive = False
+            self.status_text = "Worker process exited"
+
+    def command(self, name):
+        if self.alive:
+            self.send(MSG_COMMAND, name.encode("utf-8"))
+        return None
+
+    def add_mark(self):
+        return self.command("add_mark")
+
+    def cycle_baseline(self):
+        return self.command("cycle_baseline")
+
+    def toggle_grouping(self):
+        return self.command("toggle_grouping")
+
+    def cycle_columns(self):
+        return self.command("cycle_columns")
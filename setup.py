@@ -15,16 +15,24 @@
 # limitations under the License.
 #
 
+import re
+
 from setuptools import setup, find_packages
 
 def readme():
     with open('README.md') as f:
         return f.read()
 
+def version():
+    # Read the version without importing the package, so that the package
+    # can keep it as a plain constant (see memsql_top.__version__).
+    with open('memsql_top/__init__.py') as f:
+        return re.search(r"^__version__ = '([^']+)'", f.read(), re.M).group(1)
+
 
 setup(
     name='memsql-top',
-    version='0.0.11',
+    version=version(),
     description='A tool for visualing top queries run against memsql',
     long_description=readme(),
     author='Alex Reece',
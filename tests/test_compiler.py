@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import random
+import unittest
+from decimal import Decimal
+
+try:
+    from memsql_top.columns import GetColumnsMetaForVersion
+except ImportError:
+    GetColumnsMetaForVersion = None
+
+#
+# The columns DiffSnapshot and NormalizeCounterDelta handled before they
+# were generated from the columns' metadata, and the raw column each one
+# was read from.
+#
+REFERENCE_COLUMNS = {
+    "5.7": {
+        "Database": "database_name",
+        "Query": "query_text",
+        "Executions/sec": "commits",
+        "RowCount/sec": "rowcount",
+        "CpuUtil": "cpu_time",
+        "Memory/query": "memory_use",
+        "ExecutionTime/query": "execution_time",
+        "QueuedTime/query": "queued_time",
+    },
+    "5.8": {
+        "Type": "activity_type",
+        "Database": "database_name",
+        "Name": "activity_name",
+        "Cpu/s": "cpu_time_ms",
+        "Mem/s": "memory_bs",
+        "Disk/s": "disk_b",
+        "Net/s": "network_b",
+        "Pf/s": "memory_major_faults",
+        "Lat/q": "elapsed_time_ms",
+        "Cpu/q": "cpu_time_ms",
+        "CpuW/q": "cpu_wait_time_ms",
+        "LockW/q": "lock_time_ms",
+        "DiskW/q": "disk_time_ms",
+        "NetW/q": "network_time_ms",
+        "Run": "run_count",
+        "Done/s": "success_count + failure_count",
+    },
+}
+
+TEXT_COLUMNS = set(["query_text", "database_name", "activity_type",
+                    "activity_name"])
+
+
+def ReferenceDiffSnapshot(a, b):
+    ret = {}
+    for k in a:
+        if isinstance(a[k], (int, Decimal)) and k != "run_count" and \
+                b[k] is not None:
+            ret[k] = int(a[k] - b[k]) if a[k] >= b[k] else 0
+        else:
+            ret[k] = a[k]
+    return ret
+
+
+def ReferenceNormalize57(snapshot, interval):
+    ret = ReferenceValues("5.7", snapshot)
+    ret['Executions/sec'] = ret['Executions/sec'] / interval
+    ret['RowCount/sec'] = ret['RowCount/sec'] / interval
+    ret['CpuUtil'] = ret['CpuUtil'] / 1000.0 / interval
+    commits = float(snapshot['commits'])
+    ret['ExecutionTime/query'] = ret['ExecutionTime/query'] / commits
+    ret['Memory/query'] = ret['Memory/query'] / commits
+    ret['QueuedTime/query'] = ret['QueuedTime/query'] / commits
+    return ret
+
+
+def ReferenceNormalize58(snapshot, interval):
+    ret = ReferenceValues("5.8", snapshot)
+
+    def od(v, d):
+        return v / d if v is not None else v
+
+    commits = float(snapshot['run_count'] +
+                    snapshot['success_count + failure_count'])
+    ret['Cpu/s'] = od(od(ret['Cpu/s'], 1000.0), interval)
+    for name in ('Disk/s', 'Mem/s', 'Pf/s', 'Net/s', 'Done/s'):
+        ret[name] = od(ret[name], interval)
+    for name in ('Lat/q', 'Cpu/q', 'CpuW/q', 'LockW/q', 'DiskW/q', 'NetW/q'):
+        ret[name] = od(ret[name], commits)
+    return ret
+
+
+def ReferenceValues(version, snapshot):
+    ret = {}
+    for name, raw in REFERENCE_COLUMNS[version].items():
+        value = snapshot[raw]
+        if isinstance(value, (int, Decimal)):
+            value = float(value)
+        ret[name] = value
+    return ret
+
+
+def RandomCounter(rng, low):
+    value = rng.randint(low, 10 ** 9)
+    return Decimal(value) if rng.random() < 0.5 else value
+
+
+def RandomSnapshots(rng, version, nullable):
+    """
+    Returns an (old, new) pair of raw rows for one activity. Counters mostly
+    grow but sometimes go backwards, and the executions always grow so the
+    old code never divides by zero.
+    """
+    old, new = {}, {}
+    for raw in set(REFERENCE_COLUMNS[version].values()):
+        if raw in TEXT_COLUMNS:
+            old[raw] = new[raw] = "text %d" % rng.randint(0, 3)
+            continue
+        old[raw] = RandomCounter(rng, 0)
+        if raw in ("commits", "success_count + failure_count"):
+            new[raw] = old[raw] + rng.randint(1, 1000)
+        elif rng.random() < 0.1:
+            new[raw] = old[raw] - rng.randint(1, 1000)
+        else:
+            new[raw] = old[raw] + rng.randint(0, 10 ** 6)
+        if raw in nullable and rng.random() < 0.2:
+            if rng.random() < 0.5:
+                old[raw] = None
+            else:
+                new[raw] = None
+    return old, new
+
+
+@unittest.skipIf(GetColumnsMetaForVersion is None,
+                 "the column dependencies are not installed")
+class TestGeneratedCounterCode(unittest.TestCase):
+    def check(self, version, reference, nullable=()):
+        meta = GetColumnsMetaForVersion(version)
+        rng = random.Random(version)
+        for _ in range(2000):
+            old, new = RandomSnapshots(rng, version, nullable)
+            interval = rng.choice([0.5, 1.0, 3.0, 7.25])
+
+            delta = meta.DiffCounters(new, old)
+            expected_delta = ReferenceDiffSnapshot(new, old)
+            for raw, value in expected_delta.items():
+                self.assertEqual(delta[raw], value, raw)
+
+            got = meta.NormalizeCounterDelta(delta, interval)
+            expected = reference(expected_delta, interval)
+            for name, value in expected.items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(got[name], value,
+                                           delta=abs(value) * 1e-9, msg=name)
+                else:
+                    self.assertEqual(got[name], value, name)
+
+    def test_57_matches_reference(self):
+        self.check("5.7", ReferenceNormalize57)
+
+    def test_58_matches_reference(self):
+        nullable = set(REFERENCE_COLUMNS["5.8"].values()) - TEXT_COLUMNS - \
+            set(["run_count", "success_count + failure_count"])
+        self.check("5.8", ReferenceNormalize58, nullable)
+
+    def test_no_executions_gives_no_per_query_values(self):
+        meta = GetColumnsMetaForVersion("5.8")
+        _, new = RandomSnapshots(random.Random(0), "5.8", ())
+        new["run_count"] = 0
+        new["success_count + failure_count"] = 0
+        got = meta.NormalizeCounterDelta(new, 1.0)
+        self.assertIsNone(got["Lat/q"])
+        self.assertEqual(got["Done/s"], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from memsql_top.humanize import FingerprintQuery
+
+
+class TestFingerprintQuery(unittest.TestCase):
+    def assertSameShape(self, a, b):
+        self.assertEqual(FingerprintQuery(a), FingerprintQuery(b))
+
+    def test_literals(self):
+        self.assertEqual(
+            FingerprintQuery("SELECT * FROM t WHERE a = 'x' AND b = 1.5e3"),
+            "select * from t where a = ? and b = ?")
+
+    def test_comments_whitespace_and_case(self):
+        self.assertSameShape("select a\n  from t -- why\n where b = 1",
+                             "SELECT /* hint */ a FROM t WHERE b = 2")
+
+    def test_lists(self):
+        self.assertEqual(FingerprintQuery("select * from t where a in (1)"),
+                         "select * from t where a in (?+)")
+        self.assertSameShape("select * from t where a in (1, 2, 3)",
+                             "select * from t where a in ('x')")
+        self.assertSameShape("insert into t values (1, 'a'), (2, 'b')",
+                             "insert into t values (3, 'c')")
+
+    def test_signs(self):
+        self.assertSameShape("select * from t where a = -1",
+                             "select * from t where a = 1")
+        self.assertSameShape("select * from t where a in (-1, +2)",
+                             "select * from t where a in (3)")
+        self.assertSameShape("select -1", "select 1")
+        self.assertSameShape("select 1 - -2", "select 1 - 2")
+
+    def test_binary_minus(self):
+        self.assertEqual(FingerprintQuery("select a-1, b -1 from t"),
+                         "select a - ?, b - ? from t")
+        self.assertEqual(FingerprintQuery("select (a) - 1"),
+                         "select (a) - ?")
+
+    def test_strings_are_opaque(self):
+        self.assertSameShape("select 'a -- b' from t",
+                             "select 'it''s' from t")
+
+
+if __name__ == '__main__':
+    unittest.main()
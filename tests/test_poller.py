@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import argparse
+import unittest
+
+try:
+    from attrdict import AttrDict
+    from memsql_top import DatabasePoller as poller_module
+    from memsql_top.columns import GetColumnsMetaForVersion
+    from memsql_top.compiler import RawColumns
+except ImportError:
+    poller_module = None
+
+ARGS = dict(host="127.0.0.1", port=3306, password="", user="root",
+            columns="all", update_interval=1.0, show_self=False,
+            max_memory_mb=None)
+
+
+class FakeConnection(object):
+    """
+    Answers the queries DatabasePoller makes of a 5.8 cluster with a fixed
+    set of activities whose counters grow by one on every poll.
+    """
+    def __init__(self, names):
+        self.names = names
+        self.raw = RawColumns(GetColumnsMetaForVersion("5.8").fetched)[0]
+        self.polls = 0
+
+    def query_stream(self, query):
+        self.polls += 1
+        for name in self.names:
+            row = AttrDict((n, self.polls) for n in self.raw)
+            row.activity_type = "Query"
+            row.database_name = "db"
+            row.activity_name = name
+            yield row
+
+    def query(self, query):
+        # Query texts, for grouping by shape.
+        return iter([AttrDict(n=name, q="select * from t where a = %d" % i)
+                     for i, name in enumerate(self.names)])
+
+    def query_rows(self, query):
+        # Our own activities.
+        return []
+
+    def get(self, query):
+        return AttrDict(m=1.0)
+
+
+@unittest.skipIf(poller_module is None,
+                 "the poller dependencies are not installed")
+class TestDatabasePoller(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeConnection(["a1", "a2"])
+        self.connect = poller_module.connect
+        poller_module.connect = lambda **kwargs: self.conn
+        self.poller = poller_module.DatabasePoller(
+            argparse.Namespace(**ARGS), GetColumnsMetaForVersion("5.8"))
+
+    def tearDown(self):
+        poller_module.connect = self.connect
+
+    def test_poll_after_cycling_columns(self):
+        poller = self.poller
+        poller.poll()
+        poller.poll()
+        poller.cycle_columns()
+        # The own activities are due to be looked up again.
+        poller.own_keys_time -= poller_module.OWN_KEYS_INTERVAL
+        poller.poll()
+        poller.poll()
+        self.assertEqual(len(poller.get_database_data()[0]), 2)
+
+    def test_group_against_mark(self):
+        poller = self.poller
+        poller.poll()
+        poller.poll()
+        poller.add_mark()
+        poller.poll()
+        poller.cycle_baseline()
+        poller.toggle_grouping()
+        poller.poll()
+        # Both activities have the same shape.
+        plancache = poller.get_database_data()[0]
+        self.assertEqual(len(plancache), 1)
+        ent, = plancache.values()
+        self.assertEqual(ent.Name, "select * from t where a = ?")
+
+
+if __name__ == '__main__':
+    unittest.main()
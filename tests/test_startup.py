@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 by MemSQL. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#
+# Runs memsql_top.main as `python -m memsql_top.main ARGS` would and prints
+# which of the heavy modules were imported by the time it exited.
+#
+PROBE = """
+import runpy, sys
+sys.argv = ["memsql-top"] + sys.argv[1:]
+try:
+    runpy.run_module("memsql_top.main", run_name="__main__", alter_sys=True)
+except SystemExit:
+    pass
+sys.stdout.flush()
+sys.stderr.write(" ".join(sorted(
+    m for m in ("urwid", "pymysql", "attrdict", "curses") if m in sys.modules)))
+"""
+
+
+def ImportedHeavyModules(*args):
+    p = subprocess.Popen([sys.executable, "-c", PROBE] + list(args),
+                         cwd=ROOT, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    return out.decode("utf-8"), err.decode("utf-8").split()
+
+
+class StartupImportsTest(unittest.TestCase):
+    def test_version_is_cheap(self):
+        out, heavy = ImportedHeavyModules("--version")
+        self.assertTrue(out.strip())
+        self.assertEqual(heavy, [])
+
+    def test_help_is_cheap(self):
+        out, heavy = ImportedHeavyModules("--help")
+        self.assertIn("--update-interval", out)
+        self.assertEqual(heavy, [])
+
+
+if __name__ == "__main__":
+    unittest.main()